@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+import_time is a regression check on the start up cost of the pyAVO2 entry points.
+Each module is imported in a fresh interpreter with 'python -X importtime' and the
+report is checked for heavy packages (plotting, mapping, shapefile and database backends)
+that should only be loaded when the corresponding feature is enabled.
+
+Usage:
+    python benchmarks/import_time.py [max_milliseconds]
+
+Exits with a non-zero status if a heavy package is imported by an entry point,
+or if an entry point takes longer than max_milliseconds to import.
+"""
+import os, re, subprocess, sys
+
+# Entry point modules and the packages that must not be loaded when importing them
+ENTRY_POINTS = ['pyAVO2.process_data', 'pyAVO2.merge_out_data', 'pyAVO2.filter',
+                        'pyAVO2.triwave_correct', 'pyAVO2.subsample']
+HEAVY_PACKAGES = ['cartopy', 'matplotlib', 'shapefile', 'geopy', 'cx_Oracle', 
+                            'astral', 'shapely', 'scipy', 'pandas', 'echolab2.plotting']
+
+IMPORT_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+def import_report(module):
+    '''
+    Method to import a module in a new interpreter and parse the -X importtime report
+    
+    :returns cumulative import time of the module (us) and list of all modules imported
+    '''
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import '+module], 
+                                    cwd=repo_dir, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError('Could not import {}:\n{}'.format(module, result.stderr))
+    imported = []
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            imported.append(match.group(4))
+            if match.group(4) == module:
+                total = int(match.group(2))
+    
+    return total, imported
+
+def check_entry_points(max_ms=None):
+    '''
+    Method to check all entry points, printing a line per module
+    
+    :returns list of failure messages, empty if all entry points pass
+    '''
+    failures = []
+    for module in ENTRY_POINTS:
+        total, imported = import_report(module)
+        heavy = sorted(set(p for p in HEAVY_PACKAGES for m in imported if m == p or m.startswith(p+'.')))
+        print('{:<30} {:>10.1f} ms   heavy imports: {}'.format(module, total/1000, ', '.join(heavy) or 'none'))
+        if heavy:
+            failures.append('{} imports {}'.format(module, ', '.join(heavy)))
+        if max_ms is not None and total/1000 > max_ms:
+            failures.append('{} took {:.1f} ms to import, more than {} ms'.format(module, total/1000, max_ms))
+    
+    return failures
+
+if __name__ == '__main__':
+    max_ms = float(sys.argv[1]) if len(sys.argv) > 1 else None
+    failures = check_entry_points(max_ms)
+    for f in failures:
+        print('FAIL: '+f)
+    sys.exit(1 if failures else 0)
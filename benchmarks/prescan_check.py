@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+prescan_check is a regression check of the prescan of Process (raw_scan.scan_raw) against a full read.
+A synthetic group is written with synthetic_raw, and a few sample datagrams of the second channel are
+removed so that the pings of the channels must be aligned.  The group is placed outside the region of
+the latlon_limit filter, so every ping is removed and the prescan path writes the reports of the group.
+
+The scan is checked on its own first: it must keep only the primary pings found in every channel.
+If echolab2 is installed, the group is then processed twice, with and without the prescan, and the
+subsample and filter reports of both runs must be identical.  The triwave report is not compared,
+since triwave correction is not done for a group rejected by the prescan.
+
+Usage:
+    python benchmarks/prescan_check.py [EK60|EK80] [pings_per_file] [work_path]
+
+Exits with a non-zero status if the scan or any report differs.
+"""
+import os, sys, struct, filecmp, logging, tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_raw
+from pyAVO2 import raw_scan
+
+SS_PARAMS = {'percent': 50, 'chunk_size': 50, 'chunk_start': 1, 'iterations': 2}
+TRIWAVE_PARAMS = {'start_sample': 0, 'end_sample': 2}
+PR_PARAMS = {'statistic_interval': 50, 'threshold_to_remove': 15}
+# Corners (latitude, longitude) of a region away from the synthetic track
+REGION = [(40.0, -130.0), (45.0, -130.0), (45.0, -125.0), (40.0, -125.0), (40.0, -130.0)]
+
+def drop_samples(file_name, channel_number, pings):
+    '''
+    Method to remove the sample datagrams (RAW0 or RAW3) of a channel for some pings of a raw file
+
+    :param channel_number: number of the channel (starting at 1) in the order of the configuration
+    :type channel_number: int
+
+    :param pings: ping numbers (starting at 0) in the file to remove
+    :type pings: list(int)
+
+    :returns times: times of the pings removed
+    :type times: list(datetime64)
+    '''
+    channel_id = synthetic_raw.ek80_channel_id(synthetic_raw.FREQUENCIES[channel_number-1]).encode()
+    with open(file_name, 'rb') as f:
+        contents = f.read()
+    kept = []
+    times = []
+    ping = 0
+    position = 0
+    while position < len(contents):
+        length, dgram_type, low, high = raw_scan.DATAGRAM_HEADER.unpack_from(contents, position)
+        body = contents[position+4+12:position+4+length]
+        if dgram_type == b'RAW0':
+            match = struct.unpack_from('<h', body)[0] == channel_number
+        elif dgram_type == b'RAW3':
+            match = body[:128].rstrip(b'\x00') == channel_id
+        else:
+            match = False
+        if match:
+            if ping in pings:
+                times.append(raw_scan.nt_to_datetime64(low, high))
+                position += length+8
+                ping += 1
+                continue
+            ping += 1
+        kept.append(contents[position:position+length+8])
+        position += length+8
+    with open(file_name, 'wb') as f:
+        f.write(b''.join(kept))
+
+    return times
+
+def check_scan(raw_files, n_pings, dropped_times):
+    '''
+    Method to check that the scan keeps the pings of the primary channel found in every channel
+
+    :returns failures: description of each difference
+    :type failures: list(str)
+    '''
+    scan = raw_scan.scan_raw(raw_files, synthetic_raw.FREQUENCIES[0])
+    failures = []
+    if scan is None:
+        return ['scan failed']
+    if scan.n_pings != n_pings-len(dropped_times):
+        failures.append('scan has {} pings, expected {}'.format(scan.n_pings, n_pings-len(dropped_times)))
+    if np.any(np.isin(scan.ping_time, np.array(dropped_times, dtype='datetime64[ms]'))):
+        failures.append('scan kept pings that are not in all channels')
+    if len(scan.configuration) != scan.n_pings:
+        failures.append('scan has {} configurations for {} pings'.format(len(scan.configuration), scan.n_pings))
+    elif scan.n_pings > 0 and scan.configuration[-1]['end_ping'] != scan.n_pings:
+        failures.append('end ping of the last file is {}, expected {}'.format(scan.configuration[-1]['end_ping'], scan.n_pings))
+    # Report rows use the ping times, which echolab2 reads to the millisecond
+    if scan.ping_time.dtype != np.dtype('datetime64[ms]'):
+        failures.append('scan ping times are {}, expected datetime64[ms]'.format(scan.ping_time.dtype))
+
+    return failures
+
+def report_files(output_path):
+    '''
+    Method to find the subsample and filter reports under an output folder, by path relative to it
+    '''
+    reports = {}
+    for folder, dirs, files in os.walk(output_path):
+        for name in files:
+            if 'subsample_report' in name or 'filter_report' in name:
+                path = os.path.join(folder, name)
+                reports[os.path.relpath(path, output_path)] = path
+
+    return reports
+
+def check_reports(raw_files, out_files, instrument, work_path):
+    '''
+    Method to process the group with and without the prescan and compare the reports
+
+    :returns failures: description of each difference
+    :type failures: list(str)
+    '''
+    from pyAVO2.process_data import Process
+
+    region_file = os.path.join(work_path, 'region.csv')
+    with open(region_file, 'w') as f:
+        f.write('latitude,longitude\n'+''.join('{},{}\n'.format(*corner) for corner in REGION))
+    filter_params = {'speed_limit': 4, 'latlon_limit': [region_file, 'in']}
+    reports = {}
+    for prescan in (True, False):
+        output_path = os.path.join(work_path, 'prescan' if prescan else 'full')+os.sep
+        os.makedirs(output_path, exist_ok=True)
+        processor = Process(instrument, synthetic_raw.FREQUENCIES[0], output_path, 1, False, False, False, {},
+                                    PR_PARAMS.copy(), SS_PARAMS.copy(), TRIWAVE_PARAMS.copy(), dict(filter_params), {},
+                                    prescan=prescan)
+        try:
+            processor.process(raw_files, '-unit2file.raw', last_one=True, out_list=out_files)
+        finally:
+            processor.close()
+        reports[prescan] = report_files(output_path)
+    failures = []
+    if not reports[True]:
+        failures.append('no reports were written')
+    for name in sorted(set(reports[True]) | set(reports[False])):
+        if name not in reports[True] or name not in reports[False]:
+            failures.append('{} was only written {} the prescan'.format(name, 'with' if name in reports[True] else 'without'))
+        elif not filecmp.cmp(reports[True][name], reports[False][name], shallow=False):
+            failures.append('{} differs'.format(name))
+
+    return failures
+
+def check(instrument='EK60', pings_per_file=200, work_path=None):
+    '''
+    Method to write the synthetic group and run the checks
+
+    :returns failures: description of each difference
+    :type failures: list(str)
+    '''
+    work_path = work_path or tempfile.mkdtemp(prefix='pyavo_prescan_')
+    logging.basicConfig(filename=os.path.join(work_path, 'prescan_check.log'), level=logging.INFO)
+    raw_files, out_files = synthetic_raw.write_files(os.path.join(work_path, 'input'), n_files=2, pings_per_file=pings_per_file,
+                                                                        n_channels=2, instrument=instrument)
+    dropped_times = drop_samples(raw_files[0], 2, [5, 6, pings_per_file-1])
+    failures = check_scan(raw_files, 2*pings_per_file, dropped_times)
+    try:
+        import echolab2
+    except ImportError:
+        print('echolab2 is not installed, only the scan was checked')
+    else:
+        failures += check_reports(raw_files, out_files, instrument, work_path)
+    print('{} check: {} failed'.format(instrument, len(failures)))
+
+    return failures
+
+if __name__ == '__main__':
+    instrument = sys.argv[1] if len(sys.argv) > 1 else 'EK60'
+    pings_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    work_path = sys.argv[3] if len(sys.argv) > 3 else None
+    failures = check(instrument, pings_per_file, work_path)
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
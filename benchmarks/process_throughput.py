@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+process_throughput is an end to end benchmark of the preprocessing pipeline on synthetic data.
+Synthetic raw and out files are written with synthetic_raw, then processed with Process.process
+using parameters like a survey run (subsampling, triwave correction, speed, region, ringdown
+and bottom filters), and the out files of each group are merged with Merge.merge.
+
+The report is printed as JSON for regression tracking, with the number of pings processed,
+pings per second, wall time for each stage and the peak resident memory of the run.
+Stage times are the group records written by the timer of Process (logs/stage_times.jsonl),
+which Merge shares.
+
+Usage:
+    python benchmarks/process_throughput.py [n_files] [pings_per_file] [n_channels] [EK60|EK80] [report.json]
+"""
+import os, sys, json, time, tempfile, collections, logging
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_raw
+
+SS_PARAMS = {'percent': 50, 'chunk_size': 50, 'chunk_start': 1, 'iterations': 2}
+TRIWAVE_PARAMS = {'start_sample': 0, 'end_sample': 2}
+PR_PARAMS = {'statistic_interval': 50, 'threshold_to_remove': 15}
+FILTER_PARAMS = {'speed_limit': 4,
+                        'ringdown': [61, 0.1, 0, 1],
+                        'bottom': ['fixed', 15, 9999, 0, 2, -40, True]}
+# Corners (latitude, longitude) of the region kept by the latlon_limit filter
+REGION = [(54.0, -180.0), (63.0, -180.0), (63.0, -155.0), (54.0, -155.0), (54.0, -180.0)]
+
+def peak_rss_mb():
+    '''
+    Method to get the peak resident memory (MB) of this process and its finished children
+    '''
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset/2**20
+        except (ImportError, AttributeError):
+            return None
+    # ru_maxrss is in bytes on macOS and kB elsewhere
+    scale = 1 if sys.platform == 'darwin' else 1024
+    usage = [resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return {'self': usage[0]*scale/2**20, 'children': usage[1]*scale/2**20}
+
+def stage_report(records):
+    '''
+    Method to sum the stage times and calls of the group records written by the Process timer
+
+    :param records: group records from stage_times.jsonl
+    :type records: list(dict)
+
+    :returns report: seconds and calls of each stage, and seconds of the groups of each kind (process or merge)
+    :type report: dict
+    '''
+    stages = collections.defaultdict(lambda: {'seconds': 0.0, 'calls': 0})
+    groups = collections.defaultdict(float)
+    for record in records:
+        groups[record['kind']] += record['seconds']
+        for stage, seconds in record['stages'].items():
+            stages[stage]['seconds'] += seconds
+            stages[stage]['calls'] += record['calls'].get(stage, 0)
+    return {'stages': {stage: {'seconds': round(v['seconds'], 4), 'calls': v['calls']} for stage, v in stages.items()},
+                'groups': {kind: round(seconds, 4) for kind, seconds in groups.items()}}
+
+def run(n_files=4, pings_per_file=3000, n_channels=2, instrument='EK60', work_path=None, make_echogram=False):
+    '''
+    Method to write synthetic data, process it and return the report
+
+    :optional param instrument: 'EK60' or 'EK80', for the synthetic files and the processing
+    :optional type instrument: str
+
+    :returns report: sizes, pings per second, stage times and peak memory
+    :type report: dict
+    '''
+    from pyAVO2.process_data import Process
+    from pyAVO2.merge_out_data import Merge
+    from pyAVO2.file_planner import plan_groups
+
+    work_path = work_path or tempfile.mkdtemp(prefix='pyavo_benchmark_')
+    input_path = os.path.join(work_path, 'input')
+    output_path = os.path.join(work_path, 'output')+os.sep
+    os.makedirs(output_path, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(work_path, 'benchmark.log'), level=logging.INFO)
+
+    start = time.perf_counter()
+    raw_files, out_files = synthetic_raw.write_files(input_path, n_files=n_files, pings_per_file=pings_per_file,
+                                                                        n_channels=n_channels, instrument=instrument)
+    generate_time = time.perf_counter()-start
+    region_file = os.path.join(work_path, 'region.csv')
+    with open(region_file, 'w') as f:
+        f.write('latitude,longitude\n'+''.join('{},{}\n'.format(*corner) for corner in REGION))
+
+    filter_params = dict(FILTER_PARAMS, latlon_limit=[region_file, 'in'])
+    processor = Process(instrument, synthetic_raw.FREQUENCIES[0], output_path, 1, False, make_echogram, True, {},
+                                PR_PARAMS.copy(), SS_PARAMS.copy(), TRIWAVE_PARAMS.copy(), filter_params, {})
+    merger = Merge({}, timer=processor.timer)
+    # Only the records of this run are read, if the work path is reused
+    times_file = processor.timer.log_path+processor.timer.file_name
+    times_start = os.path.getsize(times_file) if os.path.exists(times_file) else 0
+    groups = plan_groups(raw_files, 'file', 2, out_files=out_files)
+    group_times = []
+    start = time.perf_counter()
+    try:
+        for group in groups:
+            group_start = time.perf_counter()
+            processor.process(group['files'], '-unit2file.raw', last_one=group['is_last'], out_list=group['out_files'])
+            merger.merge(group['out_files'], os.path.join(output_path, os.path.basename(group['files'][0])[:-4]+'-merged.out'))
+            group_times.append(round(time.perf_counter()-group_start, 4))
+    finally:
+        processor.close()
+    total_time = time.perf_counter()-start
+    records = []
+    if os.path.exists(times_file):
+        with open(times_file) as f:
+            f.seek(times_start)
+            records = [json.loads(line) for line in f if line.strip()]
+
+    n_pings = n_files*pings_per_file
+    return dict({'instrument': instrument, 'n_files': n_files, 'pings_per_file': pings_per_file, 'n_channels': n_channels,
+                'n_pings': n_pings, 'generate_seconds': round(generate_time, 4),
+                'total_seconds': round(total_time, 4), 'pings_per_second': round(n_pings/total_time, 2),
+                'group_seconds': group_times, 'peak_rss_mb': peak_rss_mb(), 'work_path': work_path}, **stage_report(records))
+
+if __name__ == '__main__':
+    sizes = [int(x) for x in sys.argv[1:4]]
+    instrument = sys.argv[4] if len(sys.argv) > 4 else 'EK60'
+    report = run(*sizes, instrument=instrument)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if len(sys.argv) > 5:
+        with open(sys.argv[5], 'w') as f:
+            f.write(text)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+synthetic_raw writes synthetic Simrad files for benchmarking the processing without survey data.
+
+EK60 raw files hold a configuration datagram (CON0) for the channels, NMEA datagrams (NME0)
+with GGA and VTG sentences along a straight track, and power sample datagrams (RAW0) for each
+ping and channel. EK80 raw files hold XML configuration and environment datagrams (XML0), the
+NMEA datagrams, and for each ping and channel an XML parameter datagram and a sample datagram
+(RAW3) with complex (float32) samples of 4 transducer sectors.
+The power has a ringdown at the start of each ping with the ES60 triangle wave error added, a
+scattering layer and a bottom echo. A small fraction of pings are dropouts with a weak ringdown
+and bottom, so the ringdown and bottom filters have something to remove.
+Matching out files hold the configuration, NMEA and the bottom depth datagrams (DEP0).
+
+Usage:
+    python benchmarks/synthetic_raw.py output_path [n_files] [pings_per_file] [n_channels] [EK60|EK80]
+"""
+import os, struct, sys
+import numpy as np
+
+# Seconds between the NT epoch (1601) and the unix epoch (1970)
+NT_EPOCH_OFFSET = 11644473600
+# Size of the raw power step (dB) in the int16 samples
+POWER_STEP = 10*np.log10(2)/256
+# Frequencies of the channels, the primary channel first
+FREQUENCIES = [38000, 120000, 18000, 70000, 200000]
+# Period (pings) of the ES60 triangle wave error
+TRIWAVE_PERIOD = 2721
+
+CON0_HEADER = struct.Struct('<128s128s128s30s98sl')
+CON0_TRANSCEIVER = struct.Struct('<128sl15f5f8s5f8s5f8s16s28s')
+RAW0_HEADER = struct.Struct('<hhfffffffffffffh6sll')
+# Channel ID, data type, spare, offset and count of a RAW3 datagram
+RAW3_HEADER = struct.Struct('<128sH2sLL')
+# Number of transducer sectors of the EK80 complex samples
+EK80_SECTORS = 4
+# Impedance (ohm) of the EK80 transceiver and transducer, for converting power to complex samples
+EK80_RX_IMPEDANCE = 5400.0
+EK80_TD_IMPEDANCE = 75.0
+
+def nt_time(time):
+    '''
+    Method to convert a datetime64 to NT time (100 ns ticks since 1601) as low and high uint32
+    '''
+    ticks = (time.astype('datetime64[us]').astype(np.int64) + NT_EPOCH_OFFSET*10**6)*10
+    return int(ticks) & 0xFFFFFFFF, int(ticks) >> 32
+
+def datagram(dgram_type, time, body):
+    '''
+    Method to pack a datagram: length, type, NT time, body, length
+    '''
+    low, high = nt_time(time)
+    contents = struct.pack('<4sLL', dgram_type, low, high) + body
+    return struct.pack('<l', len(contents)) + contents + struct.pack('<l', len(contents))
+
+def con0_datagram(time, frequencies):
+    '''
+    Method to make the configuration datagram for a list of channel frequencies
+    '''
+    body = CON0_HEADER.pack(b'synthetic', b'benchmark', b'ES60', b'2.2.0', b'', len(frequencies))
+    for f in frequencies:
+        channel_id = 'GPT {:3d} kHz 00907203422d 1 ES{}-7'.format(f//1000, f//1000).encode()
+        pulse_lengths = [0.000256, 0.000512, 0.001024, 0.002048, 0.004096]
+        body += CON0_TRANSCEIVER.pack(channel_id, 1, f, 26.5, -20.6, 7.0, 7.0, 21.97, 21.97, 0, 0, 0, 0, 0, 0, 0, 0,
+                                                        *pulse_lengths, b'', *[26.5]*5, b'', *[-0.7]*5, b'', b'070413', b'')
+    return datagram(b'CON0', time, body)
+
+def ek80_channel_id(frequency):
+    '''
+    Method to make the EK80 channel ID of a frequency
+    '''
+    return 'WBT {}-1 ES{}-7_ES'.format(FREQUENCIES.index(frequency)+1, frequency//1000)
+
+def xml0_datagram(time, text):
+    '''
+    Method to make an XML datagram
+    '''
+    return datagram(b'XML0', time, ('<?xml version="1.0" encoding="utf-8"?>\r\n'+text).encode('utf-8'))
+
+def ek80_configuration(time, frequencies):
+    '''
+    Method to make the XML configuration datagram for a list of channel frequencies, one transceiver each
+    '''
+    transceivers = ''
+    for number, f in enumerate(frequencies, start=1):
+        transducer = ('<Transducer TransducerName="ES{0}-7" SerialNumber="{1}" Frequency="{2}" FrequencyMinimum="{2}" '
+                            'FrequencyMaximum="{2}" BeamType="1" EquivalentBeamAngle="-20.6" Gain="26.5;26.5;26.5;26.5;26.5" '
+                            'SaCorrection="-0.7;-0.7;-0.7;-0.7;-0.7" MaxTxPowerTransducer="2000" BeamWidthAlongship="7" '
+                            'BeamWidthAthwartship="7" AngleSensitivityAlongship="21.97" AngleSensitivityAthwartship="21.97" '
+                            'AngleOffsetAlongship="0" AngleOffsetAthwartship="0" DirectivityDropAt2XBeamWidth="0" />').format(f//1000, number, f)
+        channel = ('<Channel ChannelID="{}" ChannelIdShort="{}" ChannelNumber="1" MaxTxPowerTransceiver="2000" '
+                        'PulseDuration="0.000256;0.000512;0.001024;0.002048;0.004096" SampleInterval="{}" HWChannelConfiguration="0">'
+                        '{}</Channel>').format(ek80_channel_id(f), ek80_channel_id(f), 0.000256, transducer)
+        transceivers += ('<Transceiver TransceiverName="WBT {0}" EthernetAddress="" IPAddress="" MarketSegment="Scientific" '
+                                'TransceiverNumber="{0}" SerialNumber="{0}" TransceiverSoftwareVersion="1.0" TransceiverType="WBT" '
+                                'Impedance="{1}" RxSampleFrequency="1500000"><Channels>{2}</Channels></Transceiver>').format(number, EK80_RX_IMPEDANCE, channel)
+    text = ('<Configuration><Header Copyright="synthetic" ApplicationName="EK80" Version="2.0.0" FileFormatVersion="1.20" '
+                'TimeBias="0" /><Transceivers>{}</Transceivers></Configuration>').format(transceivers)
+    return xml0_datagram(time, text)
+
+def ek80_environment(time, sound_velocity):
+    '''
+    Method to make the XML environment datagram
+    '''
+    text = ('<Environment Depth="100" Acidity="8" Salinity="32" SoundSpeed="{0}" Temperature="5" Latitude="57" '
+                'SoundVelocitySource="Manual" DropKeelOffset="0" DropKeelOffsetIsManual="0" WaterLevelDraft="0" '
+                'WaterLevelDraftIsManual="0" TowedBodyDepth="0" TowedBodyDepthIsManual="0">'
+                '<Transducer TransducerName="Unknown" SoundSpeed="{0}" /></Environment>').format(sound_velocity)
+    return xml0_datagram(time, text)
+
+def ek80_parameter(time, frequency, sample_interval):
+    '''
+    Method to make the XML parameter datagram of a CW ping of a channel
+    '''
+    text = ('<Parameter><Channel ChannelID="{}" ChannelMode="0" PulseForm="0" Frequency="{}" PulseDuration="0.001024" '
+                'SampleInterval="{}" TransmitPower="1000" Slope="0.0159" /></Parameter>').format(ek80_channel_id(frequency), frequency, sample_interval)
+    return xml0_datagram(time, text)
+
+def raw3_datagram(time, frequency, power, rng):
+    '''
+    Method to make the complex sample datagram of a ping of a channel from the power (dB) of each sample.
+    The sectors have the same amplitude with small phase differences, so the echo is near the beam axis.
+    '''
+    n_samples = len(power)
+    # Amplitude of each sector giving the power of the sectors' mean, as converted by echolab2
+    impedance = ((EK80_RX_IMPEDANCE+EK80_TD_IMPEDANCE)/EK80_RX_IMPEDANCE)**2/EK80_TD_IMPEDANCE
+    amplitude = 2*np.sqrt(2)*np.sqrt(10**(power.astype(float)/10)/(EK80_SECTORS*impedance))
+    phase = rng.uniform(-np.pi, np.pi, n_samples)[:, np.newaxis] + rng.normal(0, 0.05, (n_samples, EK80_SECTORS))
+    samples = (amplitude[:, np.newaxis]*np.exp(1j*phase)).astype('<c8')
+    header = RAW3_HEADER.pack(ek80_channel_id(frequency).encode(), 8 | (EK80_SECTORS << 8), b'', 0, n_samples)
+    return datagram(b'RAW3', time, header+samples.tobytes())
+
+def nmea_sentence(text):
+    '''
+    Method to add the checksum and line end to an NMEA sentence
+    '''
+    checksum = 0
+    for c in text.encode():
+        checksum ^= c
+    return '${}*{:02X}\r\n'.format(text, checksum).encode()
+
+def nmea_datagrams(time, lat, lon, speed, heading):
+    '''
+    Method to make the GGA and VTG datagrams for a fix
+    '''
+    hms = str(time.astype('datetime64[ms]'))[11:].replace(':', '')[:9]
+    lat_str = '{:02d}{:07.4f},{}'.format(int(abs(lat)), (abs(lat) % 1)*60, 'N' if lat >= 0 else 'S')
+    lon_str = '{:03d}{:07.4f},{}'.format(int(abs(lon)), (abs(lon) % 1)*60, 'E' if lon >= 0 else 'W')
+    gga = nmea_sentence('GPGGA,{},{},{},1,08,0.9,0.0,M,0.0,M,,'.format(hms, lat_str, lon_str))
+    vtg = nmea_sentence('GPVTG,{:05.1f},T,,M,{:05.1f},N,{:05.1f},K'.format(heading, speed, speed*1.852))
+    return datagram(b'NME0', time, gga) + datagram(b'NME0', time, vtg)
+
+def dep0_datagram(time, depths):
+    '''
+    Method to make a bottom depth datagram with a depth for each channel
+    '''
+    body = struct.pack('<l', len(depths))
+    for d in depths:
+        body += struct.pack('<ffl', d, 0, 0)
+    return datagram(b'DEP0', time, body)
+
+def make_power(n_pings, n_samples, ping_offset, bottom_samples, rng, dropout_rate=0.01, triwave_amplitude=1.0):
+    '''
+    Method to make the power (dB) of a channel for a block of pings
+
+    :param ping_offset: number of pings before this block, to continue the triangle wave across files
+    :type ping_offset: int
+
+    :param bottom_samples: sample of the bottom for each ping
+    :type bottom_samples: array(int)
+
+    :returns power: power (dB) by ping (rows) and sample (columns) and the boolean array of dropout pings
+    :type power: array(float32), array(bool)
+    '''
+    samples = np.arange(n_samples)
+    # Background noise and a scattering layer
+    power = rng.normal(-125, 2, (n_pings, n_samples)).astype(np.float32)
+    layer = (samples > 0.3*n_samples) & (samples < 0.4*n_samples)
+    power[:, layer] += rng.exponential(15, (n_pings, np.sum(layer))).astype(np.float32)
+    # Ringdown in the first samples of each ping
+    power[:, :3] = -15
+    # Bottom echo decaying over 20 samples below the bottom
+    below = samples[np.newaxis, :] - bottom_samples[:, np.newaxis]
+    bottom = (below >= 0) & (below < 20)
+    power[bottom] = -40 - 2*below[bottom]
+    power[below >= 20] = -100
+    # Dropouts have a weak ringdown and bottom
+    dropouts = rng.random(n_pings) < dropout_rate
+    power[dropouts] -= 20
+    # The triangle wave error is added to all samples of a ping
+    phase = ((np.arange(n_pings)+ping_offset) % TRIWAVE_PERIOD)/TRIWAVE_PERIOD
+    triangle = triwave_amplitude*(2*np.abs(2*phase-1)-1)
+    power += triangle[:, np.newaxis].astype(np.float32)
+
+    return power, dropouts
+
+def write_files(output_path, n_files=2, pings_per_file=3000, n_channels=1, n_samples=800, start_time='2024-06-15T20:00:00',
+                        ping_interval=1.0, start_position=(57.0, -168.0), speed=10.0, heading=45.0, prefix='SYN', seed=0, instrument='EK60'):
+    '''
+    Method to write a set of synthetic raw files and their out files
+
+    :param output_path: directory for the files
+    :type output_path: str
+
+    :optional param n_files, pings_per_file, n_channels, n_samples: size of the data
+    :optional type n_files, pings_per_file, n_channels, n_samples: int
+
+    :optional param instrument: 'EK60' for power samples or 'EK80' for complex samples
+    :optional type instrument: str
+
+    :optional param speed: speed (knots) of the ship, along a straight track with heading (degrees)
+    :optional type speed: float
+
+    :returns raw_files, out_files: lists of the files written and the number of pings per file
+    :type raw_files, out_files: list(str)
+    '''
+    if instrument not in ('EK60', 'EK80'):
+        raise ValueError('Unknown instrument {}'.format(instrument))
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    rng = np.random.default_rng(seed)
+    frequencies = FREQUENCIES[:n_channels]
+    sample_interval = 0.000256
+    sound_velocity = 1470.0
+    sample_thickness = sound_velocity*sample_interval/2
+    step = np.timedelta64(int(ping_interval*1000), 'ms')
+    time = np.datetime64(start_time, 'ms')
+    lat, lon = start_position
+    # Distance travelled each ping in degrees
+    dist = speed*1852/3600*ping_interval/111120
+    dlat = dist*np.cos(np.radians(heading))
+    dlon = dist*np.sin(np.radians(heading))/np.cos(np.radians(lat))
+
+    raw_files = []
+    out_files = []
+    for file_number in range(n_files):
+        name = '{}-D{}-T{}'.format(prefix, str(time.astype('datetime64[D]')).replace('-', ''),
+                                            str(time.astype('datetime64[s]'))[11:].replace(':', ''))
+        raw_name = os.path.join(output_path, name+'.raw')
+        out_name = os.path.join(output_path, name+'.out')
+        ping_offset = file_number*pings_per_file
+        # Bottom depth slowly varying around 100 m
+        depths = 100 + 10*np.sin((np.arange(pings_per_file)+ping_offset)/500) + rng.normal(0, 0.2, pings_per_file)
+        bottom_samples = np.minimum((depths/sample_thickness).astype(int), n_samples-1)
+        powers = [make_power(pings_per_file, n_samples, ping_offset, bottom_samples, rng)[0] for f in frequencies]
+        with open(raw_name, 'wb') as raw, open(out_name, 'wb') as out:
+            if instrument == 'EK60':
+                config = con0_datagram(time, frequencies)
+                raw.write(config)
+            else:
+                config = ek80_configuration(time, frequencies)
+                raw.write(config+ek80_environment(time, sound_velocity))
+            out.write(config)
+            for ping in range(pings_per_file):
+                nmea = nmea_datagrams(time, lat, lon, speed, heading)
+                raw.write(nmea)
+                out.write(nmea)
+                out.write(dep0_datagram(time, [depths[ping]]*len(frequencies)))
+                for channel, (f, power) in enumerate(zip(frequencies, powers)):
+                    if instrument == 'EK80':
+                        raw.write(ek80_parameter(time, f, sample_interval))
+                        raw.write(raw3_datagram(time, f, power[ping], rng))
+                        continue
+                    header = RAW0_HEADER.pack(channel+1, 1, 0.0, f, 1000.0, 0.001024, 2425.0, sample_interval,
+                                                            sound_velocity, 0.0098, 0, 0, 0, 5.0, heading, 0, b'', 0, n_samples)
+                    samples = np.round(power[ping]/POWER_STEP).astype('<i2').tobytes()
+                    raw.write(datagram(b'RAW0', time, header+samples))
+                time = time + step
+                lat += dlat
+                lon += dlon
+        raw_files.append(raw_name)
+        out_files.append(out_name)
+
+    return raw_files, out_files
+
+if __name__ == '__main__':
+    sizes = [int(x) for x in sys.argv[2:5]]
+    instrument = sys.argv[5] if len(sys.argv) > 5 else 'EK60'
+    raw_files, out_files = write_files(sys.argv[1], *sizes, instrument=instrument)
+    print('Wrote {} raw and {} out files to {}'.format(len(raw_files), len(out_files), sys.argv[1]))
@@ -45,8 +45,7 @@ Nate Lauffenburger 2/8/2022
 import glob, logging, datetime, os
 from pyAVO2.process_data import Process
 from pyAVO2.merge_out_data import Merge
-import numpy as np
-import pandas as pd
+from pyAVO2.file_planner import plan_groups
 
 
 # Parameterize some of the processing.  Later, we will allow user to pass these into this script or read from an init file
@@ -58,7 +57,8 @@ minimum_pings_to_write = 1
 write_orig = False
 # make a figure with echogram image of original data with no subsampling or filter for reference.
 make_echogram = True
-# save gps data and speed by ping for original file
+# save gps data and speed by ping for original file as columnar track segments in gps_tracks (a folder for each run),
+# all tracks are exported to gps_report.csv at the end of the run.  Use 'npz' to only save the track segments
 save_gps = True
 # primary frequency- process this channel first, match pings from other frequencies to this frequency and use subsampling index from this one for others
 primary_frequency = 38000
@@ -200,142 +200,114 @@ pr_params = {'statistic_interval': 50,
 
 map_params = {'save': True, 'grids': 'G:\\AVO\Code\\pyAVO\\pyAVO2\\BT_grids.shp'}
 
+# Number of pings to convert to Sv at once for the Sv based filters (ringdown and bottom).
+# This bounds the memory used by Sv copies on long groups, but the raw data of a group are still read whole unless stream is True.
+# Use None to convert a whole group at once.
+window_pings = 5000
+
+# Number of worker processes that render echograms in the background while processing continues
+echogram_workers = 2
+# Echogram images: 'echolab2' for the echolab2 Echogram plot of the full Sv, or 'reduced' to reduce Sv
+# to the pixels of the image and draw it with imshow, which is faster but changes the images
+echogram_style = 'echolab2'
+
+# Time of each processing stage is written by group to logs\stage_times.jsonl.
+# To profile a group with cProfile, set the base name of its first file (e.g. 'AKK-D20250725-T213643')
+# or its number (starting at 0).  The profile is saved in logs as profile_<name>.prof.  Use None for no profiling.
+profile_group = None
+
+# Scan only the ping times and NMEA of each group first, and do not read groups that the time_limit, latlon_limit
+# and speed_limit filters remove completely (e.g. at night or in port). Their subsample and filter reports are still written.
+# Not used when write_orig or make_echogram are True, as those need every group to be read.
+prescan = False
+
+# Folder where bottom lines read from the out files, or detected when there are no bottom data in them, are saved for each raw file.
+# Reruns with other filter or subsample settings load these lines instead of reading the out files or detecting the bottom again.
+# Detected lines are only reused for the same group of files and the same triwave correction.
+# Keep the same folder between runs to reuse them.  Use None to not save bottom lines.
+bottom_cache_path = output_path+'bottom_cache\\'
+
+# Read the raw files of each group one at a time, so the memory used does not grow with the size of the group (e.g. 'day' groups).
+# Files are read several times (triwave fit, Sv based filters and echogram, writing), and GPS comes from a scan of the NMEA.
+# The bottom is detected on each file, and echograms are drawn in the 'reduced' style.  Groups that cannot be streamed
+# (e.g. the sampling changes between files) are read whole.
+stream = False
+
 #
 # BEGIN PROCESSING CODE
 #
-# First record the parameters used in this analysis in the main output folder
-def record_params(write_dict):
-    f_name = output_path+'run_params_{:%d-%m-%Y-%H-%M-%S}.txt'.format(datetime.datetime.now())
-    with open(f_name, 'w') as f:
-        for key, value in write_dict.items():
-            f.write('%s: %s\n' % (key, value))
-param_dict = {}
-for i in ('instrument', 'minimum_pings_to_write', 'write_orig', 'make_echogram', 'save_gps', 'primary_frequency', 'merge_out_data', 
-            'start_time', 'load_params', 'input_path', 'output_path', 'size_info', 'ss_params', 'filter_params', 'triwave_params', 
-            'pr_params', 'map_params'):
-    param_dict[i] =locals()[i]
-record_params(param_dict)
-
-# Find raw files in path
-files = glob.glob(input_path+'*.raw')
-num_of_files = len(files)
-
-# Find out files in path, if there are any.
-out_files = None
-if 'bottom' in filter_params:
-    out_files = glob.glob(input_path+'*.out')
-
-# Set up logger
-LOG_FORMAT = "%(asctime)s %(filename)s:%(lineno)-4d "\
-                            "%(levelname)s %(message)s"
-formatter = logging.Formatter(LOG_FORMAT)
-try:
-    os.mkdir(output_path+'logs')
-    logging.info('Successful creation of folder: logs')
-except: 
-    logging.info('Folder logs already exists')
-file_handler = logging.FileHandler(output_path+'logs\\log_{:%m-%d-%Y}.log'.format(datetime.datetime.now()))
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(formatter)
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
-
-# Initialize the logger with processing meta data
-if not ss_params or ss_params['percent']==100:
-    logging.info('Subsampling will not be performed, as requested')
-else:
-    logging.info('Subsampling: {} percent, {} ping chunks, {} iterations starting with ping number {}'.format(ss_params['percent'], ss_params['chunk_size'], ss_params['iterations'], ss_params['chunk_start']))
-logging.info('{} {}(s) will be processed at a time'.format(size_info['size_number'], size_info['size_unit']))
-
-# Initialize process and merge objects for use later
-# Processor is the main processing loop that does all the raw file subsampling/filtering/reporting/mapping/making echograms
-processor = Process(instrument, primary_frequency, output_path,
-                        minimum_pings_to_write, write_orig, make_echogram, save_gps, load_params,
-                        pr_params, ss_params, triwave_params, filter_params, map_params)
-# Merger is the merging of out (bottom) files together and renaming to match the processor output raw data
-merger = Merge(load_params)
-
-# Get bottom file (out) date times for easier searching later
-if 'bottom' in filter_params:
-    out_date_times = []
-    for f in out_files:
-        d_start=f.find('-D')+2
-        f_date=f[d_start:d_start+8]
-        t_start=f.find('-T')+2
-        f_time=f[t_start:t_start+6]
-        out_date_times.append(pd.to_datetime(f_date+'-'+f_time))
-    out_ind = np.argsort(out_date_times)
-    out_date_times = np.array(out_date_times)[out_ind]
-    out_files = np.array(out_files)[out_ind]
-
-# CASE 1 of processing: If file size info is dependent on a time unit:
-# Compile dictionary of file names and start times, so indexing by hour/day will be easy,
-# Then loop through size intervals specified
-f_full_dates=[]
-f_dates=[]
-f_times=[]
-ping_stats = {}
-unit=size_info['size_unit']
-num=size_info['size_number']
-size_suffix = '-unit'+str(size_info['size_number'])+size_info['size_unit']+'.raw'
-if unit in {'hour', 'day'}:
-    file_dt=[]
-    for f in files:
-        d_start=f.find('-D')+2
-        f_date=f[d_start:d_start+8]
-        t_start=f.find('-T')+2
-        f_time=f[t_start:t_start+6]
-        f_full_dates.append(pd.to_datetime(f_date+'-'+f_time))
-        f_dates.append(pd.to_datetime(f_date).date())
-        f_times.append(pd.to_datetime(f_date+'-'+f_time).time())
-    # Now create the timing grid to cyle through
-    freq=str(num)+str(unit[0])
-    if unit=='hour':
-        if start_time:
-            date_range=pd.date_range(pd.to_datetime(start_time[0]+'-'+start_time[1]),np.max(f_full_dates)+pd.to_timedelta(num, unit='h'), None, freq)
-        else:
-            date_range=pd.date_range(np.min(f_full_dates),np.max(f_full_dates)+pd.to_timedelta(num, unit='h'), None, freq)
+# The processing code is guarded so that the worker processes (e.g. echogram rendering) can import this script safely
+if __name__ == '__main__':
+    # First record the parameters used in this analysis in the main output folder
+    def record_params(write_dict):
+        f_name = output_path+'run_params_{:%d-%m-%Y-%H-%M-%S}.txt'.format(datetime.datetime.now())
+        with open(f_name, 'w') as f:
+            for key, value in write_dict.items():
+                f.write('%s: %s\n' % (key, value))
+    param_dict = {}
+    for i in ('instrument', 'minimum_pings_to_write', 'write_orig', 'make_echogram', 'save_gps', 'primary_frequency', 'merge_out_data', 
+                'start_time', 'load_params', 'input_path', 'output_path', 'size_info', 'ss_params', 'filter_params', 'triwave_params', 
+                'pr_params', 'map_params', 'window_pings', 'echogram_workers', 'echogram_style', 'profile_group', 'prescan', 'bottom_cache_path', 'stream'):
+        param_dict[i] =locals()[i]
+    record_params(param_dict)
+
+    # Find raw files in path
+    files = glob.glob(input_path+'*.raw')
+    num_of_files = len(files)
+
+    # Find out files in path, if there are any.
+    out_files = None
+    if 'bottom' in filter_params or merge_out_data:
+        out_files = glob.glob(input_path+'*.out')
+
+    # Set up logger
+    LOG_FORMAT = "%(asctime)s %(filename)s:%(lineno)-4d "\
+                                "%(levelname)s %(message)s"
+    formatter = logging.Formatter(LOG_FORMAT)
+    try:
+        os.mkdir(output_path+'logs')
+        logging.info('Successful creation of folder: logs')
+    except: 
+        logging.info('Folder logs already exists')
+    file_handler = logging.FileHandler(output_path+'logs\\log_{:%m-%d-%Y}.log'.format(datetime.datetime.now()))
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(formatter)
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    logger.addHandler(file_handler)
+
+    # Initialize the logger with processing meta data
+    if not ss_params or ss_params['percent']==100:
+        logging.info('Subsampling will not be performed, as requested')
     else:
-        if start_time:
-            date_range=pd.date_range(pd.to_datetime(start_time[0]).date(),np.max(f_dates),None,freq)
-        else:
-            date_range=pd.date_range(np.min(f_dates),np.max(f_dates),None,freq)
+        logging.info('Subsampling: {} percent, {} ping chunks, {} iterations starting with ping number {}'.format(ss_params['percent'], ss_params['chunk_size'], ss_params['iterations'], ss_params['chunk_start']))
+    logging.info('{} {}(s) will be processed at a time'.format(size_info['size_number'], size_info['size_unit']))
+
+    # Initialize process and merge objects for use later
+    # Processor is the main processing loop that does all the raw file subsampling/filtering/reporting/mapping/making echograms
+    processor = Process(instrument, primary_frequency, output_path,
+                            minimum_pings_to_write, write_orig, make_echogram, save_gps, load_params,
+                            pr_params, ss_params, triwave_params, filter_params, map_params, 
+                            window_pings=window_pings, echogram_workers=echogram_workers, profile_group=profile_group,
+                            prescan=prescan, bottom_cache_path=bottom_cache_path, echogram_style=echogram_style, stream=stream)
+    # Merger is the merging of out (bottom) files together and renaming to match the processor output raw data
+    merger = Merge(load_params, timer=processor.timer)
+
+    # Plan the groups of files to process together:
+    # If file size info is dependent on a time unit ('hour' or 'day'), files are binned by the start time in their names,
+    # otherwise they are grouped by the number of files specified.
+    # Each raw file is paired with the latest out file starting before it, if needed for filtering or merging
+    size_suffix = '-unit'+str(size_info['size_number'])+size_info['size_unit']+'.raw'
+    groups = plan_groups(files, size_info['size_unit'], size_info['size_number'], start_time=start_time, out_files=out_files)
+    logging.info('{} file groups will be processed'.format(len(groups)))
+
     is_first = True
-    is_last = False
-    for i, d in enumerate(date_range):
-        cur_files=[]
-        if d == date_range[-1]:
-            is_last = True
-        if unit=='hour':
-            if i==0:
-                last_date=d
-            else:
-                for ind, full_d in enumerate(f_full_dates):
-                    if full_d>=last_date and full_d<d:
-                        cur_files.append(files[ind])
-                last_date=d
-        else:
-            for ind, date in enumerate(f_dates):
-                if date==pd.to_datetime(d).date():
-                    cur_files.append(files[ind])
-        if cur_files!=[]:
-            cur_files.sort()
-            # Gather a list of bottom files associated with these raw files, if needed for filtering or merging
-            if 'bottom' in filter_params or merge_out_data:
-                cur_out_files = []
-                if out_date_times.size>0:
-                    for f in cur_files:
-                        d_start=f.find('-D')+2
-                        f_date=f[d_start:d_start+8]
-                        t_start=f.find('-T')+2
-                        f_time=f[t_start:t_start+6]
-                        cur_date_time = pd.to_datetime(f_date+'-'+f_time)
-                        out_file_ind = np.max(np.where(out_date_times <= cur_date_time))
-                        cur_out_files.append(out_files[out_file_ind])
-                    cur_out_files = np.unique(cur_out_files)
+    try:
+        for group in groups:
+            cur_files = group['files']
+            cur_out_files = group['out_files']
             # Do the main processing here
-            val = processor.process(cur_files, size_suffix, mk_dirs=is_first, last_one=is_last, out_list=cur_out_files)
+            val = processor.process(cur_files, size_suffix, mk_dirs=is_first, last_one=group['is_last'], out_list=cur_out_files)
             # If the processing was successful and merging of out files is desired, do it here for the subsamples specified in the load params
             if val[1] and merge_out_data:
                 # Merge bottom data and distribute into subsample folders specified in load params
@@ -348,46 +320,7 @@ if unit in {'hour', 'day'}:
                         merge_name = output_path+'SS_'+ss_str+'\\'+ss_line_prefix+start_file[start_file.rfind('\\')+7:-4]+'.out'
                         merger.merge(in_files=cur_out_files, out_file_name=merge_name)
                         logging.info("Finished combining out data to file(s) {}".format(merge_name))
-            is_first=False
-
-# CASE 2 of processing: If file size info is not dependent on a time unit and is based on file unit
-# Compile dictionary of file names and start times, so indexing by hour/day will be easy,
-# Loop through the files on the interval specified
-else:
-    is_first = True
-    is_last = False
-    # Build an index to loop through the correct spacing of files
-    for i in np.arange(0, num_of_files, size_info['size_number']):
-        # If the last set of files is being processed, pass that into the processor, for different treatment
-        if i == num_of_files-1:
-            is_last = True
-        cur_files = files[i:i+size_info['size_number']]
-        # Gather a list of bottom files associated with these raw files, if needed for filtering or merging
-        if 'bottom' in filter_params or merge_out_data:
-            cur_out_files = []
-            if out_date_times.size>0:
-                for f in cur_files:
-                    d_start=f.find('-D')+2
-                    f_date=f[d_start:d_start+8]
-                    t_start=f.find('-T')+2
-                    f_time=f[t_start:t_start+6]
-                    cur_date_time = pd.to_datetime(f_date+'-'+f_time)
-                    out_file_ind = np.max(np.where(out_date_times <= cur_date_time))
-                    cur_out_files.append(out_files[out_file_ind])
-                cur_out_files = np.unique(cur_out_files)
-        # Do the main processing here
-        val = processor.process(cur_files, size_suffix, mk_dirs=is_first, last_one=is_last, out_list=cur_out_files)
-        # If the processing was successful and merging of out files is desired, do it here for the subsamples specified in the load params
-        if val[1] and merge_out_data:
-            # Merge bottom data and distribute into subsample folders, load file name if desired
-            for iters in range(ss_params['iterations']):
-                cur_iter = int((iters+ss_params['chunk_start']-1)%(100/ss_params['percent']))
-                if cur_iter in load_params['ss_list']:
-                    ss_str = str(cur_iter)
-                    ss_line_prefix = 'L'+ss_str.zfill(4)+'-'
-                    start_file = cur_files[0]
-                    merge_name = output_path+'SS_'+ss_str+'\\'+ss_line_prefix+start_file[start_file.rfind('\\')+7:-4]+'.out'
-                    merger.merge(in_files = cur_out_files, out_file_name = merge_name)
-                    logging.info("Finished combining out data to file(s) {}".format(merge_name))
-        is_first = False
-        
+            is_first = False
+    finally:
+        # Wait for the echograms of the run and stop the rendering workers, even if a group failed
+        processor.close()
@@ -774,6 +774,56 @@ class Cursor(db.Cursor):
         else:
             return dict(zip(columns, rows[0]))
 
+    def get_integration_data(self, ship_id, survey_id, max_depth):
+        '''
+        Returns a dictionary of columns with the integrated nasc by interval and class,
+        joined with the interval source and grid cell, for cells down to max_depth
+        '''
+
+        columns = ['id', 'grid_id', 'line', 'start_lat', 'start_lon', 'end_lat', 'end_lon',
+                   'start_time', 'end_time', 'length', 'mean_speed', 'mean_ex_below_depth',
+                   'num_pings', 'class', 'nasc', 'station_id', 'shape']
+
+        SQL_CMD=\
+        """SELECT a.id, a.grid_id, a.line, a.start_lat, a.start_lon, a.end_lat, a.end_lon,
+                a.start_time, a.end_time, a.length, a.mean_speed, a.mean_ex_below_depth,
+                b.num_pings, c.class, sum(c.nasc) as nasc, d.station_id, d.shape
+            FROM interval a
+            JOIN interval_source b ON a.id = b.interval_id
+            JOIN integration_cell c ON a.id = c.interval_id AND a.frequency_id = c.frequency_id
+            JOIN grid d ON a.grid_id = d.id
+            WHERE a.ship_id=:ship_id AND a.survey_id=:survey_id
+                AND c.max_depth <= :max_depth
+            GROUP BY a.id, a.grid_id, a.line, a.start_lat, a.start_lon, a.end_lat, a.end_lon,
+                a.start_time, a.end_time, a.length, a.mean_speed, a.mean_ex_below_depth, b.num_pings,
+                c.class, d.station_id, d.shape"""
+
+        rows = self.execute(SQL_CMD, ship_id=ship_id, survey_id=survey_id,
+                            max_depth=max_depth).fetchall()
+
+        if len(rows) == 0:
+            return {key: [] for key in columns}
+
+        return dict(zip(columns, [list(x) for x in zip(*rows)]))
+
+    def get_integration_watermark(self, ship_id, survey_id):
+        '''
+        Returns a dictionary that changes whenever intervals or integration cells
+        are loaded or deleted for a ship and survey
+        '''
+
+        columns = ['max_process_id', 'max_interval_id', 'n_intervals', 'n_cells']
+
+        SQL_CMD=\
+        """SELECT MAX(a.process_id), MAX(a.id), COUNT(DISTINCT a.id), COUNT(c.interval_id)
+            FROM interval a
+            LEFT JOIN integration_cell c ON a.id = c.interval_id
+            WHERE a.ship_id=:ship_id AND a.survey_id=:survey_id"""
+
+        row = self.execute(SQL_CMD, ship_id=ship_id, survey_id=survey_id).fetchall()[0]
+
+        return {key: (None if value is None else int(value)) for key, value in zip(columns, row)}
+
     def get_groundfish_source(self, ident, output_filename=None):
 
         if isinstance(ident, (int, float)):
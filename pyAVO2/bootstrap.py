@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+'''
+Bootstrap of the AVO index to estimate its variance and confidence intervals.
+Intervals are resampled with replacement within each grid cell, or optionally whole subsample
+lines are resampled within each grid cell, and the distance weighted index of index.py is computed
+for each replicate. Replicates are computed in blocks of vectorized draws, spread over a pool of
+worker processes with a seed for each block, so results are the same for any number of processes.
+'''
+
+import logging
+from concurrent import futures
+import numpy as np
+import pandas as pd
+from pyAVO2 import index
+
+def make_units(data, classes, interval_min, time_max, min_number_intervals=0, resample_lines=False):
+    '''
+    Method to organize the intervals used in the index of a year into units that are resampled within grid cells
+
+    :param data: integration data for each ship and survey of the year
+    :type data: list(DataFrame)
+
+    :optional param resample_lines: resample whole subsample lines in each grid cell instead of intervals
+    :optional type resample_lines: bool
+
+    :returns units: 'grid' (position in grid_list) of each unit, sorted by grid, 'weighted' (nasc * length) and 'length' of each unit,
+                        'start' and 'count' of the units of each grid cell, 'grid_count' for the index scaler and the point 'index'
+    :type units: dict of arrays
+    '''
+    if isinstance(classes, str):
+        classes = [classes]
+    results = index.compute_one_year(data, classes, interval_min, time_max, min_number_intervals)
+    combined = pd.concat([index.zero_fill(d, classes) for d in data], ignore_index=True)
+    selected = combined[index.select_intervals(combined, classes, interval_min, time_max)]
+    # Only grid cells with a station are used in the index
+    grid_list = results['grid_list'][pd.Series(results['station_list']).fillna('').values != '']
+    selected = selected[selected['grid_id'].isin(grid_list)]
+    selected = selected.assign(weighted=selected['nasc']*selected['length'],
+                                    grid=np.searchsorted(grid_list, selected['grid_id']))
+    if resample_lines:
+        selected = selected.groupby(['grid', 'line'], as_index=False)[['weighted', 'length']].sum()
+    selected = selected.sort_values('grid', kind='stable')
+
+    grid = selected['grid'].values
+    count = np.bincount(grid, minlength=len(grid_list))
+    units = {'grid': grid,
+                'weighted': selected['weighted'].values.astype(float),
+                'length': selected['length'].values.astype(float),
+                'start': np.concatenate([[0], np.cumsum(count)[:-1]]),
+                'count': count,
+                'grid_count': len(results['grid_sA']),
+                'index': index.compute_index(results)['index']}
+
+    return units
+
+def replicate_indices(units, n_replicates, seed, ebs_area=index.EBS_AREA):
+    '''
+    Method to compute the index for a block of bootstrap replicates with vectorized draws
+
+    :param units: output of make_units
+    :type units: dict
+
+    :param n_replicates: number of replicates in the block
+    :type n_replicates: int
+
+    :param seed: seed for the random generator of the block
+    :type seed: numpy.random.SeedSequence or int
+
+    :returns indices: index value of each replicate
+    :type indices: array(float)
+    '''
+    rng = np.random.default_rng(seed)
+    grid = units['grid']
+    n_grids = len(units['count'])
+    # Each unit is replaced by a unit drawn from the same grid cell
+    draws = units['start'][grid] + (rng.random((n_replicates, len(grid)))*units['count'][grid]).astype(np.int64)
+    bins = (np.arange(n_replicates)[:, np.newaxis]*n_grids + grid).ravel()
+    weighted = np.bincount(bins, weights=units['weighted'][draws].ravel(), minlength=n_replicates*n_grids)
+    length = np.bincount(bins, weights=units['length'][draws].ravel(), minlength=n_replicates*n_grids)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grid_sA = (weighted/length).reshape(n_replicates, n_grids)
+    scaler = units['grid_count']*index.CELL_AREA/ebs_area
+
+    return np.nansum(grid_sA, axis=1)*index.CELL_AREA/(4*np.pi)/scaler
+
+def bootstrap_year(data, classes, interval_min, time_max, n_replicates=1000, resample_lines=False,
+                                seed=None, alpha=0.05, block_size=250, pool=None, ebs_area=index.EBS_AREA):
+    '''
+    Method to bootstrap the index of a year
+
+    :param data: integration data for each ship and survey of the year
+    :type data: list(DataFrame)
+
+    :optional param n_replicates: number of bootstrap replicates
+    :optional type n_replicates: int
+
+    :optional param seed: seed for the replicates, the same seed gives the same replicates
+    :optional type seed: int or numpy.random.SeedSequence
+
+    :optional param alpha: the confidence intervals are the alpha/2 and 1-alpha/2 percentiles of the replicates
+    :optional type alpha: float
+
+    :optional param block_size: number of replicates drawn at once in each task
+    :optional type block_size: int
+
+    :optional param pool: pool of worker processes for the blocks of replicates, if None, blocks are computed in this process
+    :optional type pool: concurrent.futures.Executor
+
+    :returns result: point 'index', 'mean', 'std', 'cv', 'ci_lower', 'ci_upper' and the 'replicates'
+    :type result: dict
+    '''
+    units = make_units(data, classes, interval_min, time_max, resample_lines=resample_lines)
+    sizes = [min(block_size, n_replicates-i) for i in range(0, n_replicates, block_size)]
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(len(sizes))
+    if pool is None:
+        blocks = [replicate_indices(units, size, s, ebs_area=ebs_area) for size, s in zip(sizes, seeds)]
+    else:
+        blocks = list(pool.map(replicate_indices, [units]*len(sizes), sizes, seeds, [ebs_area]*len(sizes)))
+    replicates = np.concatenate(blocks)
+
+    mean = replicates.mean()
+    std = replicates.std(ddof=1)
+    ci_lower, ci_upper = np.percentile(replicates, [100*alpha/2, 100*(1-alpha/2)])
+
+    return {'index': units['index'], 'mean': mean, 'std': std, 'cv': std/mean,
+                'ci_lower': ci_lower, 'ci_upper': ci_upper, 'replicates': replicates}
+
+def bootstrap_indices(cursor, ship_list, survey_list, max_depth, classes, interval_min, time_max,
+                                    n_replicates=1000, resample_lines=False, seed=None, alpha=0.05,
+                                    processes=None, cache=None, ebs_area=index.EBS_AREA):
+    '''
+    Method to bootstrap the index for a number of years
+
+    :param ship_list, survey_list: ships and surveys for each year, one row per year
+    :type ship_list, survey_list: list(list(int))
+
+    :optional param seed: seed for the replicates, each year gets its own seed from it
+    :optional type seed: int
+
+    :optional param processes: number of worker processes, 1 to compute in this process
+    :optional type processes: int
+
+    :optional param cache: read the integration data through a local cache
+    :optional type cache: integration_cache.IntegrationCache
+
+    :returns indices: point index, replicate mean, std, cv and confidence intervals by year
+    :type indices: DataFrame
+    '''
+    year_seeds = np.random.SeedSequence(seed).spawn(len(survey_list))
+    pool = futures.ProcessPoolExecutor(max_workers=processes) if processes != 1 else None
+    indices = {}
+    try:
+        for ships, surveys, year_seed in zip(ship_list, survey_list, year_seeds):
+            year = surveys[0]//100
+            logging.info('Bootstrapping the index for year {}'.format(year))
+            if cache is not None:
+                data = [cache.get(ship, survey, max_depth) for ship, survey in zip(ships, surveys)]
+            else:
+                data = [index.get_integration_data(cursor, ship, survey, max_depth) for ship, survey in zip(ships, surveys)]
+            result = bootstrap_year(data, classes, interval_min, time_max, n_replicates=n_replicates,
+                                            resample_lines=resample_lines, seed=year_seed, alpha=alpha, pool=pool,
+                                            ebs_area=ebs_area)
+            indices[year] = {key: value for key, value in result.items() if key != 'replicates'}
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return pd.DataFrame.from_dict(indices, orient='index')
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+'''
+Local cache of the bottom lines of raw files.
+Detected lines (when the out files have no bottom) and lines loaded from the out files are saved to a
+.npz file for each raw file, named by a key of the group the line was made for.  The key of a detected
+line is a hash of the detector parameters, the settings that change the Sv it was detected on (e.g.
+triwave correction) and all raw files in the group, since the detector runs on the Sv of the whole group.
+The key of a loaded line is a hash of the raw and out files of the group.  Files are identified by name,
+size and modification time, so large groups are not read to make the key.
+Later runs (e.g. with other filter or subsample settings) load the line instead of detecting or reading it
+again, and changed files, parameters or settings give a new key so old lines are not used.
+'''
+
+import os, json, hashlib, logging
+import numpy as np
+
+def fill_bottom_gaps(depths):
+    '''
+    Method to fill missing (nan) bottom depths with the previous depth, and any
+    missing depths at the start with the first depth
+
+    :param depths: bottom depth of each ping
+    :type depths: array(float)
+
+    :returns depths: filled in place, unchanged if there are no depths
+    :type depths: array(float)
+    '''
+    valid = np.logical_not(np.isnan(depths))
+    if not np.any(valid) or np.all(valid):
+        return depths
+    # Index of the last valid depth at or before each ping
+    last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(depths)), 0))
+    last_valid[:np.argmax(valid)] = np.argmax(valid)
+    depths[:] = depths[last_valid]
+
+    return depths
+
+class BottomCache():
+    '''
+    Class for saving and loading the detected or loaded bottom line of each raw file
+    '''
+
+    def __init__(self, path, detector_params):
+        '''
+        Initialize the cache with the directory for the files
+
+        :param path: directory for cache files, with trailing slashes
+        :type path: str
+
+        :param detector_params: parameters of the bottom detector, part of the key of each line
+        :type detector_params: dict
+        '''
+        self.path = path
+        self.detector_params = detector_params
+        if not os.path.exists(path):
+            os.mkdir(path)
+
+    def file_stamp(self, file_name):
+        '''
+        Method to identify a file for a key by its name, size and modification time, without reading it
+        '''
+        stat = os.stat(file_name)
+        return [os.path.basename(file_name), stat.st_size, stat.st_mtime_ns]
+
+    def group_key(self, file_list, out_list=None, sv_settings=None):
+        '''
+        Method to get the key of the bottom line of a group
+
+        :param file_list: raw files of the group, with path
+        :type file_list: list(str)
+
+        :optional param out_list: out files the line is loaded from, None for a detected line
+        :optional type out_list: list(str)
+
+        :optional param sv_settings: settings that change the Sv the line is detected on, e.g. triwave correction
+        :optional type sv_settings: dict
+
+        :returns key: hash of the group, parameters and settings
+        :type key: str
+        '''
+        files = [self.file_stamp(f) for f in file_list]
+        if out_list is not None:
+            contents = {'source': 'loaded', 'files': files, 'out_files': [self.file_stamp(f) for f in out_list]}
+        else:
+            contents = {'source': 'detected', 'files': files, 'detector': self.detector_params, 'settings': sv_settings}
+        return hashlib.sha1(json.dumps(contents, sort_keys=True).encode()).hexdigest()[:20]
+
+    def cache_name(self, file_name, key):
+        '''
+        Method to get the path of the cached line of a raw file for a group key
+        '''
+        base_name = os.path.basename(file_name)
+        return self.path+'{}_{}.npz'.format(base_name[:base_name.rfind('.')], key)
+
+    def has(self, file_list, key):
+        '''
+        Method to check that every raw file of a group has a cached line for a group key
+        '''
+        return all(os.path.exists(self.cache_name(f, key)) for f in file_list)
+
+    def group_files(self, file_list, ping_files):
+        '''
+        Method to find the raw file (with path) of each file name in ping_files
+        '''
+        paths = {os.path.basename(f): f for f in file_list}
+        names = []
+        for name in ping_files:
+            if name not in names:
+                names.append(name)
+        if not all(os.path.basename(name) in paths for name in names):
+            return None
+        return [(name, paths[os.path.basename(name)]) for name in names]
+
+    def get(self, file_list, ping_files, ping_time, key):
+        '''
+        Method to load the bottom line of a group from the cached lines of its raw files
+
+        :param file_list: raw files of the group, with path
+        :type file_list: list(str)
+
+        :param ping_files: raw file name of each ping
+        :type ping_files: list(str)
+
+        :param ping_time: time of each ping
+        :type ping_time: array(datetime64)
+
+        :param key: key of the group, from group_key
+        :type key: str
+
+        :returns depths: bottom depth of each ping, None if a file has no cached line or a ping is missing
+        :type depths: array(float)
+        '''
+        files = self.group_files(file_list, ping_files)
+        if files is None:
+            return None
+        times = []
+        depths = []
+        try:
+            for name, file_name in files:
+                cache_name = self.cache_name(file_name, key)
+                if not os.path.exists(cache_name):
+                    return None
+                with np.load(cache_name) as cached:
+                    times.append(cached['ping_time'])
+                    depths.append(cached['depth'])
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning('Could not read cached bottom line for {}: {}'.format(file_list, e))
+            return None
+        times = np.concatenate(times)
+        depths = np.concatenate(depths)
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        ind = np.minimum(np.searchsorted(times, ping_time), len(times)-1)
+        if len(times) == 0 or np.any(times[ind] != ping_time):
+            logging.info('Cached bottom line does not have all the pings of {}'.format(file_list))
+            return None
+        logging.info('Loaded cached bottom line for {}'.format(file_list))
+
+        return depths[order][ind]
+
+    def put(self, file_list, ping_files, ping_time, depths, key):
+        '''
+        Method to save the bottom line of a group, one file for each raw file
+
+        :returns boolean for success of write
+        '''
+        files = self.group_files(file_list, ping_files)
+        if files is None:
+            logging.warning('Could not match the pings to the raw files of {}, bottom line was not cached'.format(file_list))
+            return False
+        ping_files = np.asarray(ping_files)
+        for name, file_name in files:
+            ind = ping_files == name
+            np.savez(self.cache_name(file_name, key), ping_time=np.asarray(ping_time)[ind], depth=np.asarray(depths, dtype=float)[ind])
+
+        return True
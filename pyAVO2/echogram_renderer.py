@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+import logging, collections, warnings
+from concurrent import futures
+import numpy as np
+
+# Simrad EK500 color table for Sv echograms
+EK500_COLORS = np.array([[255, 255, 255], [159, 159, 159], [95, 95, 95], [0, 0, 255], [0, 0, 127],
+                                        [0, 191, 0], [0, 127, 0], [255, 255, 0], [255, 127, 0], [255, 0, 191],
+                                        [255, 0, 0], [166, 83, 60], [120, 60, 40]])/255
+# Fraction of the figure width and height taken by the axes, with the default matplotlib subplot margins
+AXES_FRACTION = (0.775, 0.77)
+
+def reduce_blocks(values, ping_step, sample_step, method='mean', chunk_pings=4096):
+    '''
+    Method to reduce a 2D array of Sv by blocks of pings and samples, in the linear domain,
+    so that thin features (e.g. bottom, fish) are kept in a reduced echogram.
+    Reduces a chunk of pings at a time so the linear copy never holds the full array.
+
+    :param values: Sv values (dB) by ping (rows) and sample (columns)
+    :type values: array(float)
+
+    :param ping_step, sample_step: number of pings and samples in each block
+    :type ping_step, sample_step: int
+
+    :optional param method: 'mean' for linear mean or 'max' for maximum of each block
+    :optional type method: str
+
+    :returns reduced Sv (dB) with one value per block
+    :type reduced: array(float32)
+    '''
+    n_pings, n_samples = values.shape
+    n_cols = int(np.ceil(n_samples/sample_step))
+    reduced = np.empty((int(np.ceil(n_pings/ping_step)), n_cols), dtype=np.float32)
+    # Whole blocks of pings are reduced in each chunk
+    chunk_pings = max(chunk_pings//ping_step, 1)*ping_step
+    for start in range(0, n_pings, chunk_pings):
+        block = np.asarray(values[start:start+chunk_pings], dtype=np.float32)
+        # Pad the end of the chunk to whole blocks with nans that are ignored in the reduction
+        n_rows = int(np.ceil(block.shape[0]/ping_step))
+        padded = np.full((n_rows*ping_step, n_cols*sample_step), np.nan, dtype=np.float32)
+        padded[:block.shape[0], :n_samples] = block
+        padded = padded.reshape(n_rows, ping_step, n_cols, sample_step)
+        with warnings.catch_warnings():
+            # All nan blocks are expected where there is no data
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            if method == 'max':
+                out = np.nanmax(padded, axis=(1, 3))
+            else:
+                out = 10*np.log10(np.nanmean(10**(padded/10), axis=(1, 3)))
+        reduced[start//ping_step:start//ping_step+n_rows] = out
+
+    return reduced
+
+def reduce_line(values, ping_step):
+    '''
+    Method to reduce a line (e.g. the bottom depth of each ping) by blocks of pings,
+    keeping the shallowest value in each block
+
+    :param values: value of each ping
+    :type values: array(float)
+
+    :param ping_step: number of pings in each block
+    :type ping_step: int
+
+    :returns reduced line with one value per block
+    :type reduced: array(float)
+    '''
+    values = np.asarray(values, dtype=float)
+    padded = np.full(int(np.ceil(len(values)/ping_step))*ping_step, np.nan)
+    padded[:len(values)] = values
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.nanmin(padded.reshape(-1, ping_step), axis=1)
+
+def build_pyramid(Sv, levels=4, method='mean'):
+    '''
+    Method to build a multi-level pyramid of an echogram for zoomable views,
+    each level reduced by 2 in pings and samples from the one before
+
+    :returns list of reduced Sv arrays, starting with the full resolution Sv
+    '''
+    pyramid = [np.asarray(Sv, dtype=np.float32)]
+    for level in range(1, levels):
+        if min(pyramid[-1].shape) < 2:
+            break
+        pyramid.append(reduce_blocks(pyramid[-1], 2, 2, method=method))
+
+    return pyramid
+
+def render_echogram(file_name, Sv, ping_time, sample_range, bottom=None, bottom_color='k',
+                                threshold=(-70, -34), figsize=(18, 4.8), dpi=1200):
+    '''
+    Method to render an Sv echogram image to a file.
+    Runs in a worker process, so it only takes arrays and imports the plotting backend itself.
+    Used for the 'reduced' style of EchogramRenderer: the image is drawn with imshow and the EK500 colors,
+    not with the echolab2 Echogram plot, so it is not identical to the 'echolab2' style images
+    (e.g. axes, color scale and reduced pixels).
+
+    :param file_name: path of the image file to save
+    :type file_name: str
+
+    :param Sv: Sv values (dB) by ping (rows) and sample (columns)
+    :type Sv: array(float)
+
+    :param ping_time: times for pings (rows) of Sv
+    :type ping_time: array(datetime64)
+
+    :param sample_range: range (m) for samples (columns) of Sv
+    :type sample_range: array(float)
+
+    :optional param bottom: bottom line (m) for each ping, not plotted if None
+    :optional type bottom: array(float)
+
+    :returns file_name
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import ListedColormap
+    import matplotlib.dates as mdates
+
+    times = mdates.date2num(ping_time)
+    fig = plt.figure(figsize=figsize)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.imshow(Sv.T, aspect='auto', interpolation='none', cmap=ListedColormap(EK500_COLORS),
+                    vmin=threshold[0], vmax=threshold[1],
+                    extent=(times[0], times[-1], sample_range[-1], sample_range[0]))
+    if bottom is not None:
+        ax.plot(times, bottom, linewidth=0.05, color=bottom_color, linestyle='solid')
+    ax.xaxis_date()
+    ax.set_ylabel('Range (m)')
+    fig.savefig(file_name, dpi=dpi)
+    plt.close(fig)
+
+    return file_name
+
+def render_echolab2_echogram(file_name, Sv, bottom=None, bottom_color='k', threshold=(-70, -34), figsize=(18, 4.8), dpi=1200):
+    '''
+    Method to render an Sv echogram image to a file with the echolab2 Echogram plot, the same image as
+    made in the processing loop before rendering was moved to worker processes.
+    Runs in a worker process, so it imports the plotting backend itself.
+
+    :param file_name: path of the image file to save
+    :type file_name: str
+
+    :param Sv: Sv of the primary channel
+    :type Sv: echolab2 processed_data object
+
+    :optional param bottom: bottom line, not plotted if None
+    :optional type bottom: echolab2 line object
+
+    :returns file_name
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from echolab2.plotting.matplotlib import echogram
+
+    fig = plt.figure(figsize=figsize)
+    eg = echogram.Echogram(fig, Sv, threshold=list(threshold))
+    if bottom is not None:
+        eg.plot_line(bottom, linewidth=0.05, color=bottom_color, linestyle='solid')
+    fig.savefig(file_name, dpi=dpi)
+    plt.close(fig)
+
+    return file_name
+
+class ReducedEchogram():
+    '''
+    Class for an echogram reduced to the pixel grid of the image a window of pings at a time, 
+    so the Sv of a group streamed one file at a time is never held whole.
+    Pings at the end of a window that do not fill a block are kept for the next window, so each block
+    has the same pings, and the result is the same, as EchogramRenderer.decimate of the whole Sv.
+    Samples are reduced on the grid of the first window: later windows with more samples are cut
+    to it and those with fewer samples are padded with nans.
+    '''
+
+    def __init__(self, n_pings, max_pings, max_samples, method='mean'):
+        '''
+        :param n_pings: number of pings of the whole echogram
+        :type n_pings: int
+
+        :param max_pings, max_samples: size of the pixel grid of the image
+        :type max_pings, max_samples: int
+
+        :optional param method: 'mean' (linear) or 'max' to reduce Sv to the pixels of the image
+        :optional type method: str
+        '''
+        self.ping_step = max(int(np.ceil(n_pings/max_pings)), 1)
+        self.max_samples = max_samples
+        self.method = method
+        self.n_samples = None
+        self.sample_step = None
+        self.sample_range = None
+        self.blocks = []
+        self.ping_times = []
+        self.left_over = None
+
+    def add(self, Sv, ping_time, sample_range):
+        '''
+        Method to add the Sv of the next window of pings
+
+        :param Sv: Sv values (dB) by ping (rows) and sample (columns)
+        :type Sv: array(float)
+
+        :param ping_time: times for pings (rows) of Sv
+        :type ping_time: array(datetime64)
+
+        :param sample_range: range (m) for samples (columns) of Sv
+        :type sample_range: array(float)
+        '''
+        values = np.asarray(Sv, dtype=np.float32)
+        if self.n_samples is None:
+            self.n_samples = values.shape[1]
+            self.sample_step = int(np.ceil(self.n_samples/self.max_samples))
+            self.sample_range = np.asarray(sample_range)[::self.sample_step]
+        if values.shape[1] != self.n_samples:
+            padded = np.full((values.shape[0], self.n_samples), np.nan, dtype=np.float32)
+            padded[:, :min(values.shape[1], self.n_samples)] = values[:, :self.n_samples]
+            values = padded
+        if self.left_over is not None:
+            values = np.concatenate((self.left_over, values))
+        n_whole = values.shape[0]//self.ping_step*self.ping_step
+        if n_whole > 0:
+            self.blocks.append(self.reduce(values[:n_whole]))
+        self.left_over = values[n_whole:]
+        self.ping_times.append(np.asarray(ping_time))
+
+    def reduce(self, values):
+        '''
+        Method to reduce whole blocks of pings, as decimate does
+        '''
+        if self.ping_step == 1 and self.sample_step == 1:
+            return values
+        return reduce_blocks(values, self.ping_step, self.sample_step, method=self.method)
+
+    def finish(self):
+        '''
+        Method to reduce the pings left over at the end of the last window
+
+        :returns Sv, ping_time, sample_range: reduced arrays
+        '''
+        if self.left_over is not None and self.left_over.shape[0] > 0:
+            self.blocks.append(self.reduce(self.left_over))
+            self.left_over = None
+        ping_time = np.concatenate(self.ping_times)[::self.ping_step]
+
+        return np.concatenate(self.blocks), ping_time, self.sample_range
+
+class EchogramRenderer():
+    '''
+    Class for rendering echogram images in a pool of worker processes,
+    so that processing can continue while images are produced.
+    Each echogram is handed over as a snapshot of the Sv and bottom line.  With the 'echolab2' style
+    the image is the echolab2 Echogram plot of the full Sv, as before.  The 'reduced' style is opt-in:
+    Sv is reduced by blocks to the pixel grid of the image and drawn with imshow, which changes the images.
+    '''
+
+    def __init__(self, processes=2, max_pending=4, figsize=(18, 4.8), dpi=1200, method='mean', style='echolab2', reduced_dpi=150):
+        '''
+        Initialize the renderer and its pool of worker processes
+
+        :optional param processes: number of worker processes
+        :optional type processes: int
+
+        :optional param max_pending: number of echograms that can wait to be rendered before
+                                                submitting another one blocks until the oldest is finished
+        :optional type max_pending: int
+
+        :optional param method: 'mean' (linear) or 'max' to reduce Sv to the pixels of the image, for the 'reduced' style
+        :optional type method: str
+
+        :optional param style: 'echolab2' for the echolab2 Echogram plot of the full Sv, or 'reduced' for Sv
+                                    reduced to the pixels of the image and drawn with imshow
+        :optional type style: str
+
+        :optional param reduced_dpi: resolution of 'reduced' style images, Sv is reduced to the pixels of the axes at this resolution
+                                            (e.g. 2092 pings by 554 samples for the default figure), and dpi is used for the 'echolab2' style
+        :optional type reduced_dpi: int
+        '''
+        if style not in ('echolab2', 'reduced'):
+            raise ValueError('Unknown echogram style {}'.format(style))
+        self.style = style
+        self.figsize = figsize
+        self.dpi = dpi
+        self.max_pending = max_pending
+        self.method = method
+        self.reduced_dpi = reduced_dpi
+        # Reduced echograms are never larger than the pixel grid of the axes they are drawn in
+        self.max_pings = int(figsize[0]*AXES_FRACTION[0]*reduced_dpi)
+        self.max_samples = int(figsize[1]*AXES_FRACTION[1]*reduced_dpi)
+        self.pool = futures.ProcessPoolExecutor(max_workers=processes)
+        self.pending = collections.deque()
+
+    def decimate(self, Sv, ping_time, sample_range, bottom=None):
+        '''
+        Method to reduce an echogram to at most the pixel grid of the image,
+        so render time and memory do not depend on the number of pings
+
+        :returns Sv, ping_time, sample_range, bottom: reduced arrays
+        '''
+        ping_step = int(np.ceil(Sv.shape[0]/self.max_pings))
+        sample_step = int(np.ceil(Sv.shape[1]/self.max_samples))
+        if ping_step == 1 and sample_step == 1:
+            return np.asarray(Sv, dtype=np.float32), np.asarray(ping_time), np.asarray(sample_range), bottom
+        Sv = reduce_blocks(Sv, ping_step, sample_step, method=self.method)
+        ping_time = np.asarray(ping_time)[::ping_step]
+        sample_range = np.asarray(sample_range)[::sample_step]
+        if bottom is not None:
+            # The bottom line keeps the shallowest depth in each block of pings
+            bottom = reduce_line(bottom, ping_step)
+
+        return Sv, ping_time, sample_range, bottom
+
+    def reducer(self, n_pings):
+        '''
+        Method to start an echogram of n_pings pings that is reduced a window of pings at a time,
+        for a group that is streamed one file at a time
+
+        :returns reducer: add the Sv of each window to it and hand it to submit_reduced
+        :type reducer: ReducedEchogram
+        '''
+        return ReducedEchogram(n_pings, self.max_pings, self.max_samples, method=self.method)
+
+    def submit_reduced(self, file_name, reducer, bottom=None, bottom_color='k', threshold=(-70, -34)):
+        '''
+        Method to hand an echogram reduced a window of pings at a time to the pool to be rendered, in the 'reduced' style
+        If max_pending echograms are waiting, blocks until the oldest is finished.
+
+        :param reducer: echogram with the Sv of every ping added
+        :type reducer: ReducedEchogram
+
+        :optional param bottom: bottom line, not plotted if None
+        :optional type bottom: echolab2 line object
+        '''
+        while len(self.pending) >= self.max_pending:
+            self.check(self.pending.popleft())
+        values, ping_time, sample_range = reducer.finish()
+        bottom_depths = None if bottom is None else reduce_line(bottom.data, reducer.ping_step)
+        future = self.pool.submit(render_echogram, file_name, values, ping_time, sample_range,
+                                            bottom=bottom_depths, bottom_color=bottom_color, threshold=threshold,
+                                            figsize=self.figsize, dpi=self.reduced_dpi)
+        self.pending.append(future)
+
+    def submit(self, file_name, Sv, bottom=None, bottom_color='k', threshold=(-70, -34)):
+        '''
+        Method to hand an echogram to the pool to be rendered.
+        If max_pending echograms are waiting, blocks until the oldest is finished.
+
+        :param Sv: Sv of the primary channel, not changed after it is submitted
+        :type Sv: echolab2 processed_data object
+
+        :optional param bottom: bottom line, not plotted if None
+        :optional type bottom: echolab2 line object
+        '''
+        while len(self.pending) >= self.max_pending:
+            self.check(self.pending.popleft())
+        if self.style == 'echolab2':
+            future = self.pool.submit(render_echolab2_echogram, file_name, Sv, bottom=bottom, bottom_color=bottom_color,
+                                                threshold=threshold, figsize=self.figsize, dpi=self.dpi)
+        else:
+            values, ping_time, sample_range, bottom_depths = self.decimate(Sv.data, Sv.ping_time, Sv.range,
+                                                                                    bottom=None if bottom is None else bottom.data)
+            future = self.pool.submit(render_echogram, file_name, values, ping_time, sample_range,
+                                                bottom=bottom_depths, bottom_color=bottom_color, threshold=threshold,
+                                                figsize=self.figsize, dpi=self.reduced_dpi)
+        self.pending.append(future)
+
+    def check(self, future):
+        '''
+        Method to wait for an echogram to be rendered and log the result
+        '''
+        try:
+            logging.info('Finished rendering echogram {}'.format(future.result()))
+        except Exception as e:
+            logging.error('There was a problem rendering an echogram: {}'.format(e))
+
+    def drain(self, shutdown=False):
+        '''
+        Method to wait for all the pending echograms to be rendered
+
+        :optional param shutdown: also shut down the pool of worker processes
+        :optional type shutdown: bool
+        '''
+        while self.pending:
+            self.check(self.pending.popleft())
+        if shutdown:
+            self.pool.shutdown()
+
+    def close(self):
+        '''
+        Method to wait for the pending echograms and shut down the worker processes, at the end of a run
+        '''
+        self.drain(shutdown=True)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+'''
+Writer for Echoview line (.evl) files, used to store the bottom line for processed raw files.
+The format of each line is: YYYYMMDD HHmmssssss depth status
+'''
+
+import numpy as np
+
+EVL_HEADER = 'EVBD 3 13.0.396.45257'
+EVL_STATUS = 3
+
+def format_evl_lines(ping_times, depths):
+    '''
+    Method to format all pings of a line at once
+
+    :param ping_times: times for pings in the line
+    :type ping_times: array(datetime64)
+
+    :param depths: depth (m) of the line for each ping
+    :type depths: array(float)
+
+    :returns lines: array of formatted lines, each ending with a new line
+    :type lines: array(str)
+    '''
+    if len(ping_times) == 0:
+        return np.array([], dtype=str)
+
+    # Split the ISO time strings into date and time of day
+    parts = np.char.partition(np.datetime_as_string(ping_times), 'T')
+    dates = np.char.replace(parts[:, 0], '-', '')
+    # Drop the last digit of the time and remove the separators to get HHmmssss
+    times = parts[:, 2]
+    times = times.astype('U{}'.format(np.max(np.char.str_len(times))-1))
+    times = np.char.replace(np.char.replace(times, ':', ''), '.', '')
+    # Pad the fraction of a second to four digits, the first line is flagged with 00 and the rest 99
+    suffix = np.full(len(times), '99')
+    suffix[0] = '00'
+
+    lines = np.char.add(np.char.add(dates, ' '), np.char.add(times, suffix))
+    lines = np.char.add(np.char.add(lines, ' '), np.asarray(depths).astype(str))
+
+    return np.char.add(lines, ' {} \n'.format(EVL_STATUS))
+
+def write_evl(file_name, ping_times, depths, mask=None):
+    '''
+    Method to write a line to an evl file in a single write
+
+    :param file_name: path of the evl file to write
+    :type file_name: str
+
+    :param ping_times: times for pings in the line
+    :type ping_times: array(datetime64)
+
+    :param depths: depth (m) of the line for each ping
+    :type depths: array(float)
+
+    :optional param mask: boolean array with True for pings to write
+    :optional type mask: array(bool)
+
+    :returns number of points written
+    '''
+    ping_times = np.asarray(ping_times)
+    depths = np.asarray(depths)
+    if mask is not None:
+        mask = np.asarray(mask, dtype=bool)
+        ping_times = ping_times[mask]
+        depths = depths[mask]
+
+    lines = format_evl_lines(ping_times, depths)
+    with open(file_name, 'w') as f:
+        f.write(EVL_HEADER+'\n'+str(len(lines))+' \n'+''.join(lines.tolist()))
+
+    return len(lines)
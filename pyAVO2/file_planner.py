@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+'''
+Planning of which raw (and out) files are processed together.
+File names are parsed once for their start time (the -DYYYYMMDD-THHMMSS part of the name),
+then files are assigned to time bins and paired with out files using sorted searches.
+'''
+
+import logging
+import numpy as np
+import pandas as pd
+
+def parse_file_times(file_names):
+    '''
+    Method to get the start time of each file from its name
+
+    :param file_names: list of file names, with or without path
+    :type file_names: list(str)
+
+    :returns times: start time of each file
+    :type times: array(datetime64[s])
+    '''
+    iso_times = []
+    for f in file_names:
+        d = f[f.find('-D')+2:f.find('-D')+10]
+        t = f[f.find('-T')+2:f.find('-T')+8]
+        iso_times.append(d[0:4]+'-'+d[4:6]+'-'+d[6:8]+'T'+t[0:2]+':'+t[2:4]+':'+t[4:6])
+
+    return np.array(iso_times, dtype='datetime64[s]')
+
+def pair_out_files(file_times, out_files, out_times=None):
+    '''
+    Method to find the out file that holds the bottom data for each raw file:
+    the latest out file that starts at or before the raw file
+
+    :param file_times: start time of each raw file
+    :type file_times: array(datetime64)
+
+    :param out_files: list of out file names
+    :type out_files: list(str)
+
+    :optional param out_times: start time of each out file, parsed from out_files if not provided
+    :optional type out_times: array(datetime64)
+
+    :returns out_index: index into out_files for each raw file, -1 if there is no out file before it
+    :type out_index: array(int)
+    '''
+    if out_times is None:
+        out_times = parse_file_times(out_files)
+    if len(out_times) == 0:
+        return np.full(len(file_times), -1)
+    order = np.argsort(out_times, kind='stable')
+    ind = np.searchsorted(out_times[order], file_times, side='right') - 1
+    out_index = np.where(ind >= 0, order[np.maximum(ind, 0)], -1)
+
+    return out_index
+
+def plan_groups(files, size_unit, size_number, start_time=None, out_files=None):
+    '''
+    Method to organize the raw files into the groups that are processed together
+
+    :param files: list of raw file names
+    :type files: list(str)
+
+    :param size_unit: 'hour' or 'day' to group by time bins, or 'file' to group by a number of files
+    :type size_unit: str
+
+    :param size_number: number of units for each group
+    :type size_number: int
+
+    :optional param start_time: start processing at this time, ['yyyymmdd','hhmmss']
+    :optional type start_time: list(str)
+
+    :optional param out_files: list of out file names to pair with the raw files in each group
+    :optional type out_files: list(str)
+
+    :returns groups: list of groups, in processing order, each with 'files', 'out_files' and 'is_last'
+    :type groups: list(dict)
+    '''
+    files = np.asarray(files)
+    if len(files) == 0:
+        return []
+    # Start times are only needed to bin by time or to pair out files, so names without
+    # the -D...-T... stamp can still be grouped by a number of files
+    if size_unit in {'hour', 'day'} or out_files is not None:
+        file_times = parse_file_times(files)
+
+    if size_unit in {'hour', 'day'}:
+        # Edges of the time bins to cycle through
+        freq = str(size_number)+{'hour': 'h', 'day': 'D'}[size_unit]
+        if size_unit == 'hour':
+            if start_time:
+                start = pd.to_datetime(start_time[0]+'-'+start_time[1])
+            else:
+                start = file_times.min()
+            edges = pd.date_range(start, file_times.max()+np.timedelta64(size_number, 'h'), None, freq)
+            # Each bin runs from one edge to the next, so the first edge does not start a group
+            edges = edges.values.astype('datetime64[s]')
+            if len(edges) == 0:
+                logging.info('All files are before the start time, no files will be processed')
+                return []
+            bins = np.searchsorted(edges, file_times, side='right')
+            first_bin = 1
+        else:
+            if start_time:
+                start = pd.to_datetime(start_time[0]).date()
+            else:
+                start = file_times.min().astype('datetime64[D]')
+            edges = pd.date_range(start, file_times.max().astype('datetime64[D]'), None, freq)
+            # Each bin runs from an edge for the number of days specified
+            edges = edges.values.astype('datetime64[s]')
+            if len(edges) == 0:
+                logging.info('All files are before the start time, no files will be processed')
+                return []
+            bins = np.searchsorted(edges, file_times, side='right') - 1
+            bins[file_times >= edges[-1]+np.timedelta64(size_number, 'D')] = -1
+            first_bin = 0
+        in_range = np.logical_and(bins >= first_bin, bins < len(edges))
+        if not np.all(in_range):
+            logging.info('{} file(s) are outside the time range processed'.format(np.sum(np.logical_not(in_range))))
+        # Sort by bin, then by name within a bin, and split where the bin changes
+        order = np.lexsort((files, bins))
+        order = order[in_range[order]]
+        if len(order) == 0:
+            return []
+        splits = np.unique(bins[order], return_index=True)[1]
+        members = np.split(order, splits[1:])
+    else:
+        # Group on a number of files, in the order provided
+        members = [np.arange(i, min(i+size_number, len(files))) for i in range(0, len(files), size_number)]
+    # The last group processed is flagged so that the end of run steps (e.g. maps) are done with it
+    is_last = np.zeros(len(members), dtype=bool)
+    is_last[-1] = True
+
+    if out_files is not None:
+        out_files = np.asarray(out_files)
+        out_index = pair_out_files(file_times, out_files)
+
+    groups = []
+    for ind, last in zip(members, is_last):
+        group = {'files': files[ind].tolist(), 'out_files': None, 'is_last': bool(last)}
+        if out_files is not None:
+            paired = out_index[ind]
+            if np.any(paired < 0):
+                logging.warning('No out file was found before raw file(s) {}'.format(files[ind][paired < 0].tolist()))
+            group['out_files'] = np.unique(out_files[paired[paired >= 0]]).tolist()
+        groups.append(group)
+
+    return groups
@@ -1,12 +1,153 @@
 
-import logging, csv
-import pandas as pd
+import logging, csv, copy
 import numpy as np
-from astral import LocationInfo
-from astral.sun import sun
-from shapely.geometry import Point
-from shapely.geometry.polygon import Polygon
-from datetime import timedelta
+# pandas and shapely are imported in the filters that use them, so they are only loaded when those filters are enabled
+
+# Geometric solar elevation (degrees) at sunrise and sunset, for refraction and the radius of the sun
+SUNRISE_ELEVATION = -0.833
+
+# Filters available by name in filter_params, with the inputs each one needs and its relative cost
+FILTER_REGISTRY = {}
+
+def register_filter(name, inputs=(), cost=1):
+    '''
+    Decorator to add a filter function to FILTER_REGISTRY under name
+    The function is called as function(filterer, data, vals, inputs) and returns (idx_array, val)
+    
+    :param inputs: names of the inputs used by the filter: 'gps' (latitude & longitude), 'speed', 'bottom' or 'Sv'
+    :type inputs: tuple(str)
+    
+    :param cost: relative cost of the filter, cheaper filters are run first
+    :type cost: int
+    '''
+    def register(function):
+        FILTER_REGISTRY[name] = {'function': function, 'inputs': tuple(inputs), 'cost': cost}
+        return function
+    return register
+
+class FilterInputs():
+    '''
+    Class for the inputs of the filters, each one is fetched the first time a filter asks for it
+    Speed is part of the GPS data, so 'speed' comes from the 'gps' getter unless it has its own
+    'Sv' is only given for a group streamed one file at a time: the Sv statistics of each ping by filter name,
+    otherwise the Sv based filters convert Sv from the data object themselves
+    '''
+    
+    def __init__(self, getters=None, **values):
+        '''
+        :optional param getters: functions without arguments that return each input, by input name
+        :optional type getters: dict
+        
+        :optional param values: inputs that are already available, by input name, None if not available
+        '''
+        self.getters = getters or {}
+        self.values = {name: value for name, value in values.items() if value is not None}
+        
+    def __getitem__(self, name):
+        if name == 'speed' and name not in self.getters and name not in self.values:
+            name = 'gps'
+        if name not in self.values:
+            getter = self.getters.get(name)
+            self.values[name] = getter() if getter is not None else None
+        return self.values[name]
+        
+    def fetched(self, name):
+        '''
+        Method to check whether an input has been fetched, without fetching it
+        '''
+        return name in self.values
+
+def solar_terms(day):
+    '''
+    Method to compute the solar declination and equation of time for each minute of a UTC day,
+    with the NOAA solar position equations (Meeus, Astronomical Algorithms)
+    
+    :param day: UTC day
+    :type day: datetime64[D]
+    
+    :returns declination, eq_time: declination (radians) and equation of time (minutes) at minutes 0 to 1440 of the day
+    :type declination, eq_time: array(float)
+    '''
+    # Julian century of each minute
+    julian_day = (day.astype('datetime64[m]').astype(np.int64) + np.arange(1441))/1440 + 2440587.5
+    century = (julian_day-2451545)/36525
+    mean_long = np.radians((280.46646 + century*(36000.76983 + century*0.0003032)) % 360)
+    mean_anom = np.radians(357.52911 + century*(35999.05029 - 0.0001537*century))
+    eccent = 0.016708634 - century*(0.000042037 + 0.0000001267*century)
+    center = np.radians(np.sin(mean_anom)*(1.914602 - century*(0.004817 + 0.000014*century))
+                                + np.sin(2*mean_anom)*(0.019993 - 0.000101*century) + np.sin(3*mean_anom)*0.000289)
+    omega = np.radians(125.04 - 1934.136*century)
+    app_long = mean_long + center - np.radians(0.00569 + 0.00478*np.sin(omega))
+    obliq = np.radians(23 + (26 + (21.448 - century*(46.815 + century*(0.00059 - century*0.001813)))/60)/60 + 0.00256*np.cos(omega))
+    declination = np.arcsin(np.sin(obliq)*np.sin(app_long))
+    y = np.tan(obliq/2)**2
+    eq_time = 4*np.degrees(y*np.sin(2*mean_long) - 2*eccent*np.sin(mean_anom) + 4*eccent*y*np.sin(mean_anom)*np.cos(2*mean_long)
+                                    - 0.5*y*y*np.sin(4*mean_long) - 1.25*eccent*eccent*np.sin(2*mean_anom))
+    
+    return declination, eq_time
+
+def solar_elevation(ping_time, latitude, longitude, memo=None):
+    '''
+    Method to compute the solar elevation (degrees) of each ping from its own UTC time and position
+    
+    :param ping_time: UTC time of each ping
+    :type ping_time: array(datetime64)
+    
+    :param latitude, longitude: position (decimal degrees) of each ping
+    :type latitude, longitude: array(float)
+    
+    :optional param memo: solar_terms by day, added to for new days
+    :optional type memo: dict
+    
+    :returns elevation: solar elevation (degrees) of each ping
+    :type elevation: array(float)
+    '''
+    if memo is None:
+        memo = {}
+    ping_time = np.asarray(ping_time, dtype='datetime64[ns]')
+    days = ping_time.astype('datetime64[D]')
+    minutes = (ping_time-days)/np.timedelta64(1, 'm')
+    declination = np.empty(len(ping_time))
+    eq_time = np.empty(len(ping_time))
+    minute_grid = np.arange(1441)
+    for day in np.unique(days):
+        if day not in memo:
+            memo[day] = solar_terms(day)
+        ind = days == day
+        declination[ind] = np.interp(minutes[ind], minute_grid, memo[day][0])
+        eq_time[ind] = np.interp(minutes[ind], minute_grid, memo[day][1])
+    # Hour angle from the true solar time (minutes)
+    hour_angle = np.radians((minutes + eq_time + 4*np.asarray(longitude, dtype=float)) % 1440/4 - 180)
+    lat = np.radians(np.asarray(latitude, dtype=float))
+    cos_zenith = np.sin(lat)*np.sin(declination) + np.cos(lat)*np.cos(declination)*np.cos(hour_angle)
+    
+    return 90 - np.degrees(np.arccos(np.clip(cos_zenith, -1, 1)))
+
+def load_day_windows(file_name):
+    '''
+    Method to read a csv file of day windows by date range for the time filter
+    Columns are the start and end of the date range, then the sunrise and sunset times, after a header row
+    
+    :param file_name: csv file
+    :type file_name: str
+    
+    :returns windows: 'start' and 'end' of each date range (datetime64[ns]), sorted by start, and 'sunrise' and 'sunset'
+                            as nanoseconds of the day (int64)
+    :type windows: dict of arrays
+    '''
+    import pandas as pd
+    with open(file_name, 'r', newline='') as f:
+        data_reader = csv.reader(f, delimiter=',')
+        next(data_reader, None) # skip header
+        rows = [row[:4] for row in data_reader if len(row) >= 4]
+    # Each value is parsed on its own, as the columns can mix date and time formats
+    columns = [pd.DatetimeIndex([pd.to_datetime(row[i]) for row in rows], dtype='datetime64[ns]') for i in range(4)]
+    order = np.argsort(columns[0].values, kind='stable')
+    windows = {'start': columns[0].values[order], 'end': columns[1].values[order]}
+    for key, times in zip(['sunrise', 'sunset'], columns[2:]):
+        windows[key] = (times-times.normalize()).values.astype(np.int64)[order]
+    
+    return windows
 
 class Filter():
     '''
@@ -14,7 +155,7 @@ class Filter():
     In addition to filtering, class gives option to track ping statistics and remove marked intervals
     '''
 
-    def __init__(self, filter_params, pr_params=None):
+    def __init__(self, filter_params, pr_params=None, window_pings=None):
         '''
         Initialize filter parameters
         
@@ -22,15 +163,47 @@ class Filter():
         :type chunk_size: dict with key as filter names
         Must be one of the following: 'time_limit, 'speed_limit', 'latlon_limit', 'bottom', 'ringdown'
         
+        :optional param window_pings: number of pings to convert to Sv at once for the Sv based filters,
+                                                None to convert the whole group at once
+        :optional type window_pings: int
+        
         '''
         self.filter_params = filter_params
         self.pr_params = pr_params
+        self.window_pings = window_pings
         self.filtered_arrays = {}
+        # Filters not run on the last group because no pings were left, reported as skipped
+        self.skipped_filters = []
+        # Solar declination and equation of time by day, for the solar angle filter
+        self.solar_memo = {}
+        # Day windows of the csv file for the time filter are read once, by file name
+        self.day_windows = {}
+        time_vals = filter_params.get('time_limit') if filter_params else None
+        if time_vals is not None:
+            file_name = time_vals[0] if len(time_vals) == 2 else time_vals
+            if file_name != 'use_solar_angle':
+                self.get_day_windows(file_name)
+        
+    def required_inputs(self):
+        '''
+        Method to get the names of the inputs needed by the filters in filter_params
+
+        :returns inputs: names of the inputs, e.g. 'gps', 'speed', 'bottom', 'Sv'
+        :type inputs: set(str)
+        '''
+        inputs = set()
+        for filt in self.filter_params:
+            if filt in FILTER_REGISTRY:
+                inputs.update(FILTER_REGISTRY[filt]['inputs'])
+        return inputs
         
-    def do_all_filtering(self, data, gps_data=None, bottom_data=None):
+    def do_all_filtering(self, data, gps_data=None, bottom_data=None, inputs=None):
         '''
         Method to perform all the filtering that is specified by the filter params dictionary
-        Will go through each filter and call appropriate method
+        Filters are looked up in FILTER_REGISTRY and run from the cheapest to the most expensive.
+        Once no pings are left, the filters that need Sv are skipped, since they cannot change the result.
+        Skipped filters have no filtered array and are listed in self.skipped_filters, so they are reported
+        as skipped and not as applied.
         
         :param data: raw data object, which must contain raw power
         :type data: raw_data object derived from pyecholab2 raw_read method
@@ -41,31 +214,33 @@ class Filter():
         :param bottom_data: interpolated bottoms to ping data times
         :type bottom_data: array of length data.n_pings
         
+        :optional param inputs: inputs of the filters, fetched when a filter first needs them, used instead of gps_data and bottom_data
+        :optional type inputs: FilterInputs
+        
         :returns idx_array: boolean array with True for pings to keep after all filters applied
         :returns int for number of successful filters applied
         '''
+        if inputs is None:
+            inputs = FilterInputs(gps=gps_data, bottom=bottom_data)
         
         idx_array = np.ones(data.n_pings, dtype=bool)
+        self.skipped_filters = []
         # Keep track of success for all filter, start with 0  
         total_val = 0
-        for filt, vals in self.filter_params.items():
-            # Choose between filter names to select the right method to call
-            if filt == 'time_limit':
-                if len(vals)>2:
-                    idx_filt_array, val = self.filter_by_time(data, vals, gps_data=gps_data)
-                if len(vals)==2:
-                    idx_filt_array, val = self.filter_by_time(data, vals[0], gps_data=gps_data, time_shift = vals[1])
-            elif filt == 'speed_limit':
-                idx_filt_array, val = self.filter_by_speed(vals, gps_data)
-            elif filt == 'latlon_limit':
-                idx_filt_array, val = self.filter_by_latlon(vals, gps_data)
-            elif filt == 'bottom':
-                idx_filt_array, val = self.bottom_filter(data, vals, bottom_data=bottom_data)
-            elif filt == 'ringdown':
-                idx_filt_array, val = self.ringdown_filter(data, vals)
-            else:
+        # Unknown filters get no cost so they are reported first
+        order = sorted(self.filter_params, key=lambda filt: FILTER_REGISTRY[filt]['cost'] if filt in FILTER_REGISTRY else 0)
+        for filt in order:
+            vals = self.filter_params[filt]
+            if filt not in FILTER_REGISTRY:
                 val = False
                 logging.warning('Filter name, {}, not an available filter'.format(filt))
+            elif 'Sv' in FILTER_REGISTRY[filt]['inputs'] and not np.any(idx_array):
+                self.filtered_arrays[filt] = None
+                self.skipped_filters.append(filt)
+                logging.info('No pings are left, so filter {} was skipped'.format(filt))
+                continue
+            else:
+                idx_filt_array, val = FILTER_REGISTRY[filt]['function'](self, data, vals, inputs)
             
             if not val:
                 # Save filtered arrays for use again in computing ping statistics.  
@@ -80,31 +255,46 @@ class Filter():
                         
             # If a single one is True, consider it a success- 
             # This will indicate that nothing worked, or at least one did.
-            total_val = total_val + np.int(val)
+            total_val = total_val + int(val)
 
         return idx_array, total_val
         
         
+    def get_day_windows(self, file_name):
+        '''
+        Method to get the day windows of a csv file, read the first time they are needed
+        
+        :returns windows: output of load_day_windows, None if the file could not be read
+        :type windows: dict of arrays
+        '''
+        if file_name not in self.day_windows:
+            try:
+                self.day_windows[file_name] = load_day_windows(file_name)
+            except (OSError, ValueError) as e:
+                logging.warning('Could not read sunrise/sunset times from {}: {}'.format(file_name, e))
+                self.day_windows[file_name] = None
+        return self.day_windows[file_name]
+        
     def filter_by_time(self, data, vals, gps_data=None, time_zone='UTC', time_shift=0):
         '''
         Method to filter by time:  Remove data before sunrise and after sunset
         Either uses a csv file for fixed sunrise/sunset times by date range
-        OR finds the sunrise/sunset times from latitude, longitude and date of data
+        OR finds the solar elevation of each ping from its time, latitude and longitude
         
         :param data: raw data object, which must contain raw power
         :type data: raw_data object derived from pyecholab2 raw_read method
         
         :param vals: Either a csv file path with start and stop times by date range for sunset/sunrise
-                            OR 'use_solar_angle'- uses lat/lon & date to find solar angle- sunrise & sunset
+                            OR 'use_solar_angle'- uses lat/lon & time of each ping to find solar angle, kept when the sun is up
         :type vals: str
         
         :optional param gps_data: intepolated latitude and longitude to ping data times
         :type gps_data: dict with arrays of length data.n_pings
         
-        :optional time_zone: time zone for computing the time of day/solar angle.  Default is 'UTC'
+        :optional time_zone: not used, ping times are UTC.  Default is 'UTC'
         :type: time_zone: str
         
-        : optional time_shift: time shift (in hours) for shifting the ping time before finding time of day/solar angle
+        : optional time_shift: time shift (in hours) for shifting the ping time before finding time of day in the csv file
         : type: float
         
         :returns idx_array: boolean array with True for pings to keep
@@ -112,52 +302,36 @@ class Filter():
         
         '''
         data_time=data.ping_time
-        time_delta = timedelta(hours=time_shift)
-        sunrise=[]
-        sunset=[]
         if vals == 'use_solar_angle':
-            # Find sunrise and sunset for UTC at the location for these data
-            cur_lat = np.nanmean(gps_data['latitude'])
-            cur_lon = np.nanmean(gps_data['longitude'])
-            if np.isnan(cur_lat) or np.isnan(cur_lon):
+            # Day is when the sun is above the horizon, found for each ping from its own time and position
+            if gps_data is None or np.all(np.isnan(gps_data['latitude'])) or np.all(np.isnan(gps_data['longitude'])):
                 logging.warning('No latitude or longitude was found in gps data for using solar angle')
                 return False, False
-            # Use the date of the first ping to determine sunrise & sunset
-            # Most the data COULD be on the following day, but the change
-            # in sunrise & sunset from one day to the next is negligible.
-            cur_date = (pd.to_datetime(data_time[0])+time_delta).date()
-            loc = LocationInfo('Current', 'EBS', time_zone, cur_lat, cur_lon)
-            try:
-                sun_data = sun(loc.observer, date=cur_date, tzinfo=loc.timezone, dawn_dusk_depression=2)
-            except:
-                # The sun never went below the depression specified, so set the array to all true
-                logging.warning('Sun never went down to specified depression, continuing without daytime filter applied.')
-                idx_array = np.full((len(data_time),1),True)
-                return idx_array,  True
-            sunrise = pd.to_datetime(sun_data['sunrise']).time()
-            sunset = pd.to_datetime(sun_data['sunset']).time()
-            # Get the sunset for the same day, earlier
-            if pd.to_datetime(sun_data['sunset']).date()>cur_date:
-                cur_date = cur_date-timedelta(days=1)
-                sun_data = sun(loc.observer, date=cur_date, dawn_dusk_depression=2)
-                sunset = pd.to_datetime(sun_data['sunset']).time()
-
+            # Pings without a fix use the mean position
+            latitude = np.asarray(gps_data['latitude'], dtype=float)
+            longitude = np.asarray(gps_data['longitude'], dtype=float)
+            latitude = np.where(np.isnan(latitude), np.nanmean(latitude), latitude)
+            longitude = np.where(np.isnan(longitude), np.nanmean(longitude), longitude)
+            elevation = solar_elevation(data_time, latitude, longitude, memo=self.solar_memo)
+            return elevation > SUNRISE_ELEVATION, True
         else:
             # Get the day (sunrise=start_time) & night (sunset=end_time) limits for this file
-            with open(vals, 'r', newline='') as f:
-                data_reader=csv.reader(f, delimiter=',')
-                next(data_reader, None) # skip header
-                for row in data_reader:
-                    # Just look at the first time in the file to see if it is inside bounds
-                    if data_time[0]>pd.to_datetime(row[0]) and data_time[0]<pd.to_datetime(row[1]):
-                        sunrise=pd.to_datetime(row[2]).time()
-                        sunset=pd.to_datetime(row[3]).time()
-            if sunrise == []:
+            windows = self.get_day_windows(vals)
+            if windows is None:
+                return False, False
+            # Just look at the first time in the file to see if it is inside bounds
+            first_time = np.datetime64(data_time[0], 'ns')
+            ind = np.searchsorted(windows['start'], first_time, side='left')-1
+            if ind < 0 or not first_time < windows['end'][ind]:
                 logging.warning('No sunrise/sunset was found from data times in dates provided by CSV file')
                 return False, False
+            sunrise = windows['sunrise'][ind]
+            sunset = windows['sunset'][ind]
 
+        # Time of day of each ping in integer nanoseconds
+        ping_ns = np.asarray(data_time, dtype='datetime64[ns]').astype(np.int64) + int(round(time_shift*3600*10**9))
+        time_array = ping_ns % (86400*10**9)
         # Need to handle two cases because logical for index array changes depending on whether sunrise is before or after the sunset
-        time_array=(pd.to_datetime(data_time)+time_delta).time
         if sunrise < sunset:
             idx_array=np.logical_and(time_array>sunrise,  time_array<sunset)
         else:
@@ -198,6 +372,8 @@ class Filter():
         :returns idx_array: boolean array with True for pings to keep (inside region)
         :returns boolean for sucess of filter
         '''
+        from shapely.geometry import Point
+        from shapely.geometry.polygon import Polygon
         # Get the latitude and longitude for all the vertices
         idx_array = []
         pairs = vals[0]
@@ -214,7 +390,7 @@ class Filter():
         
         return np.array(idx_array), True
         
-    def bottom_filter(self, data, vals, bottom_data):
+    def bottom_filter(self, data, vals, bottom_data, mean_bottoms=None):
         '''
         Remove pings with Sv that varies from the running median of Sv mean (computed in linear)
         in a specified range of max Sv (near the bottom).
@@ -225,6 +401,10 @@ class Filter():
         :param vals: array of values for ringdown filtering- [ ] 
         :type vals: list(str,int) of length 6 or 7
         
+        :optional param mean_bottoms: Sv near the bottom of each ping from get_mean_bottoms, if it has already been
+                                                computed (e.g. a file at a time for a streamed group), otherwise it is computed from data
+        :optional type mean_bottoms: array(float)
+        
         :returns idx_array: boolean array with True for pings to keep after subsampling
         :returns boolean for sucess of filter
         '''
@@ -234,35 +414,14 @@ class Filter():
             return False, False
         
         # If there are no bottom data, then cannot perform this filter
-        if bottom_data == [] or bottom_data is None:
+        if bottom_data is None or len(bottom_data) == 0:
             logging.warning('No bottom data available for bottom filtering')
             return False,  False
         
         type = vals[0]
         
-        # Find Sv
-        Sv = data.get_Sv()
-        range_ind = np.logical_and(Sv.range>vals[1], Sv.range<vals[2])
-        mean_bottoms = []
-        top_line = []
-        bottom_line = []
-        for ping, bot, t_depth in zip(Sv, bottom_data, Sv.transducer_offset):
-            if not np.isnan(np.nanmax(ping[range_ind])):
-                #max_Sv=np.nanmax(ping[range_ind])
-                #max_ind=np.where(ping==max_Sv)
-                if vals[6]:
-                        bot = bot-t_depth
-                env_upper = bot-vals[3]
-                env_lower = bot+vals[4]
-                top_line.append(env_upper)
-                bottom_line.append(env_lower)
-                env_ind = np.logical_and(Sv.range >= env_upper, Sv.range<=env_lower)
-                if type == 'fixed':
-                    mean_bottoms = np.append(mean_bottoms, 10*np.log10(np.median(10**(ping[env_ind]/10))))
-                elif type == 'relative':
-                    mean_bottoms = np.append(mean_bottoms, 10*np.log10(np.median(10**(ping[env_ind]/10))))
-            else:
-                mean_bottoms=np.append(mean_bottoms, np.nan)
+        if mean_bottoms is None:
+            mean_bottoms = self.get_mean_bottoms(data, vals, bottom_data)
        
         if type == 'fixed':
             bool_bottom = mean_bottoms>vals[5]
@@ -272,8 +431,39 @@ class Filter():
         
         return bool_bottom, True
         
+    def get_mean_bottoms(self, data, vals, bottom_data):
+        '''
+        Method to find the median Sv (computed in linear) in the envelope around the bottom of each ping,
+        for the pings with Sv in the range of the bottom filter.  Each value only depends on its own ping,
+        so the values of the files of a group can be joined before the running median is computed.
+        
+        :param vals: values for bottom filtering, as in bottom_filter
+        :type vals: list(str,int) of length 7 or 8
         
-    def ringdown_filter(self, data, vals):
+        :param bottom_data: bottom depth of each ping of data
+        :type bottom_data: array(float)
+        
+        :returns mean_bottoms: Sv near the bottom of each ping, nan where there is no Sv in the range
+        :type mean_bottoms: array(float)
+        '''
+        # Find Sv, a window of pings at a time
+        mean_bottoms = np.full(data.n_pings, np.nan)
+        for start, stop, Sv in self.get_Sv_windows(data):
+            range_ind = np.logical_and(Sv.range>vals[1], Sv.range<vals[2])
+            # Values of earlier windows are replaced if the whole group is yielded
+            mean_bottoms[start:stop] = np.nan
+            for idx, ping, bot, t_depth in zip(range(start, stop), Sv, bottom_data[start:stop], Sv.transducer_offset):
+                if not np.isnan(np.nanmax(ping[range_ind])):
+                    if vals[6]:
+                            bot = bot-t_depth
+                    env_upper = bot-vals[3]
+                    env_lower = bot+vals[4]
+                    env_ind = np.logical_and(Sv.range >= env_upper, Sv.range<=env_lower)
+                    mean_bottoms[idx] = 10*np.log10(np.median(10**(ping[env_ind]/10)))
+        
+        return mean_bottoms
+        
+    def ringdown_filter(self, data, vals, mean_Sv=None):
         '''
         Remove pings with Sv that varies from the running median of Sv mean (computed in linear)
         in a specified range from transducer.
@@ -284,6 +474,10 @@ class Filter():
         :param vals: array of values for ringdown filtering- [ ] 
         :type vals: array(int) of length 4
         
+        :optional param mean_Sv: mean Sv in the range of each ping from get_mean_ringdown, if it has already been
+                                        computed (e.g. a file at a time for a streamed group), otherwise it is computed from data
+        :optional type mean_Sv: array(float)
+        
         :returns idx_array: boolean array with True for pings to keep after subsampling
         :returns boolean for sucess of filter
         '''
@@ -293,20 +487,134 @@ class Filter():
             logging.warning('Incorrect number input values for ringdown filtering')
             return False, False
             
-        # Find Sv
-        Sv=data.get_Sv()
-        # Find vertical range index from the last two entries of filter_values
-        range_idx=np.logical_and(Sv.range>=vals[2], Sv.range<=vals[3])
-        
-        # Find mean Sv in the range across all pings
-        # Should probably make this into a method, but good here for now.
-        mean_Sv=10*np.log10(np.mean(10**(Sv[:,range_idx]/10), axis=1))
+        if mean_Sv is None:
+            mean_Sv = self.get_mean_ringdown(data, vals)
         N = vals[0]
         medians = self.get_running_median(mean_Sv, N)
         
         # Now find pings inside the deviations- the 'good' ones
         return np.logical_and(mean_Sv<medians+vals[1], mean_Sv>(medians-vals[1])),  True
         
+    def get_mean_ringdown(self, data, vals):
+        '''
+        Method to find the mean Sv (computed in linear) of each ping in the range of the ringdown filter.
+        Each value only depends on its own ping, so the values of the files of a group can be joined
+        before the running median is computed.
+        
+        :param vals: values for ringdown filtering, as in ringdown_filter
+        :type vals: array(int) of length 4
+        
+        :returns mean_Sv: mean Sv in the range of each ping
+        :type mean_Sv: array(float)
+        '''
+        # Find mean Sv in the range across all pings, a window of pings at a time
+        # Only the samples down to the bottom of the range are converted to Sv
+        mean_Sv = np.full(data.n_pings, np.nan)
+        for start, stop, Sv in self.get_Sv_windows(data, max_range=vals[3]):
+            # Find vertical range index from the last two entries of filter_values
+            range_idx=np.logical_and(Sv.range>=vals[2], Sv.range<=vals[3])
+            mean_Sv[start:stop]=10*np.log10(np.mean(10**(Sv[:,range_idx]/10), axis=1))
+        
+        return mean_Sv
+        
+    def get_range_limited(self, data, max_range):
+        '''
+        Method to get a shallow copy of a data object with only the power samples needed to reach max_range,
+        so that Sv is converted for those samples only.  Sv of the samples kept is the same as in the full Sv,
+        since the range of each sample does not depend on the number of samples.
+        
+        :param data: raw data object, which must contain raw power
+        :type data: raw_data object derived from pyecholab2 raw_read method
+        
+        :param max_range: deepest range (m) needed
+        :type max_range: float
+        
+        :returns data: the copy, or data itself if the samples cannot be limited (e.g. no power, as with complex EK80 data)
+        :type data: raw_data object
+        '''
+        power = getattr(data, 'power', None)
+        if power is None or np.size(power) == 0:
+            return data
+        try:
+            # Thinnest samples need the most samples to reach max_range, plus the 2 samples of the TVG range correction
+            thickness = np.nanmin(np.asarray(data.sound_velocity)*np.asarray(data.sample_interval)/2)
+            n_samples = int(np.ceil(max_range/thickness))+3
+        except (AttributeError, TypeError, ValueError):
+            return data
+        if not np.isfinite(thickness) or thickness <= 0 or n_samples >= power.shape[1]:
+            return data
+        limited = copy.copy(data)
+        limited.power = power[:, :n_samples]
+        if hasattr(data, 'n_samples'):
+            limited.n_samples = n_samples
+        return limited
+        
+    def get_Sv_windows(self, data, max_range=None):
+        '''
+        Generator over Sv of a data object in windows of self.window_pings pings,
+        so that only one window of Sv is held in memory at a time (the raw data of the group are still all read).
+        Per ping values from the windows are combined before any running statistics are computed,
+        so the result is the same as converting the whole group at once, as long as every window is on the
+        same range grid.  The whole group is converted at once if the sample interval, sound speed or sample
+        offset change within the group, and if a window's range grid still differs from the first window's,
+        the whole group Sv is yielded for all pings, replacing the values from the earlier windows.
+        
+        :param data: raw data object, which must contain raw power
+        :type data: raw_data object derived from pyecholab2 raw_read method
+        
+        :optional param max_range: only convert the samples down to this range (m), None for all samples
+        :optional type max_range: float
+        
+        :yields start, stop, Sv: first and one past last ping index of the window, and the Sv for those pings
+        '''
+        if max_range is not None:
+            limited = self.get_range_limited(data, max_range)
+            if limited is not data:
+                try:
+                    windows = self.get_Sv_windows(limited)
+                    start, stop, Sv = next(windows)
+                except (AttributeError, IndexError, ValueError) as e:
+                    logging.info('Could not convert limited range to Sv, converting all samples: {}'.format(e))
+                else:
+                    # Fall back to all samples if the limited Sv does not reach max_range
+                    if Sv.range[-1] >= max_range:
+                        yield start, stop, Sv
+                        yield from windows
+                        return
+                    logging.info('Limited range Sv ended above {} m, converting all samples'.format(max_range))
+        if not self.window_pings or self.window_pings >= data.n_pings or not self.uniform_sampling(data):
+            yield 0, data.n_pings, data.get_Sv()
+            return
+        first_range = None
+        for start in range(0, data.n_pings, self.window_pings):
+            stop = min(start+self.window_pings, data.n_pings)
+            Sv = data.get_Sv(return_indices=np.arange(start, stop))
+            if first_range is None:
+                first_range = np.asarray(Sv.range)
+            elif not np.array_equal(first_range, np.asarray(Sv.range)):
+                logging.info('Range of Sv for pings {} to {} differs from the first window, converting all pings'.format(start, stop))
+                del Sv
+                yield 0, data.n_pings, data.get_Sv()
+                return
+            yield start, stop, Sv
+        
+    def uniform_sampling(self, data):
+        '''
+        Method to check that the sample interval, sound speed and sample offset are the same for every ping,
+        so that Sv windows are on the same range grid as the whole group
+        
+        :returns boolean for uniform sampling, False if the values are not available
+        '''
+        for name in ['sample_interval', 'sound_velocity', 'sample_offset']:
+            values = getattr(data, name, None)
+            if values is None:
+                return False
+            values = np.asarray(values, dtype=float)
+            if values.size > 1 and np.nanmax(values) != np.nanmin(values):
+                logging.info('{} changes within the group, converting all pings to Sv at once'.format(name))
+                return False
+        
+        return True
         
     def get_running_median(self, m, N):
         '''
@@ -385,6 +693,7 @@ class Filter():
                             file_tracker['removed'] = 'Y'
                             file_tracker['reason'] = filt
                             
+            tracker['skipped'] = list(self.skipped_filters)
             tracker['file_removed'] = file_tracker['removed']
             tracker['file_reason'] = file_tracker['reason']
             tracker['interval_removed'] = []
@@ -428,7 +737,12 @@ class Filter():
         
         '''
         if idx_array is None:
-            return [np.nan, np.nan, np.nan, np.nan, np.nan, 'N']
+            if idx_ss_array is None:
+                return [np.nan, np.nan, np.nan, np.nan, np.nan, 'N']
+            # Intervals of a filter that was not applied have bounds but no statistics, and are not removed
+            start_pings, end_pings = self.get_ping_stats(np.ones(len(idx_ss_array), dtype=bool), idx_ss_array=idx_ss_array)[0:2]
+            n_intervals = len(end_pings)
+            return [start_pings, end_pings, [np.nan]*n_intervals, [np.nan]*n_intervals, [np.nan]*n_intervals, ['N']*n_intervals]
         # Find percent of dropped pings by 'set' specified in self.pr_params
         if idx_ss_array is None:
             # This is an easy case- a reference boolean array was not passed in,
@@ -477,3 +791,37 @@ class Filter():
             
         ping_stats = [start_pings, end_pings, number_of_pings_removed, total_number_of_pings, percent, removed_interval]
         return ping_stats
+
+
+@register_filter('time_limit', inputs=('gps',), cost=1)
+def time_limit_filter(filterer, data, vals, inputs):
+    '''
+    Day time filter, vals is a csv file or 'use_solar_angle', or a list of that and a time shift (hours)
+    GPS data are only used with the solar angle
+    '''
+    time_shift = 0
+    if len(vals) == 2:
+        vals, time_shift = vals
+    gps_data = inputs['gps'] if vals == 'use_solar_angle' else None
+    return filterer.filter_by_time(data, vals, gps_data=gps_data, time_shift=time_shift)
+
+@register_filter('speed_limit', inputs=('speed',), cost=1)
+def speed_limit_filter(filterer, data, vals, inputs):
+    return filterer.filter_by_speed(vals, inputs['speed'])
+
+@register_filter('latlon_limit', inputs=('gps',), cost=2)
+def latlon_limit_filter(filterer, data, vals, inputs):
+    return filterer.filter_by_latlon(vals, inputs['gps'])
+
+@register_filter('ringdown', inputs=('Sv',), cost=10)
+def ringdown_filter(filterer, data, vals, inputs):
+    # The 'Sv' input has the Sv statistics of each ping by filter name when they were computed a file at a time
+    Sv_values = inputs['Sv'] or {}
+    return filterer.ringdown_filter(data, vals, mean_Sv=Sv_values.get('ringdown'))
+
+@register_filter('bottom', inputs=('bottom', 'Sv'), cost=20)
+def bottom_filter(filterer, data, vals, inputs):
+    # Bottom may be given as the bottom line object or its array of depths
+    bottom_data = inputs['bottom']
+    Sv_values = inputs['Sv'] or {}
+    return filterer.bottom_filter(data, vals, getattr(bottom_data, 'data', bottom_data), mean_bottoms=Sv_values.get('bottom'))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import os, csv, glob, logging
+import numpy as np
+
+class GpsTrackStore():
+    '''
+    Class for storing the ping-by-ping GPS track of processed file groups.
+    Each group is written in one call to its own .npz segment of columnar arrays,
+    which can be loaded back as arrays for mapping or exported to csv on demand.
+    '''
+    # Columns saved for each ping, in the order of the csv report
+    columns = ['ping_time', 'latitude', 'longitude', 'speed', 'file label', 'filter label']
+
+    def __init__(self, path):
+        '''
+        Initialize the store with the directory for the track segments
+
+        :param path: directory for track segments, with trailing slashes
+        :type path: str
+        '''
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def write_group(self, group_name, ping_times, gps_data):
+        '''
+        Method to write the track of a file group as a single segment
+
+        :param group_name: base name of the first file in the group, used as segment name
+        :type group_name: str
+
+        :param ping_times: times for pings in the group
+        :type ping_times: array(datetime64)
+
+        :param gps_data: latitude, longitude, speed, file label and filter label by ping
+        :type gps_data: dict with arrays of length ping_times
+
+        :returns boolean for success of write
+        '''
+        arrays = {'ping_time': np.asarray(ping_times)}
+        for key in self.columns[1:]:
+            arrays[key.replace(' ', '_')] = np.asarray(gps_data[key], dtype=float)
+        np.savez(self.path+group_name+'.npz', **arrays)
+
+        return True
+
+    def segment_names(self):
+        '''
+        Method to list the segments in the store, sorted by group name (start time of the group)
+        '''
+        return sorted(glob.glob(self.path+'*.npz'))
+
+    def read_all(self):
+        '''
+        Method to load all segments as concatenated arrays
+
+        :returns track: arrays for each column plus 'group' with the segment name on the first ping of each group
+        :type track: dict of arrays
+        '''
+        track = {key: [] for key in self.columns}
+        track['group'] = []
+        for segment in self.segment_names():
+            with np.load(segment) as f:
+                for key in self.columns:
+                    track[key].append(f[key.replace(' ', '_')])
+            names = np.full(len(track['ping_time'][-1]), '', dtype=object)
+            if len(names):
+                names[0] = os.path.basename(segment)[:-4]
+            track['group'].append(names)
+
+        if not track['group']:
+            logging.warning('No GPS track segments were found in {}'.format(self.path))
+            track['ping_time'] = np.array([], dtype='datetime64[ms]')
+            for key in self.columns[1:]:
+                track[key] = np.array([], dtype=float)
+            track['group'] = np.array([], dtype=object)
+            return track
+
+        for key in track:
+            track[key] = np.concatenate(track[key])
+
+        return track
+
+    def export_csv(self, file_name):
+        '''
+        Method to export all segments to a single csv report (gps_report format)
+
+        :param file_name: path of csv file to write
+        :type file_name: str
+
+        :returns number of rows written
+        '''
+        track = self.read_all()
+        rows = zip(track['group'], np.datetime_as_string(track['ping_time']), track['latitude'].tolist(),
+                            track['longitude'].tolist(), track['speed'].tolist(), track['file label'].tolist(),
+                            track['filter label'].tolist())
+        with open(file_name, 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile, delimiter=',')
+            csvwriter.writerow(['file name', 'ping time', 'latitude', 'longitude', 'speed', 'file label', 'filter label'])
+            csvwriter.writerows(rows)
+
+        return len(track['group'])
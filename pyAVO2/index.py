@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+'''
+Computation of the AVO index from the integration data loaded in the database (avobase).
+This follows index_tools/get_integration_data.m, index_tools/compute_one_year.m and the
+index weighting in compute_AVO_indices.m, with the loops over intervals and grid cells
+replaced by group-bys on a single table of intervals.
+
+Subsamples are expected to be organized into line 1 and line 11.
+'''
+
+import logging
+import numpy as np
+import pandas as pd
+
+# Nominal area of the eastern Bering Sea (2.5*10^5 km^2) in nmi^2
+EBS_AREA = 102043.62
+# Area of a grid cell in nmi^2
+CELL_AREA = 400
+# Line numbers of the two subsamples
+SUBSAMPLE_LINES = (1, 11)
+
+def get_integration_data(cursor, ship_id, survey_id, max_depth):
+    '''
+    Method to query the nasc by interval and class for a ship and survey
+
+    :param cursor: database cursor
+    :type cursor: avo_db.Cursor
+
+    :param max_depth: only integration cells with a max depth (m) at or above this are summed
+    :type max_depth: float
+
+    :returns data: one row per interval and class
+    :type data: DataFrame
+    '''
+    data = pd.DataFrame(cursor.get_integration_data(ship_id, survey_id, max_depth))
+    data['start_time'] = pd.to_datetime(data['start_time'])
+    data['end_time'] = pd.to_datetime(data['end_time'])
+    data['nasc'] = data['nasc'].astype(float)
+    data['ship_id'] = ship_id
+    data['survey_id'] = survey_id
+
+    return data
+
+def zero_fill(data, classes):
+    '''
+    Method to add a zero nasc row of the first class for every interval that has no row for the classes.
+    Otherwise, intervals without the class (e.g. no pollock) are not included in the averages.
+
+    :param data: one row per interval and class
+    :type data: DataFrame
+
+    :param classes: classes for which backscatter is combined, e.g. ['PK1']
+    :type classes: list(str)
+
+    :returns data with the zero rows appended
+    :type data: DataFrame
+    '''
+    has_class = data['id'].isin(data.loc[data['class'].isin(classes), 'id'])
+    # One row for each interval, copied from the first row found for it
+    fill = data[~has_class].drop_duplicates('id').copy()
+    fill['class'] = classes[0]
+    fill['nasc'] = 0.0
+
+    return pd.concat([data, fill], ignore_index=True)
+
+def interval_duration(data):
+    '''
+    Method to get the duration (s) of each interval
+    '''
+    return (data['end_time']-data['start_time']).dt.total_seconds()
+
+def select_intervals(data, classes, interval_min, time_max):
+    '''
+    Method to select the rows of the classes for complete intervals
+
+    :param interval_min: minimum number of pings in an interval
+    :type interval_min: int
+
+    :param time_max: intervals that are this long (s) or longer are excluded
+    :type time_max: float
+
+    :returns boolean Series with True for the rows used in the index
+    '''
+    return data['class'].isin(classes) & (interval_duration(data) < time_max) & (data['num_pings'] >= interval_min)
+
+def grid_stats(intervals):
+    '''
+    Method to compute the mean nasc of each grid cell from the selected intervals
+
+    :param intervals: selected rows, one per interval
+    :type intervals: DataFrame
+
+    :returns grids: indexed by grid_id with 'sA_weighted_by_dist', 'sA', 'total_dist' and 'count'
+    :type grids: DataFrame
+    '''
+    grouped = intervals.assign(weighted=intervals['nasc']*intervals['length']).groupby('grid_id')
+    total_dist = grouped['length'].sum()
+    grids = pd.DataFrame({'sA_weighted_by_dist': grouped['weighted'].sum()/total_dist,
+                                        'sA': grouped['nasc'].mean(),
+                                        'total_dist': total_dist,
+                                        'count': grouped.size()})
+
+    return grids
+
+def compute_one_year(data, classes, interval_min, time_max, min_number_intervals):
+    '''
+    Method to compute the backscatter by grid cell and the totals for a year
+
+    :param data: integration data for each ship and survey of the year
+    :type data: list(DataFrame)
+
+    :param classes: classes for which backscatter is combined, e.g. ['PK1']
+    :type classes: list(str)
+
+    :param interval_min: minimum number of pings in an interval
+    :type interval_min: int
+
+    :param time_max: intervals that are this long (s) or longer are excluded
+    :type time_max: float
+
+    :param min_number_intervals: grid cells with this many intervals or fewer are removed for an alternative estimate
+    :type min_number_intervals: int
+
+    :returns results: same fields as the results struct of compute_one_year.m
+    :type results: dict
+    '''
+    if isinstance(classes, str):
+        classes = [classes]
+    data = [zero_fill(d, classes) for d in data]
+    combined = pd.concat(data, ignore_index=True)
+    selected = combined[select_intervals(combined, classes, interval_min, time_max)]
+
+    grids = grid_stats(selected)
+    grids['station_id'] = selected.groupby('grid_id')['station_id'].first()
+    for line in SUBSAMPLE_LINES:
+        line_grids = grid_stats(selected[selected['line'] == line]).reindex(grids.index, fill_value=0)
+        for key in line_grids:
+            grids[key+str(line)] = line_grids[key]
+    # Grid cells without a station are not computed and left as 0, and the
+    # results end at the last grid cell with a station
+    has_station = grids['station_id'].fillna('') != ''
+    value_keys = [key for key in grids if key != 'station_id']
+    grids.loc[~has_station, value_keys] = 0
+    grids = grids.iloc[:np.flatnonzero(has_station)[-1]+1] if has_station.any() else grids.iloc[:0]
+    if not has_station.all():
+        logging.warning('{} grid cell(s) with data have no station'.format(np.sum(~has_station)))
+
+    def total(values):
+        return np.nansum(values)*CELL_AREA/(4*np.pi)
+
+    indA = (grids['count'] > min_number_intervals).values
+    results = {'mean_sA': grids['sA_weighted_by_dist'].values.mean(),
+                    'total_sigma_bs': total(grids['sA_weighted_by_dist']),
+                    'total_sigma_bs_unweighted': total(grids['sA']),
+                    'total_sigma_bs_min_count_applied': total(grids['sA_weighted_by_dist'][indA]),
+                    'grid_sA': grids['sA'].values,
+                    'grid_sA_weighted_by_dist': grids['sA_weighted_by_dist'].values,
+                    'grid_list': grids.index.values,
+                    'station_list': grids['station_id'].values,
+                    'count': grids['count'].values}
+    for line in SUBSAMPLE_LINES:
+        s = str(line)
+        ind = (grids['count'+s] > 0).values
+        weighted = grids['sA_weighted_by_dist'+s].values
+        results['total_sigma_bs'+s] = total(weighted)
+        results['mean_sA'+s] = weighted[ind].mean()
+        results['total_sigma_bs_unweighted'+s] = total(grids['sA'+s])
+        # The minimum count is applied with the counts of all data, as in compute_one_year.m
+        results['total_sigma_bs_min_count_applied'+s] = total(weighted[indA])
+        results['grid_sA'+s] = grids['sA'+s].values[ind]
+        results['grid_sA_weighted_by_dist'+s] = weighted
+        results['grid_list'+s] = grids.index.values[ind]
+        results['station_list'+s] = grids['station_id'].values[ind]
+        results['count'+s] = grids['count'+s].values[ind]
+
+    # Statistics from the processing for each ship and survey
+    results.update({key: [] for key in ['total_ints', 'number_rej_min_pings', 'number_rej_max_time',
+                                                        'number_rej_total', 'total_sA1', 'total_sA11']})
+    for d in data:
+        is_class = d['class'].isin(classes)
+        min_ind = (d['num_pings'] < interval_min) & is_class
+        max_ind = (interval_duration(d) > time_max) & is_class
+        results['total_ints'].append(is_class.sum())
+        results['number_rej_min_pings'].append(min_ind.sum())
+        results['number_rej_max_time'].append(max_ind.sum())
+        results['number_rej_total'].append((min_ind | max_ind).sum())
+        for line in SUBSAMPLE_LINES:
+            results['total_sA'+str(line)].append(d.loc[d['line'] == line, 'nasc'].sum())
+    for key in ['total_ints', 'number_rej_min_pings', 'number_rej_max_time', 'number_rej_total', 'total_sA1', 'total_sA11']:
+        results[key] = np.array(results[key])
+
+    return results
+
+def compute_index(results, ebs_area=EBS_AREA):
+    '''
+    Method to scale the total backscatter of a year to an index, to handle the different
+    number of grid cells in each year
+
+    :param results: output of compute_one_year
+    :type results: dict
+
+    :returns index: index values and rejection statistics for the year
+    :type index: dict
+    '''
+    index = {}
+    for s in ['', '1', '11']:
+        # Dimensionless scaler for the number of grid cells with data
+        scaler = len(results['grid_sA'+s])*CELL_AREA/ebs_area
+        name = '_ss'+s if s else ''
+        index['grid_count'+s] = len(results['grid_sA'+s])
+        index['index'+name] = results['total_sigma_bs'+s]/scaler
+        index['index_unweighted'+name] = results['total_sigma_bs_unweighted'+s]/scaler
+        index['index_min_applied'+s] = results['total_sigma_bs_min_count_applied'+s]/scaler
+    index['rej_min_pings'] = results['number_rej_min_pings'].sum()
+    index['rej_max_time'] = results['number_rej_max_time'].sum()
+    index['rej_total'] = results['number_rej_total'].sum()
+    index['total_ints'] = results['total_ints'].sum()
+    index['total_sA1'] = results['total_sA1'].sum()
+    index['total_sA11'] = results['total_sA11'].sum()
+
+    return index
+
+def compute_indices(cursor, ship_list, survey_list, max_depth, classes, interval_min, time_max,
+                                min_number_intervals, ebs_area=EBS_AREA, cache=None):
+    '''
+    Method to compute the index for a number of years
+
+    :param cursor: database cursor
+    :type cursor: avo_db.Cursor
+
+    :param ship_list, survey_list: ships and surveys for each year, one row per year
+    :type ship_list, survey_list: list(list(int))
+
+    :optional param cache: read the integration data through a local cache, refreshed from the cursor if it has changed
+    :optional type cache: integration_cache.IntegrationCache
+
+    :returns indices: index values by year
+    :type indices: DataFrame
+    '''
+    indices = {}
+    for ships, surveys in zip(ship_list, survey_list):
+        year = surveys[0]//100
+        logging.info('Working on year {}'.format(year))
+        if cache is not None:
+            data = [cache.get(ship, survey, max_depth) for ship, survey in zip(ships, surveys)]
+        else:
+            data = [get_integration_data(cursor, ship, survey, max_depth) for ship, survey in zip(ships, surveys)]
+        results = compute_one_year(data, classes, interval_min, time_max, min_number_intervals)
+        indices[year] = compute_index(results, ebs_area=ebs_area)
+
+    return pd.DataFrame.from_dict(indices, orient='index')
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+'''
+Local cache of the integration data used for index runs.
+The joined integration data of each ship and survey is extracted once to a columnar file
+(Parquet if pyarrow is installed, otherwise a pandas pickle) with a json watermark from the
+database beside it. The data is queried again only when the watermark in the database changes.
+'''
+
+import os, json, logging
+import pandas as pd
+from pyAVO2 import index
+
+class IntegrationCache():
+    '''
+    Class for reading the integration data of a survey from local files,
+    refreshed from the database (avobase) when it has changed
+    '''
+
+    def __init__(self, path, cursor=None):
+        '''
+        Initialize the cache with the directory for the files
+
+        :param path: directory for cache files, with trailing slashes
+        :type path: str
+
+        :optional param cursor: database cursor to check and refresh the cache, if None, only local files are read
+        :optional type cursor: avo_db.Cursor
+        '''
+        self.path = path
+        self.cursor = cursor
+        if not os.path.exists(path):
+            os.mkdir(path)
+        try:
+            import pyarrow
+            self.extension = '.parquet'
+        except ImportError:
+            logging.info('pyarrow is not installed, integration data is cached as pickle files')
+            self.extension = '.pkl'
+
+    def base_name(self, ship_id, survey_id, max_depth):
+        '''
+        Method to get the path of the files for a ship, survey and max depth, without extension
+        '''
+        return self.path+'integration_{}_{}_{}'.format(ship_id, survey_id, max_depth)
+
+    def read_watermark(self, ship_id, survey_id, max_depth):
+        '''
+        Method to read the watermark saved with the cached data
+
+        :returns watermark: None if the survey has not been cached
+        :type watermark: dict
+        '''
+        file_name = self.base_name(ship_id, survey_id, max_depth)+'.json'
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, 'r') as f:
+            return json.load(f)
+
+    def write(self, ship_id, survey_id, max_depth, data, watermark):
+        '''
+        Method to write the data and then its watermark, so a partial write is never read as current
+        '''
+        base_name = self.base_name(ship_id, survey_id, max_depth)
+        if self.extension == '.parquet':
+            data.to_parquet(base_name+self.extension, index=False)
+        else:
+            data.to_pickle(base_name+self.extension)
+        watermark = dict(watermark, format=self.extension)
+        with open(base_name+'.json', 'w') as f:
+            json.dump(watermark, f)
+
+    def read(self, ship_id, survey_id, max_depth, extension):
+        '''
+        Method to read cached data
+        '''
+        file_name = self.base_name(ship_id, survey_id, max_depth)+extension
+        if extension == '.parquet':
+            return pd.read_parquet(file_name)
+
+        return pd.read_pickle(file_name)
+
+    def get(self, ship_id, survey_id, max_depth, refresh=False):
+        '''
+        Method to get the integration data for a ship and survey, from the local file
+        if the database has not changed since it was written
+
+        :optional param refresh: query the data again even if the database has not changed
+        :optional type refresh: bool
+
+        :returns data: one row per interval and class, as index.get_integration_data
+        :type data: DataFrame
+        '''
+        cached = self.read_watermark(ship_id, survey_id, max_depth)
+        if self.cursor is None:
+            if cached is None:
+                raise ValueError('No cached integration data for ship {} survey {} and no database connection'.format(ship_id, survey_id))
+            return self.read(ship_id, survey_id, max_depth, cached['format'])
+
+        watermark = self.cursor.get_integration_watermark(ship_id, survey_id)
+        if not refresh and cached is not None:
+            if {key: cached.get(key) for key in watermark} == watermark:
+                logging.info('Using cached integration data for ship {} survey {}'.format(ship_id, survey_id))
+                return self.read(ship_id, survey_id, max_depth, cached['format'])
+        logging.info('Extracting integration data for ship {} survey {}'.format(ship_id, survey_id))
+        data = index.get_integration_data(self.cursor, ship_id, survey_id, max_depth)
+        self.write(ship_id, survey_id, max_depth, data, watermark)
+
+        return data
+
+    def extract(self, ship_list, survey_list, max_depth, refresh=False):
+        '''
+        Method to bring the cache up to date for a number of ships and surveys
+
+        :param ship_list, survey_list: ships and surveys, one row per year
+        :type ship_list, survey_list: list(list(int))
+
+        :returns number of surveys in the cache
+        '''
+        n = 0
+        for ships, surveys in zip(ship_list, survey_list):
+            for ship_id, survey_id in zip(ships, surveys):
+                self.get(ship_id, survey_id, max_depth, refresh=refresh)
+                n += 1
+
+        return n
@@ -3,8 +3,8 @@ import cartopy.crs as ccrs
 import matplotlib.pyplot as plt
 from matplotlib import cm
 import numpy as np
-from shapely.geometry import Point
-from shapely.geometry.polygon import Polygon
+from matplotlib.collections import LineCollection
+from matplotlib.path import Path
 
 
 class Map():
@@ -21,74 +21,102 @@ class Map():
         self.colorlist = C(np.arange(0,1,0.1).tolist())
         self.two_colorlist = [[0,  1,  0], [1, 0, 0]]
                                 
+        # Base map (projection, coastlines, border and grids) reused between maps
+        self.base_map = None
         self.do_save = map_params['save']
         if map_params['save']:
             self.save_path = map_params['save_path']
     
-    def draw_map(self, latitudes, longitudes, limits=None, labels=None, border=None, title=None, file_name=None, grids=None, legend=None):
-        
-        if not limits:
-            limits = self.limits
-        elif limits == 'find_limts':
-            limits = (round(np.nanmin(longitudes), 0), round(np.nanmax(longitudes), 0), round(np.nanmin(latitudes), 0), round(np.nanmax(latitudes), 0))
+    def get_base_map(self, limits, border=None, grids=None):
+        '''
+        Method to get the axes with the base layers of a map: projection, coastlines, 
+        region border and grid overlay.  The base map is rendered once and cached, 
+        so maps drawn with the same limits, border and grids only add their data layers.
         
-        if not labels:
-            labels = np.zeros(len(latitudes))
+        :returns ax: cartopy axes with the base layers drawn
+        '''
+        # Grids are keyed by the vertices that are drawn
+        grid_vertices = None if grids is None else np.array([g[0:4]+[g[0]] for g in grids], dtype=float)
+        key = (tuple(limits), None if border is None else np.asarray(border, dtype=float).tobytes(), 
+                    None if grids is None else (grid_vertices.shape, grid_vertices.tobytes()))
+        if self.base_map is not None and self.base_map['key'] == key:
+            return self.base_map['ax']
+        self.close()
         
         cen_lon = np.mean(limits[0:2])
         cen_lat = np.mean(limits[2:4])
         
-        ax = plt.axes(projection=ccrs.AlbersEqualArea(central_latitude=cen_lat, central_longitude=cen_lon))
+        fig = plt.figure()
+        ax = fig.add_subplot(1, 1, 1, projection=ccrs.AlbersEqualArea(central_latitude=cen_lat, central_longitude=cen_lon))
         ax.set_extent(limits)
         ax.coastlines()
         ax.gridlines(draw_labels=True, linewidth=1, color='gray', alpha=0.2, linestyle='--')
-        # Make sure it wraps around the first point
-        border.append(border[0])
         if border is not None:
-            plt.plot(np.transpose(border)[0], np.transpose(border)[1], color='black', linestyle='-', linewidth=2, transform=ccrs.Geodetic())
+            # Make sure it wraps around the first point
+            border = np.vstack((border, border[:1]))
+            ax.plot(border[:, 0], border[:, 1], color='black', linestyle='-', linewidth=2, transform=ccrs.Geodetic())
+
+        # Currently just plot all grids that are within the region if there is a border provided
+        # All selected grids are drawn as one collection of lines
+        if grids is not None:
+            if border is not None:
+                # A grid is in the region if any of its vertices are
+                region = Path(border)
+                in_region = region.contains_points(grid_vertices.reshape(-1, 2)).reshape(grid_vertices.shape[0:2]).any(axis=1)
+                grid_vertices = grid_vertices[in_region]
+            ax.add_collection(LineCollection(grid_vertices, colors='grey', linestyles='-', linewidths=.5, transform=ccrs.PlateCarree()))
+        
+        self.base_map = {'key': key, 'fig': fig, 'ax': ax}
+        return ax
+    
+    def close(self):
+        '''
+        Method to close the cached base map
+        '''
+        if self.base_map is not None:
+            plt.close(self.base_map['fig'])
+            self.base_map = None
+    
+    def draw_map(self, latitudes, longitudes, limits=None, labels=None, border=None, title=None, file_name=None, grids=None, legend=None):
+        
+        if not limits:
+            limits = self.limits
+        elif limits == 'find_limts':
+            limits = (round(np.nanmin(longitudes), 0), round(np.nanmax(longitudes), 0), round(np.nanmin(latitudes), 0), round(np.nanmax(latitudes), 0))
+        
+        if labels is None:
+            labels = np.zeros(len(latitudes))
+        
+        ax = self.get_base_map(limits, border=border, grids=grids)
+        # Keep track of the layers added to the base map, so they can be removed after saving
+        layers = []
         
         # If there are just two labels, use more opposing colors:
+        # Each set of labels is drawn as a single scatter of all its points
+        labels = np.asarray(labels)
         UL = np.unique(labels)
         UL = UL[np.logical_not(np.isnan(UL))]
         N = len(np.unique(labels))
         for l in UL:
-            ind = np.argwhere(labels==l)
+            ind = labels==l
             if N==2:
-                plt.plot(longitudes[ind], latitudes[ind], color=self.two_colorlist[int(l%len(self.two_colorlist))], marker='.', markersize=0.05, transform=ccrs.Geodetic(), label=l)
+                color = self.two_colorlist[int(l%len(self.two_colorlist))]
             else:
-                plt.plot(longitudes[ind], latitudes[ind], color=self.colorlist[int(l%len(self.colorlist))], marker='.', markersize=0.05, transform=ccrs.Geodetic(), label=l)
-
-        # Currently just plot all grids that are within the region if there is a border provided
-        if grids is not None:
-            for g in grids:
-                if border is not None:
-                    polygon = Polygon(border)
-                    in_region = False
-                    for p in g:
-                        if polygon.contains(Point(p[0], p[1])):
-                            in_region = True
-                    if in_region:
-                        bb_long = [g[0][0], g[1][0], g[2][0], g[3][0], g[0][0]]
-                        bb_lat = [g[0][1], g[1][1], g[2][1], g[3][1], g[0][1]]
-                        plt.plot(bb_long, bb_lat, color='grey', linestyle='-', linewidth=.5, transform=ccrs.Geodetic())
-                else:
-                    bb_long = [g[0][0], g[1][0], g[2][0], g[3][0], g[0][0]]
-                    bb_lat = [g[0][1], g[1][1], g[2][1], g[3][1], g[0][1]]
-                    plt.plot(bb_long, bb_lat, color='grey', linestyle='-', linewidth=.5, transform=ccrs.Geodetic())
+                color = self.colorlist[int(l%len(self.colorlist))]
+            layers.append(ax.scatter(longitudes[ind], latitudes[ind], color=[color], marker='.', s=0.05, linewidths=0, transform=ccrs.PlateCarree(), label=l))
         
         if legend is not None:
-            plt.legend()
+            layers.append(ax.legend(markerscale=50))
             
         # Labeling
-        if title is not None:
-            plt.title(title)
+        ax.set_title(title if title is not None else '')
         
         if self.do_save:
             if not file_name:
                 file_name = 'map'
-            plt.savefig(self.save_path+file_name, dpi=1200)
+            self.base_map['fig'].savefig(self.save_path+file_name, dpi=1200)
+            for layer in layers:
+                layer.remove()
         else:
             plt.show()
-
-        plt.clf()
-        
+            self.close()
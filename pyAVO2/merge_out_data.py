@@ -1,41 +1,257 @@
 # -*- coding: utf-8 -*-
 
-import logging
+import logging, mmap, struct, heapq, contextlib
 from echolab2.instruments.util.simrad_raw_file import RawSimradFile, SimradEOF
 from echolab2.instruments.util import simrad_parsers
-from pyAVO2 import avo_db
+from echolab2.instruments.util.date_conversion import nt_to_unix
+from pyAVO2.stage_timer import StageTimer
 import datetime
 
+# Datagrams are stored as: length (int32), type (4 chars), NT time (2 x uint32), contents, length (int32)
+DGRAM_LENGTH = struct.Struct('<l')
+DGRAM_HEADER = struct.Struct('<4sLL')
+
+def read_datagram_headers(buf):
+    '''
+    Generator over the datagrams of a raw/out file buffer that only reads the headers
+    
+    :param buf: contents of the file, e.g. a memory map
+    :type buf: bytes-like
+    
+    :yields offset, size, dgram_type, nt_time: offset and size in bytes of the whole datagram 
+    (including both length fields), the datagram type (e.g. b'DEP0') and the NT time stamp (100 ns ticks since 1601)
+    '''
+    offset = 0
+    end = len(buf)
+    while offset+4 <= end:
+        length = DGRAM_LENGTH.unpack_from(buf, offset)[0]
+        size = length+8
+        if length < DGRAM_HEADER.size or offset+size > end or DGRAM_LENGTH.unpack_from(buf, offset+size-4)[0] != length:
+            logging.warning('Bad or truncated datagram at byte {}, stopping read of this file'.format(offset))
+            return
+        dgram_type, low_date, high_date = DGRAM_HEADER.unpack_from(buf, offset+4)
+        yield offset, size, dgram_type, (high_date << 32) + low_date
+        offset += size
+
 class Merge():
     '''
     Class for combining a multiple out files into a single out file
     '''
-    def __init__(self,  load_params):
+    def __init__(self,  load_params, timer=None):
         '''
         Initialize Merge class with loading parameters
         
         :param load_params
         :type : dict with database connection params
+        
+        :optional param timer: timer to record the stages of each merge, e.g. the timer of the Process object
+        :optional type timer: StageTimer
         '''
+        self.timer = timer if timer is not None else StageTimer()
         
         if not load_params:
             self.need_to_load = False
         else:
             self.need_to_load = True
             self.load_params = load_params
+            # The database backend is only imported when loading is requested
+            from pyAVO2 import avo_db
             self.db_manager = avo_db.Connection(user=load_params['user'], 
                 password=load_params['password'], dsn=load_params['dsn'],
                                       schema=load_params['schema'])
             self.db_cursor = self.db_manager.cursor()
     
-    def merge(self, in_files, out_file_name):
+    def merge(self, in_files, out_file_name, fast=True, ordered=True, dedupe=True):
         '''
         Method to read in a list of input out files and combine them into a single file with out_file_name
+        
+        :optional param fast: copy the bytes of the datagrams straight to the output without parsing them
+        :optional type fast: bool
+        
+        :optional param ordered: with fast, merge the datagrams of all files by time instead of concatenating files
+        :optional type ordered: bool
+        
+        :optional param dedupe: with ordered, drop DEP0 datagrams identical to one already written for the same time
+        :optional type dedupe: bool
+        '''
+        
+        base_name = out_file_name[out_file_name.rfind('\\')+1:]
+        with self.timer.group(base_name, kind='merge'):
+            with self.timer.stage('merge'):
+                if fast and ordered:
+                    bytes_written, count, start_time, cur_time = self.time_merge_datagrams(in_files, out_file_name, dedupe=dedupe)
+                elif fast:
+                    bytes_written, count, start_time, cur_time = self.copy_datagrams(in_files, out_file_name)
+                else:
+                    bytes_written, count, start_time, cur_time = self.parse_datagrams(in_files, out_file_name)
+            logging.info("Done. " + str(bytes_written) + " bytes written to file.")
+            self.timer.count('files_read', len(in_files))
+            self.timer.count('bytes_written', bytes_written)
+            self.timer.count('pings_written', count)
+            
+            if self.need_to_load:
+                with self.timer.stage('db_insert'):
+                    from pyAVO2 import avo_db
+                    line = int(base_name[1:5])
+                    val = self.db_cursor.get_datafile(self.load_params['ship_id'], self.load_params['survey_id'], base_name)
+                    if not val:
+                        # If it isn't in the database already, insert it
+                        self.db_cursor.insert_datafile(self.load_params['ship_id'], self.load_params['survey_id'], return_id=False,
+                            line=line, file_name=base_name, start_time=start_time, end_time=cur_time,
+                            n_pings=int(count),
+                            clock_adj=0,
+                            mean_skew=0,
+                            stddev_skew=0,
+                            status=avo_db.StatusCodes.UNCHECKED)
+                        logging.info("File name " + str(base_name) + " written to database.")
+                    self.db_manager.commit()
+        
+        return True
+    
+    def copy_datagrams(self, in_files, out_file_name, buffer_size=2**24):
+        '''
+        Method to combine out files by copying the raw bytes of the datagrams that are kept:
+        the first config datagram (CON0), bottom depths (DEP0) and NMEA (NME0).
+        Only the datagram headers are read, from memory mapped input files,
+        and consecutive kept datagrams are written out in a single write.
+        
+        :returns bytes_written, count, start_time, cur_time: the same values as the parsing merge
+        '''
+        bytes_written = 0
+        count = 0
+        start_time = None
+        cur_nt_time = None
+        with open(out_file_name, 'wb', buffering=buffer_size) as out_fid:
+            for in_file in in_files:
+                with open(in_file, 'rb') as in_fid:
+                    try:
+                        buf = mmap.mmap(in_fid.fileno(), 0, access=mmap.ACCESS_READ)
+                    except ValueError:
+                        logging.warning('Out file {} is empty, skipping it'.format(in_file))
+                        continue
+                    with buf:
+                        run_start = None
+                        run_end = None
+                        for index, (offset, size, dgram_type, nt_time) in enumerate(read_datagram_headers(buf)):
+                            keep = dgram_type == b'DEP0' or dgram_type == b'NME0'
+                            # The first datagram of the first file is the config datagram
+                            if index == 0 and count == 0:
+                                keep = True
+                                start_time = nt_to_unix((nt_time & 0xFFFFFFFF, nt_time >> 32))
+                                count += 1
+                            elif dgram_type == b'DEP0':
+                                cur_nt_time = nt_time
+                                count += 1
+                            
+                            if keep and run_end == offset:
+                                run_end = offset+size
+                            else:
+                                if run_start is not None:
+                                    bytes_written += out_fid.write(buf[run_start:run_end])
+                                run_start, run_end = (offset, offset+size) if keep else (None, None)
+                        if run_start is not None:
+                            bytes_written += out_fid.write(buf[run_start:run_end])
+        
+        cur_time = None if cur_nt_time is None else nt_to_unix((cur_nt_time & 0xFFFFFFFF, cur_nt_time >> 32))
+        
+        return bytes_written, count, start_time, cur_time
+    
+    def time_merge_datagrams(self, in_files, out_file_name, dedupe=True, buffer_size=2**24):
+        '''
+        Method to combine out files with a streaming k-way merge of their datagrams by time,
+        so overlapping or out of order files give a single time ordered file.
+        The config datagram (CON0) of the earliest file is written first, followed by
+        the bottom depth (DEP0) and NMEA (NME0) datagrams of all files in time order.
+        Only datagram headers are read from memory mapped input files and the heap holds
+        one datagram per file, so memory use does not grow with the number or size of files.
+        Datagrams within each file are expected to be in time order, as written by the echosounder.
+        
+        :optional param dedupe: drop DEP0 datagrams identical to one already written for the same time
+        :optional type dedupe: bool
+        
+        :returns bytes_written, count, start_time, cur_time: the same values as the parsing merge
+        '''
+        def kept_datagrams(file_index, buf):
+            # Skip the config datagram of each file and keep bottom and NMEA datagrams
+            for index, (offset, size, dgram_type, nt_time) in enumerate(read_datagram_headers(buf)):
+                if index > 0 and (dgram_type == b'DEP0' or dgram_type == b'NME0'):
+                    yield nt_time, file_index, offset, size, dgram_type
+        
+        bytes_written = 0
+        count = 0
+        start_time = None
+        cur_nt_time = None
+        with contextlib.ExitStack() as stack:
+            buffers = []
+            configs = []
+            for in_file in in_files:
+                with open(in_file, 'rb') as in_fid:
+                    try:
+                        buf = stack.enter_context(mmap.mmap(in_fid.fileno(), 0, access=mmap.ACCESS_READ))
+                    except ValueError:
+                        logging.warning('Out file {} is empty, skipping it'.format(in_file))
+                        continue
+                first = next(read_datagram_headers(buf), None)
+                if first is None:
+                    continue
+                configs.append((first[3], len(buffers), first[0], first[1]))
+                buffers.append(buf)
+            
+            out_fid = stack.enter_context(open(out_file_name, 'wb', buffering=buffer_size))
+            if configs:
+                nt_time, file_index, offset, size = min(configs)
+                bytes_written += out_fid.write(buffers[file_index][offset:offset+size])
+                start_time = nt_to_unix((nt_time & 0xFFFFFFFF, nt_time >> 32))
+                count += 1
+            
+            # Datagrams already written at the current DEP0 time, for removing duplicates
+            written_depths = set()
+            run_file = None
+            run_start = None
+            run_end = None
+            for nt_time, file_index, offset, size, dgram_type in heapq.merge(*[kept_datagrams(i, buf) for i, buf in enumerate(buffers)]):
+                if dgram_type == b'DEP0':
+                    if nt_time != cur_nt_time:
+                        written_depths.clear()
+                    if dedupe:
+                        contents = buffers[file_index][offset:offset+size]
+                        if contents in written_depths:
+                            continue
+                        written_depths.add(contents)
+                    cur_nt_time = nt_time
+                    count += 1
+                
+                # Write consecutive datagrams from the same file in a single write
+                if file_index == run_file and offset == run_end:
+                    run_end = offset+size
+                else:
+                    if run_file is not None:
+                        bytes_written += out_fid.write(buffers[run_file][run_start:run_end])
+                    run_file, run_start, run_end = file_index, offset, offset+size
+            if run_file is not None:
+                bytes_written += out_fid.write(buffers[run_file][run_start:run_end])
+        
+        cur_time = None if cur_nt_time is None else nt_to_unix((cur_nt_time & 0xFFFFFFFF, cur_nt_time >> 32))
+        
+        return bytes_written, count, start_time, cur_time
+    
+    def parse_datagrams(self, in_files, out_file_name):
+        '''
+        Method to combine out files by parsing every datagram and writing back
+        the first config datagram (CON0), bottom depths (DEP0) and NMEA (NME0).
+        
+        :returns bytes_written, count, start_time, cur_time: number of bytes written, number of datagrams 
+        written (config and DEP0), and the time of the config and of the last DEP0 datagrams
         '''
         
         bytes_written = 0
+        start_time = None
+        cur_time = None
 
         out_fid = open(out_file_name, 'wb')
+        config_parser = simrad_parsers.SimradConfigParser()
+        depth_parser = simrad_parsers.SimradDepthParser()
+        nmea_parser = simrad_parsers.SimradNMEAParser()
         
         count=0
         for in_file in in_files:
@@ -48,7 +264,7 @@ class Merge():
             #  to generate a stream of bytes to write. FYI, the config datagram type in EK/ES60
             #  files is CON0.
             if count==0:
-                bytes_written += out_fid.write(simrad_parsers.SimradConfigParser().to_string(dgram))
+                bytes_written += out_fid.write(config_parser.to_string(dgram))
                 start_time = dgram['timestamp']
                 count += 1
 
@@ -67,33 +283,16 @@ class Merge():
                 #  based on the datagram type. DEP0 is the datagram that has the bottom depths
                 #  in an .out file.
                 if dgram['type'] == 'DEP0':
-                    bytes_written += out_fid.write(simrad_parsers.SimradDepthParser().to_string(dgram))
+                    bytes_written += out_fid.write(depth_parser.to_string(dgram))
                     cur_time = dgram['timestamp']
                     count += 1
 
                 #  NME0 are NMEA datagrams - if you want to omit NMEA datagrams from the combined file
                 #  you would just not include this block of code.
                 if dgram['type'] == 'NME0':
-                    bytes_written += out_fid.write(simrad_parsers.SimradNMEAParser().to_string(dgram))
+                    bytes_written += out_fid.write(nmea_parser.to_string(dgram))
 
             in_fid.close()
         out_fid.close()
-        logging.info("Done. " + str(bytes_written) + " bytes written to file.")
-        
-        if self.need_to_load:
-            base_name = out_file_name[out_file_name.rfind('\\')+1:]
-            line = int(base_name[1:5])
-            val = self.db_cursor.get_datafile(self.load_params['ship_id'], self.load_params['survey_id'], base_name)
-            if not val:
-                # If it isn't in the database already, insert it
-                self.db_cursor.insert_datafile(self.load_params['ship_id'], self.load_params['survey_id'], return_id=False,
-                    line=line, file_name=base_name, start_time=start_time, end_time=cur_time,
-                    n_pings=int(count),
-                    clock_adj=0,
-                    mean_skew=0,
-                    stddev_skew=0,
-                    status=avo_db.StatusCodes.UNCHECKED)
-                logging.info("File name " + str(base_name) + " written to database.")
-            self.db_manager.commit()
         
-        return True
+        return bytes_written, count, start_time, cur_time
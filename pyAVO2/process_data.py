@@ -1,21 +1,22 @@
 # -*- coding: utf-8 -*-
 
-import sys,  os, csv, logging
+import sys,  os, csv, logging, functools, datetime
 from echolab2.instruments import EK60,  EK80
-from echolab2.plotting.matplotlib import echogram
-from echolab2.processing import afsc_bot_detector
 from pyAVO2.subsample import Subsample
 from pyAVO2.triwave_correct import TriwaveCorrect
-from pyAVO2.filter import Filter
-from pyAVO2.map import Map
-from pyAVO2 import avo_db
+from pyAVO2.filter import Filter, FilterInputs, FILTER_REGISTRY
+from pyAVO2.gps_track import GpsTrackStore
+from pyAVO2.stage_timer import StageTimer
+from pyAVO2.bottom_cache import BottomCache, fill_bottom_gaps
+from pyAVO2 import evl, raw_scan
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.pyplot import figure
-import cartopy.io.shapereader as shpreader
-import shapefile
-import geopy.distance as gd
+# Parameters of the bottom detector, used when there are no bottom data in the out files
+# For NWExp 2025- search_min=15, backstep=40 was used for 2025 but it often went over fish near the bottom.  A better value is probably closer to 30, but should be tested in 2026
+# For AK Knight 2025- backstep=20 worked well.
+BOTTOM_DETECTOR_PARAMS = {'search_min': 15, 'backstep': 20}
+
+# Plotting, mapping, shapefile and database backends are imported 
+# where they are used, so they are only loaded when those features are enabled.
 
 class Process():
     '''
@@ -25,9 +26,36 @@ class Process():
     '''
     def __init__(self, instrument, primary_frequency, output_path,
                         minimum_pings_to_write, write_original, make_echogram, save_gps, load_params,
-                        pr_params, ss_params, triwave_params, filter_params, map_params):
+                        pr_params, ss_params, triwave_params, filter_params, map_params, window_pings=None, echogram_workers=2,
+                        profile_group=None, prescan=False, bottom_cache_path=None, echogram_style='echolab2', stream=False):
         '''
         Initializes Process class with parameters for processing
+        
+        :optional param window_pings: number of pings to convert to Sv at once in the Sv based filters,
+                                                None to convert the whole group (or file, with stream) at once
+        :optional type window_pings: int
+        
+        :optional param echogram_workers: number of worker processes rendering echograms in the background
+        :optional type echogram_workers: int
+        
+        :optional param profile_group: name (base name of the first file) or number (starting at 0) of a group to profile with cProfile
+        :optional type profile_group: str or int
+        
+        :optional param prescan: scan the ping times and NMEA of each group first, and do not read the groups 
+                                        that the time, region and speed filters remove completely, only write their reports
+        :optional type prescan: bool
+        
+        :optional param bottom_cache_path: directory for the read or detected bottom lines of each raw file, that are loaded
+                                                        instead of reading the out files or detecting the bottom again, None to not cache bottom lines
+        :optional type bottom_cache_path: str
+        
+        :optional param echogram_style: 'echolab2' for the echolab2 Echogram plot, or 'reduced' for Sv reduced to the pixels
+                                                    of the image and drawn with imshow (faster, but the images change)
+        :optional type echogram_style: str
+        
+        :optional param stream: read each group one raw file at a time (see process_stream), so the memory used does not
+                                        grow with the size of the group.  Each file is read more than once.
+        :optional type stream: bool
         '''
         # General set up parameters for processing
         self.instrument = instrument
@@ -36,7 +64,24 @@ class Process():
         self.minimum_pings_to_write = minimum_pings_to_write
         self.write_original = write_original
         self.make_echogram = make_echogram
+        if make_echogram:
+            from pyAVO2.echogram_renderer import EchogramRenderer
+            self.echogram_renderer = EchogramRenderer(processes=echogram_workers, style=echogram_style)
         self.save_gps = save_gps
+        self.window_pings = window_pings
+        self.stream = stream
+        if stream and make_echogram and echogram_style != 'reduced':
+            logging.info("Echograms of streamed groups are drawn in the 'reduced' style, the echolab2 Echogram plot needs the Sv of the whole group")
+        # Time of each stage is recorded by group in the logs folder
+        if not os.path.exists(output_path+'logs'):
+            os.mkdir(output_path+'logs')
+        self.timer = StageTimer(output_path+'logs\\', profile_group=profile_group)
+        # Number of pings removed from each channel of the last group, to align the channels
+        self.dropped_pings = {}
+        self.bottom_detector_params = BOTTOM_DETECTOR_PARAMS
+        self.bottom_cache = None
+        if bottom_cache_path is not None:
+            self.bottom_cache = BottomCache(bottom_cache_path, self.bottom_detector_params)
         need_gps_data = False
         need_bottom_data = False
 
@@ -59,18 +104,34 @@ class Process():
                 
         # Filtering for time of day, speed, bottom and ringdown
         self.filter_params = filter_params
+        self.prescan_filterer = None
+        self.gps_filterer = None
         N = len(filter_params)
         if not filter_params:
             do_filtering = False
         else:
             do_filtering = True
-            if 'time_limit' in filter_params or 'speed_limit' in filter_params or 'latlon_limit' in filter_params:
-                need_gps_data = True
-            if 'bottom' in filter_params:
-                need_bottom_data = True
             if 'latlon_limit' in filter_params:
                 filter_params['latlon_limit'][0] = self.get_latlon_pairs(filter_params['latlon_limit'][0], 2)
-            self.filterer = Filter(filter_params, pr_params=pr_params)
+            self.filterer = Filter(filter_params, pr_params=pr_params, window_pings=window_pings)
+            # Each filter declares the inputs it needs
+            required_inputs = self.filterer.required_inputs()
+            if 'gps' in required_inputs or 'speed' in required_inputs:
+                need_gps_data = True
+            if 'bottom' in required_inputs:
+                need_bottom_data = True
+            # The filters that only need ping times and GPS can be applied to a scan of the group before reading it
+            # Groups are always read when every group is written as an original file or an echogram
+            prescan_params = {filt: vals for filt, vals in filter_params.items()
+                                        if filt in FILTER_REGISTRY and set(FILTER_REGISTRY[filt]['inputs']) <= {'gps', 'speed'}}
+            if prescan and prescan_params:
+                if write_original or make_echogram:
+                    logging.warning('Groups are not prescanned, because original files or echograms are written for every group')
+                else:
+                    self.prescan_filterer = Filter(prescan_params)
+            # Streamed groups apply the same filters first, to find out whether the Sv based filters will be skipped
+            if stream and prescan_params:
+                self.gps_filterer = Filter(prescan_params)
             self.ping_stats = pr_params
         
         # Apply these settings for our process to use when feeding the filterer
@@ -84,6 +145,7 @@ class Process():
         if not map_params:
             self.map_params['make_map'] = False
         else:
+            from pyAVO2.map import Map
             map_params['save_path'] = output_path+'maps\\'
             self.mapper = Map(map_params)
             self.map_params['make_map'] = True
@@ -98,18 +160,22 @@ class Process():
             self.all_longitudes = []
             self.all_labels = []
             self.all_labels_by_filtering = []
-            self.gps_counter = 0
         
         # Set inital GPS data flag
         # Do not need to pass in GPS data unless there is a filter or file save requiring it
+        # GPS tracks are stored as one columnar segment per group and exported to gps_report.csv at the end of the run,
+        # save_gps='npz' only stores the segments.  Each run has its own folder of segments, so maps and reports only have this run.
         if save_gps:
-           need_gps_data = save_gps
+           need_gps_data = True
+           self.gps_store = GpsTrackStore(output_path+'gps_tracks\\run_{:%Y%m%d-%H%M%S}\\'.format(datetime.datetime.now()))
+           self.gps_counter = 0
         
         # Set up database object, if there will be loading of the data files table
         if not load_params:
             need_to_load = False
         if load_params:
             need_to_load = True
+            from pyAVO2 import avo_db
             self.db_manager = avo_db.Connection(user=load_params['user'], 
                 password=load_params['password'], dsn=load_params['dsn'],
                                       schema=load_params['schema'])
@@ -124,10 +190,107 @@ class Process():
         self.process_settings['need_gps_data'] = need_gps_data
         self.process_settings['need_bottom_data'] = need_bottom_data
         self.process_settings['need_to_load'] = need_to_load
+        self.process_settings['detect_bottom'] = False
+        # Whether the bottom line loaded from the out files in an earlier run is used instead of reading them
+        self.process_settings['cached_bottom'] = False
         
     def process(self, file_list, size_suffix, mk_dirs=True, last_one=False, out_list=None):
         '''
         Primary method to process data files
+        The time of each stage is recorded for the group and written to the logs folder
+        
+        '''
+        start_file = file_list[0]
+        with self.timer.group(start_file[start_file.rfind('\\')+1:-4]):
+            if self.prescan_filterer is not None:
+                scan = self.prescan_group(file_list)
+                if scan is not None:
+                    return self.process_rejected_group(scan, file_list, mk_dirs=mk_dirs, last_one=last_one)
+            if self.stream:
+                return self.process_stream(file_list, size_suffix, mk_dirs=mk_dirs, last_one=last_one, out_list=out_list)
+            return self.process_files(file_list, size_suffix, mk_dirs=mk_dirs, last_one=last_one, out_list=out_list)
+        
+    def close(self):
+        '''
+        Method to end a run: exports the GPS tracks of all groups to gps_report.csv, waits for the echograms
+        still being rendered, and checks their errors, then shuts down the rendering workers.
+        Call it after the last group, even if a group failed.
+        '''
+        if self.save_gps and self.save_gps != 'npz':
+            with self.timer.stage('gps_store'):
+                self.gps_store.export_csv(self.output_path+'gps_report.csv')
+        if self.make_echogram:
+            self.echogram_renderer.close()
+        
+    def prescan_group(self, file_list):
+        '''
+        Method to apply the filters that only need ping times and GPS to a scan of the raw files,
+        without reading the samples
+        
+        :returns scan: scan of the group with its 'gps_data' if these filters remove every ping, otherwise None
+        :type scan: raw_scan.ScanData
+        '''
+        with self.timer.stage('prescan'):
+            scan = raw_scan.scan_raw(file_list, self.primary_frequency)
+            if scan is None or scan.n_pings == 0:
+                return None
+            self.timer.count('pings_prescanned', scan.n_pings)
+            gps_data = scan.interpolate_gps()
+            gps_data = self.check_gps_data(gps_data, gps_data['speed'])
+            idx_array, val = self.prescan_filterer.do_all_filtering(scan, gps_data=gps_data)
+        if not val or np.any(idx_array):
+            return None
+        logging.info('All pings of {} are removed by the {} filter(s), so the group is not read'.format(file_list, ', '.join(self.prescan_filterer.filter_params)))
+        scan.gps_data = gps_data
+        return scan
+        
+    def process_rejected_group(self, scan, file_list, mk_dirs=True, last_one=False):
+        '''
+        Method to write the subsample and filter reports, and store the GPS track, of a group with no pings
+        left after the prescan, the same as process_files does for such a group
+        The scan keeps the pings found in every channel, as align_pings does, so the report rows are the same
+        as after a full read (checked by benchmarks/prescan_check.py).  Triwave correction is not done, so there
+        are no triwave report rows, and groups that process_files would skip after reading (e.g. a channel
+        split into several data objects by a change of settings) are still reported here
+        
+        :param scan: scan of the group from prescan_group
+        :type scan: raw_scan.ScanData
+        '''
+        start_file = file_list[0]
+        start_file_base_name = start_file[start_file.rfind('\\')+5:]
+        filter_inputs = FilterInputs(gps=scan.gps_data)
+        idx_array = np.zeros(scan.n_pings, dtype=bool)
+        for iters in range(self.ss_params['iterations']):
+            logging.info('Begin reporting iteration {} out of {}'.format(iters+1, self.ss_params['iterations']))
+            cur_iter, ss_line_prefix, out_dir, start_ping = self.get_iteration_output(iters, mk_dirs)
+            with self.timer.stage('subsample'):
+                idx_ss_array = np.ones(scan.n_pings, dtype=bool)
+                if self.ss_params['do_subsample']:
+                    if iters == 0:
+                        self.subsampler.make_bank(scan.n_pings)
+                    idx_ss_array, ss_starts, ss_stops, val = self.subsampler.subsample_from_bank(cur_iter)
+                    if val:
+                        val = self.write_csv_report('subsample_report', out_dir, ss_line_prefix+'-'+start_file_base_name[0:-4], cur_iter+1, scan.ping_time, (ss_starts, ss_stops), config=scan.configuration)
+            with self.timer.stage('filter'):
+                # The Sv based filters are skipped, since the cheaper filters already removed every ping
+                if iters == 0:
+                    idx_filt_array, val = self.filterer.do_all_filtering(scan, inputs=filter_inputs)
+                idx_ss_array, self.ping_stats['data'], self.ping_stats['tracking'] = self.filterer.remove_intervals(idx_ss_array)
+            logging.info("Did not write raw data to file, number of pings left did not exceed minimum pings")
+            with self.timer.stage('reports'):
+                if self.ss_params['do_subsample']:
+                    val = self.write_csv_report('filter_report', out_dir, ss_line_prefix+'-'+start_file_base_name[0:-4], cur_iter+1, scan.ping_time, self.ping_stats)
+                else:
+                    val = self.write_csv_report('filter_report', out_dir, start_file_base_name[0:-4], 1, scan.ping_time, self.ping_stats)
+        
+        self.finish_group(start_file_base_name, scan.ping_time, scan.gps_data, idx_array, last_one)
+        logging.info('\n \n FINISHED FILE \n')
+        
+        return True, False, False
+        
+    def process_files(self, file_list, size_suffix, mk_dirs=True, last_one=False, out_list=None):
+        '''
+        Method to process a group of data files, called by process
         
         '''
 
@@ -142,23 +305,25 @@ class Process():
         # Read in files from the file list.  pyecholab2 allows for providing multiple files
         # in a list to all be read into one raw_data object
         try:
-            ek.read_raw(file_list, progress_callback=self.read_write_callback)
+            with self.timer.stage('read_raw'):
+                ek.read_raw(file_list, progress_callback=self.read_write_callback)
             # If there are issues with non-primary frequencies, use this following commented out line to only process the primary
             #ek.read_raw(file_list, progress_callback=self.read_write_callback, frequencies=[self.primary_frequency])
             logging.info("Finished successful reading raw data from file(s) {}".format(file_list))
+            self.timer.count('files_read', len(file_list))
         except:
             logging.error("There was a problem with reading raw data from files {}".format(file_list))
             return False,  False
-        # Read in out files from the out file list
+        # Read in out files from the out file list, unless the line loaded from the same files is in the bottom cache
+        self.process_settings['cached_bottom'] = False
         if self.process_settings['need_bottom_data']:
-            try:
-                ek.read_bot(out_list, progress_callback=self.read_write_callback)
-                logging.info("Finished successful reading out data from file(s) {}".format(out_list))
+            if self.bottom_cache is not None and out_list:
+                self.process_settings['cached_bottom'] = self.bottom_cache.has(file_list, self.bottom_cache.group_key(file_list, out_list=out_list))
+            if self.process_settings['cached_bottom']:
+                logging.info("Bottom line loaded from {} is in the bottom cache, out files are not read".format(out_list))
                 self.process_settings['detect_bottom'] = False
-            except:
-                logging.error("There was a problem with reading out data from files {}, will detect bottom".format(out_list))
-                # Here instead of failing completely, use custom bottom detection
-                self.process_settings['detect_bottom'] = True
+            else:
+                self.read_bottom(ek, out_list)
             
         # Find the first file with path in the list and find the base name without path attached
         start_file = file_list[0]
@@ -166,52 +331,9 @@ class Process():
         orig_line_prefix = start_file[start_file.rfind('\\')+1:start_file.rfind('\\')+4]
         
         # Do some channel organization and clean up here
-        # Make sure 38 (primary, set at the beginning) is read first, 
-        # so the subsampling index from 38 can be applied to other frequencies
-        # In addition, there is some data quality issues with saildrone, where there is only one 'sector'
-        # In this case, just remove the file that has the bad data and move on.
-        channel_list = []
-        for key, value  in ek.frequency_map.items():
-            L = len(ek.raw_data[value[0]])
-            if self.instrument == 'EK80':
-                # Check to see if there is more than one data object for this channel ID
-                # This will happen for saildrone and we need to get rid of the one with a single sector
-                if L > 1:
-                    for idx in range(0, L):
-                        num_of_sectors = ek.raw_data[value[0]][idx].complex.shape[2]
-                        if num_of_sectors < 3:
-                            idx_to_remove = idx
-                    ek.raw_data[value[0]].remove(ek.raw_data[value[0]][idx_to_remove])
-                    # check to make sure the first file name is still in there
-                    start_file = ek.raw_data[value[0]][0].configuration[0]['file_name']
-            
-            # If there are a list of raw data objects, there is probably something wrong- 
-            # perhaps a setting was changed or there was an erroneous ping.
-            # If there is an 'empty' raw_data object, just remove it.
-            # If there are two non-empty raw_data objects or all empty raw_data objects, 
-            # then skip this file, make a note and move on.
-            skip_this_file = False
-            if L > 1:
-                idx_to_remove = []
-                for idx in range(0, L):
-                    if ek.raw_data[value[0]][idx].n_pings == 1 or ek.raw_data[value[0]][idx].power.size == 0:
-                        idx_to_remove = np.append(idx_to_remove, idx)
-                if len(idx_to_remove) == 0 or len(idx_to_remove) == L:
-                    skip_this_file = True
-                else:
-                    for i in np.flip(idx_to_remove):
-                        ek.raw_data[value[0]].remove(ek.raw_data[value[0]][int(i)])
-            if skip_this_file:
-                logging.error("There were two raw data objects for one frequency and could not determine the cause, so skipping {}".format(file_list))
-                return False,  False
-            
-            # Now check to see if this is the primary frequency to base index for others off of
-            # If so, keep track and make sure primary is the first in the list
-            if key == self.primary_frequency:
-                channel_list.insert(0, value[0])
-                channel_primary = value[0]
-            else:
-                channel_list.append(value[0])
+        channel_list, channel_primary = self.organize_channels(ek, file_list)
+        if channel_list is None:
+            return False,  False
         
         # Save whether triwave correction should be applied. 
         # It will be applied to the first iteration and then it does not need to be applied in the subsequent iterations.
@@ -219,54 +341,52 @@ class Process():
         wrote_a_raw_file = False
         wrote_an_evl_file = False
         tw_correct = self.triwave_params['do_triwave']
+        
+        # Begin by matching the pings between the frequencies, once for all iterations
+        self.dropped_pings = self.align_pings(ek, channel_list)
+        # Raw file of each ping for caching the bottom line, before the configuration of the first ping is applied to all pings
+        ping_files = None
+        if self.bottom_cache is not None and self.process_settings['need_bottom_data']:
+            ping_files = [ping['file_name'] for ping in ek.raw_data[channel_primary][0].configuration]
+        # The cached line loaded from the out files is used if it has every ping, otherwise the out files are read after all
+        cached_depths = None
+        if self.process_settings['cached_bottom']:
+            with self.timer.stage('bottom'):
+                cached_depths = self.bottom_cache.get(file_list, ping_files, ek.raw_data[channel_primary][0].ping_time, 
+                                                                        self.bottom_cache.group_key(file_list, out_list=out_list))
+            if cached_depths is None:
+                logging.info("Could not load the cached bottom line of {}, reading the out files".format(out_list))
+                self.process_settings['cached_bottom'] = False
+                self.read_bottom(ek, out_list)
         for iters in range(self.ss_params['iterations']):
             # After performing all the operations, we need to know whether at least one channel will be empty
             logging.info('Begin processing iteration {} out of {}'.format(iters+1, self.ss_params['iterations']))
             minimum_pings = True
             # Set up for subsampling with directories
-            if self.ss_params['do_subsample']:
-                cur_iter = int((iters+self.ss_params['chunk_start']-1)%(100/self.ss_params['percent']))
-                ss_str = str(cur_iter+1)
-                ss_line_prefix = 'L'+ss_str.zfill(4)
-                if mk_dirs:
-                    try:
-                        os.mkdir(self.output_path+'SS_'+ss_str)
-                        logging.info('Successful creation of folder: {}'.format('SS_'+ss_str))
-                    except: 
-                        logging.info(self.output_path+'SS_'+ss_str+' already exists')
-                out_dir = self.output_path+'SS_'+ss_str+'/'
-                start_ping = cur_iter*self.ss_params['chunk_size']
-            else:
-                out_dir =  self.output_path
-                cur_iter = 0
+            cur_iter, ss_line_prefix, out_dir, start_ping = self.get_iteration_output(iters, mk_dirs)
             # Create the empty raw index dictionary
             raw_index_array = {}
                     
-            # Begin by matching the pings between the frequencies.
-            # Do this by remove only on all frequencies
-            for channel in channel_list:
-                data = ek.raw_data[channel][0]
-                for channel_comp in channel_list:
-                    data_comp = ek.raw_data[channel_comp][0]
-                    if data_comp != data:
-                        data.match_pings(data_comp, remove_only=True)
-                    
             # first, iterate through the channels we have read (starting with 38)
             for channel in channel_list:
                 # And then the data objects associated with each channel
                 logging.info('Begin processing frequency channel {}'.format(channel))
                 for data in ek.raw_data[channel]: 
                     # Perform triwave correction if desired for every channel
+                    # Settings that change Sv are kept, as part of the key of a detected bottom line
+                    sv_settings = {'triwave': None}
                     if self.triwave_params['do_triwave']:
                         if data.n_pings<1360:
                             logging.warning('Too few pings to triwave correct.')
                             logging.warning('Triwave correction was not performed, skipping this step...')
                         else:
-                            data, fit_results, val = self.triwave_correcter.triwave_correct(data)
+                            with self.timer.stage('triwave'):
+                                data, fit_results, val = self.triwave_correcter.triwave_correct(data)
                             if not val:
                                 logging.warning('Triwave correction was not performed, skipping this step...')
                             else:
                                 logging.info('Triwave correction was performed successfully.')
+                                sv_settings['triwave'] = [self.triwave_params['start_sample'], self.triwave_params['end_sample']]
                                 val = self.write_csv_report('triwave_report', self.output_path, start_file_base_name[0:-4], data.frequency[0], None, fit_results)
                     
                     if channel==channel_primary:
@@ -276,133 +396,85 @@ class Process():
 
                         # Do initial processing to acquire GPS, bottom data or others
                         if iters == 0:
-                            # Try to read in bottom data
-                            if self.process_settings['need_bottom_data']:
-                                if hasattr(data, 'detected_bottom'):
-                                    bottom_data = data.get_bottom()
-                                    if bottom_data.data is None or len(np.where(np.isnan(bottom_data.data))[0])==len(bottom_data.data):
-                                        logging.info("There was a problem reading bottom data from {} file, will detect bottom".format(out_list))
-                                        self.process_settings['detect_bottom'] = True
-                                    else:
-                                        logging.info("Successfully read bottom data from {}".format(out_list))
-                                else:
-                                    logging.info("There was no bottom data available, will detect bottom")
-                                    self.process_settings['detect_bottom'] = True
-                                    bottom_data = []
-                            else:
-                                bottom_data = None
-                            # If bottom data is not available, detect it
-                            if self.process_settings['detect_bottom']:
-                                # For NWExp 2025- this was used for 2025 but it often went over fish near the bottom.  A better value is probably closer to 30, but should be tested in 2026
-                                #bot_detector = afsc_bot_detector.afsc_bot_detector(search_min=15, backstep=40)
-                                # For AK Knight 2025- this value of 20 worked well.
-                                bot_detector = afsc_bot_detector.afsc_bot_detector(search_min=15, backstep=20)
-                                Sv_data = data.get_Sv()
-#                                try:
-                                bottom_data, max_bottom_range= bot_detector.detect(Sv_data) 
-                                logging.info("Successfully detected bottom data for {}".format(file_list))
-#                                except:
-#                                    logging.info("Error in detecting bottom data for {}".format(file_list))
-                            # Fill nans in bottom with closest
-                            nan_inds = np.argwhere(np.isnan(bottom_data.data))
-                            while np.any(nan_inds):
-                                bottom_data.data[nan_inds] = bottom_data.data[nan_inds-1]
-                                nan_inds = np.argwhere(np.isnan(bottom_data.data))
-
-                            # Get GPS data, including position and speed
+                            self.timer.count('pings_read', data.n_pings)
+                            # Inputs of the filters are only fetched when they are first needed, e.g. bottom
+                            # detection is not done when the cheaper filters have already removed all the pings
+                            filter_inputs = FilterInputs({'gps': functools.partial(self.get_gps_data, ek, data),
+                                                        'bottom': functools.partial(self.get_bottom_data, data, out_list, file_list, ping_files, sv_settings, cached_depths)})
+                            # GPS data are also saved and mapped, so get them now
                             if self.process_settings['need_gps_data']:
-                                blank, gps_data = ek.nmea_data.interpolate(data, 'position')
-                                # Find any erroneous GPS fixes and set them to nan
-                                gps_data = self.mark_bad_gps_data(gps_data)
-                                no_gps = np.all(np.isnan(gps_data['latitude'])) or np.all(np.isnan(gps_data['longitude']))
-                                if no_gps:
-                                    logging.warning('There are no GPS data available.')
-                                fields, speeds = ek.nmea_data.interpolate(data, 'speed')
-                                speed_data = speeds[fields[0]]
-                                no_speed = np.any(np.isnan(speed_data))
-                                if no_speed:
-                                    logging.info('There are no speed data available.')
-                                    if no_gps:
-                                        logging.warning('There are no GPS data to compute speeds. No speeds will be used.')
-                                    else:
-                                        speed_data,  val = self.compute_speed_from_gps(speed_data, gps_data)
-                                        if val:
-                                            logging.info('Speed data successfully computed from GPS data')
-                                        else:
-                                            logging.info('Unable to find missing speed data from GPS. Some speeds may still be missing.')
-                                gps_data['speed'] = speed_data
+                                gps_data = filter_inputs['gps']
 
                         # Subsample
-                        if self.ss_params['do_subsample']:
-                            idx_ss_array, ss_starts, ss_stops, val = self.subsampler.subsample(data.ping_time.shape[0], start_ping)
-                            if not val:
-                                logging.warning('Subsampling was not performed, skipping this step...')
-                            else:
-                                logging.info('Subsamping was performed successfully on primary frequency.')
-                                if iters ==0:
-                                    val = self.write_csv_report('subsample_report', out_dir, ss_line_prefix+'-'+start_file_base_name[0:-4], cur_iter+1, data.ping_time, (ss_starts, ss_stops), config=data.configuration)
-                                    first_config = data.configuration.copy()
+                        with self.timer.stage('subsample'):
+                            if self.ss_params['do_subsample']:
+                                # Masks for all subsample offsets are computed once for this group and read by each iteration
+                                if iters == 0:
+                                    self.subsampler.make_bank(data.ping_time.shape[0])
+                                idx_ss_array, ss_starts, ss_stops, val = self.subsampler.subsample_from_bank(cur_iter)
+                                if not val:
+                                    logging.warning('Subsampling was not performed, skipping this step...')
                                 else:
-                                    val = self.write_csv_report('subsample_report', out_dir, ss_line_prefix+'-'+start_file_base_name[0:-4], cur_iter+1, data.ping_time, (ss_starts, ss_stops), config=first_config)
+                                    logging.info('Subsamping was performed successfully on primary frequency.')
+                                    if iters ==0:
+                                        val = self.write_csv_report('subsample_report', out_dir, ss_line_prefix+'-'+start_file_base_name[0:-4], cur_iter+1, data.ping_time, (ss_starts, ss_stops), config=data.configuration)
+                                        first_config = data.configuration.copy()
+                                    else:
+                                        val = self.write_csv_report('subsample_report', out_dir, ss_line_prefix+'-'+start_file_base_name[0:-4], cur_iter+1, data.ping_time, (ss_starts, ss_stops), config=first_config)
                                     
                         
                         # Filter for day, speed, and for dropouts (bottom and ringdown filters)
-                        if self.filter_settings['do_filtering']:
-                            if iters == 0:
-                                if self.filter_settings['need_gps_data']:
-                                    if 'bottom' in self.filter_params:
-                                        idx_filt_array, val = self.filterer.do_all_filtering(data, gps_data=gps_data, bottom_data=bottom_data.data)
-                                    else:
-                                        idx_filt_array, val = self.filterer.do_all_filtering(data, gps_data=gps_data)
-                                else:
-                                    if 'bottom' in self.filter_params:
-                                        idx_filt_array, val  = self.filterer.do_all_filtering(data, bottom_data=bottom_data.data)
-                                    else:
-                                        idx_filt_array, val  = self.filterer.do_all_filtering(data)
+                        with self.timer.stage('filter'):
+                            if self.filter_settings['do_filtering']:
+                                if iters == 0:
+                                    idx_filt_array, val = self.filterer.do_all_filtering(data, inputs=filter_inputs)
                                 
-                                # Save filtered array for use in following iterations, if needed
-                                if self.ss_params['iterations'] > 1:
-                                    idx_filt_array_saved = idx_filt_array
+                                    # Save filtered array for use in following iterations, if needed
+                                    if self.ss_params['iterations'] > 1:
+                                        idx_filt_array_saved = idx_filt_array
                                 
-                                # Remove intervals with dropouts above threshold provided
-                                idx_ss_array, self.ping_stats['data'], self.ping_stats['tracking'] = self.filterer.remove_intervals(idx_ss_array=idx_ss_array)
+                                    # Remove intervals with dropouts above threshold provided
+                                    idx_ss_array, self.ping_stats['data'], self.ping_stats['tracking'] = self.filterer.remove_intervals(idx_ss_array=idx_ss_array)
                                 
-                                if not val:
-                                    logging.warning('None of the filtering was successfully performed, skipped all')
-                                else:
-                                    idx_array = np.logical_and(idx_filt_array, idx_ss_array)
-                                    logging.info('{} out of {} filters were successfully applied'.format(val, self.filter_settings['number_of_filters']))
+                                    if not val:
+                                        logging.warning('None of the filtering was successfully performed, skipped all')
+                                    else:
+                                        idx_array = np.logical_and(idx_filt_array, idx_ss_array)
+                                        logging.info('{} out of {} filters were successfully applied'.format(val, self.filter_settings['number_of_filters']))
                                     
+                                else:
+                                   logging.info('Filtering from first iteration was successfully applied to following iteration')
+                                   idx_ss_array, self.ping_stats['data'], self.ping_stats['tracking'] = self.filterer.remove_intervals(idx_ss_array)
+                                   idx_array = np.logical_and(idx_filt_array_saved, idx_ss_array)
                             else:
-                               logging.info('Filtering from first iteration was successfully applied to following iteration')
-                               idx_ss_array, self.ping_stats['data'], self.ping_stats['tracking'] = self.filterer.remove_intervals(idx_ss_array)
-                               idx_array = np.logical_and(idx_filt_array_saved, idx_ss_array)
-                        else:
-                            idx_array = idx_ss_array
+                                idx_array = idx_ss_array
                             
                         # Save subsampling array and data from primary (typically 38 kHz)
                         idx_array_primary = idx_array.copy()
                         
                         # Save echogram image of primary frequency data in first iteration
-                        if self.make_echogram and iters == 0:
-                            if mk_dirs:
-                                try:
-                                    os.mkdir(self.output_path+'echograms')
-                                    logging.info('Successful creation of folder: echograms')
-                                except: 
-                                    logging.info(self.output_path+'echograms already exists')
-                            Sv = data.get_Sv()
-                            plot_data = Sv.copy()
-                            fig = figure(figsize=(18, 4.8))
-                            eg = echogram.Echogram(fig, plot_data, threshold=[-70, -34])
-                            # Plot bottom if has been loaded or detected- use different color depending on which
-                            if bottom_data is not None:
-                                if self.process_settings['detect_bottom']:
-                                    eg.plot_line(bottom_data, linewidth=0.05, color='k', linestyle='solid')
+                        with self.timer.stage('echogram'):
+                            if self.make_echogram and iters == 0:
+                                if mk_dirs:
+                                    try:
+                                        os.mkdir(self.output_path+'echograms')
+                                        logging.info('Successful creation of folder: echograms')
+                                    except: 
+                                        logging.info(self.output_path+'echograms already exists')
+                                # Hand a snapshot of Sv and the bottom line to the rendering pool and continue processing
+                                Sv = data.get_Sv()
+                                bottom_data = filter_inputs['bottom']
+                                # Plot bottom if has been loaded or detected- use different color depending on which
+                                if bottom_data is not None:
+                                    if self.process_settings['detect_bottom']:
+                                        bottom_color = 'k'
+                                    else:
+                                        bottom_color = 'g'
+                                    self.echogram_renderer.submit(self.output_path+'echograms\\'+start_file_base_name[0:-4], Sv, 
+                                                        bottom=bottom_data, bottom_color=bottom_color)
                                 else:
-                                    eg.plot_line(bottom_data, linewidth=0.05, color='g', linestyle='solid')
-                            fig.savefig(self.output_path+'echograms\\'+start_file_base_name[0:-4], dpi=1200)
-                            plt.close(fig)
+                                    self.echogram_renderer.submit(self.output_path+'echograms\\'+start_file_base_name[0:-4], Sv)
+                                del Sv
                     else:
                         # Use subsampled and filtered array from primary (typically 38 kHz)
                         idx_array = idx_array_primary
@@ -430,195 +502,1007 @@ class Process():
                 # Make dictionary that raw writer needs to write out the proper name
                 out_file_name = {orig_line_prefix+'-'+start_file_base_name:out_dir+ss_line_prefix+'-'+start_file_base_name[0:-4]+file_suffix}
                 # Write raw file
-                ek.write_raw(out_file_name, raw_index_array=raw_index_array, overwrite=True, progress_callback=self.read_write_callback)
+                with self.timer.stage('write_raw'):
+                    ek.write_raw(out_file_name, raw_index_array=raw_index_array, overwrite=True, progress_callback=self.read_write_callback)
                 logging.info("Finished writing raw data to file(s) {}".format(out_file_name))
+                self.timer.count('pings_written', np.sum(idx_array_primary))
                 wrote_a_raw_file = True
                 
                 # Write bottom file
+                bottom_data = filter_inputs['bottom']
                 if self.process_settings['detect_bottom']:
                     print('Writing bottom line file(s)')
-                    depths = bottom_data.data
-                    # Builld up the format for an evl:  YYYYMMDD HHmmssssss depth 3
-                    dates = bottom_data.ping_time
-                    years = dates.astype('datetime64[Y]').astype(int) + 1970
-                    months = dates.astype('datetime64[M]').astype(int) % 12 + 1
-                    days = (dates.astype('datetime64[D]') - dates.astype('datetime64[M]')).astype(int) + 1
                     base_bot_file_name = ss_line_prefix+'-'+start_file_base_name[0:-4]+file_suffix[:-4]+'.evl'
                     bot_file_name = out_dir+base_bot_file_name
-                    first_one = True
-                    with open(bot_file_name, 'w') as f:
-                        f.write('EVBD 3 13.0.396.45257\n'+str(np.sum(list(raw_index_array.values())[0]))+' \n')
-                        for y, m, d, t, depth, mask in zip(years, months, days, dates, depths, list(raw_index_array.values())[0]):
-                            if mask:
-                                # first column
-                                day = str(d)
-                                if len(day)==1:
-                                    day = '0'+day
-                                month = str(m)
-                                if len(month)==1:
-                                    month = '0'+month
-                                first = str(y)+month+day
-                                # second column
-                                t_string = str(t)
-                                time_string = t_string[t_string.find('T')+1:-1]
-                                time_string = time_string.replace(':', '')
-                                time_string = time_string.replace('.', '')
-                                if first_one:
-                                    second = time_string+'00'
-                                    first_one = False
-                                else:
-                                    second = time_string+'99'
-                            
-                                f.write(first+' '+second+' '+str(depth)+' '+'3 \n')
+                    with self.timer.stage('evl'):
+                        evl.write_evl(bot_file_name, bottom_data.ping_time, bottom_data.data, mask=list(raw_index_array.values())[0])
                     wrote_an_evl_file = True
-                if cur_iter+1 in self.load_params['ss_list']:
-                    # Need to check if this data file is already in there
-                    val = self.db_cursor.get_datafile(self.load_params['ship_id'], self.load_params['survey_id'],
-                        ss_line_prefix+'-'+start_file_base_name[0:-4]+file_suffix)
-                    if not val:
-                        # If it isn't in the database already, insert it
-                        self.db_cursor.insert_datafile(self.load_params['ship_id'], self.load_params['survey_id'], return_id=False,
-                            line=int(cur_iter+1), file_name=ss_line_prefix+'-'+start_file_base_name[0:-4]+file_suffix,
-                            start_time=pd.Timestamp(data.ping_time[idx_array_primary][0]),
-                            end_time=pd.Timestamp(data.ping_time[idx_array_primary][-1]),
-                            n_pings=int(sum(idx_array_primary)),
-                            clock_adj=0,
-                            mean_skew=0,
-                            stddev_skew=0,
-                            status=avo_db.StatusCodes.UNCHECKED)
-                            
-                        logging.info("Finished inserting data file {} info to data_files table".format(ss_line_prefix+'-'+start_file_base_name[0:-4]+file_suffix))
-                    else:
-                        logging.info("Data file {} is already in the data files table".format(ss_line_prefix+'-'+start_file_base_name[0:-4]+file_suffix))
-                        
-                    if self.process_settings['detect_bottom']:
-                        val = self.db_cursor.get_datafile(self.load_params['ship_id'], self.load_params['survey_id'],
-                            base_bot_file_name)
-                        if not val:
-                            # If it isn't in the database already, insert it
-                            self.db_cursor.insert_datafile(self.load_params['ship_id'], self.load_params['survey_id'], return_id=False,
-                                line=int(cur_iter+1), file_name=base_bot_file_name,
-                                start_time=pd.Timestamp(data.ping_time[idx_array_primary][0]),
-                                end_time=pd.Timestamp(data.ping_time[idx_array_primary][-1]),
-                                n_pings=int(sum(idx_array_primary)),
-                                clock_adj=0,
-                                mean_skew=0,
-                                stddev_skew=0,
-                                status=avo_db.StatusCodes.UNCHECKED)
-                            
-                            logging.info("Finished inserting data file {} info to data_files table".format(base_bot_file_name))
-                        else:
-                            logging.info("Data file {} is already in the data files table".format(base_bot_file_name))
-                        
+                with self.timer.stage('db_insert'):
+                    if self.process_settings['need_to_load'] and cur_iter+1 in self.load_params['ss_list']:
+                        self.insert_datafiles(cur_iter, ss_line_prefix+'-'+start_file_base_name[0:-4]+file_suffix, 
+                                                    base_bot_file_name if self.process_settings['detect_bottom'] else None, data.ping_time[idx_array_primary])
 
             else:
                 logging.info("Did not write raw data to file, number of pings left did not exceed minimum pings")
             
             # If it is desired to save an un-subsampled and un-filtered file 
             # that has the file grouping ('size') for referenced, do it here.
-            if self.write_original and iters == 0:
-                ocrf_name = 'original_compiled_raw_files'
-                if mk_dirs:
-                    try:
-                        os.mkdir(self.output_path+ocrf_name)
-                        logging.info('Successful creation of folder: '+ ocrf_name)
-                    except: 
-                        logging.info(self.output_path+ocrf_name+' already exists')
-                file_suffix = '-no_ss_no_filtering'+size_suffix
-                out_file_name = {start_file_base_name:self.output_path+ocrf_name+'\\'+start_file_base_name[0:-4]+file_suffix}
-                ek.write_raw(out_file_name, overwrite=True, progress_callback=self.read_write_callback)
-                logging.info("Finished writing original raw data to file(s) {}".format(out_file_name))
+            with self.timer.stage('write_original'):
+                if self.write_original and iters == 0:
+                    ocrf_name = 'original_compiled_raw_files'
+                    if mk_dirs:
+                        try:
+                            os.mkdir(self.output_path+ocrf_name)
+                            logging.info('Successful creation of folder: '+ ocrf_name)
+                        except: 
+                            logging.info(self.output_path+ocrf_name+' already exists')
+                    file_suffix = '-no_ss_no_filtering'+size_suffix
+                    out_file_name = {start_file_base_name:self.output_path+ocrf_name+'\\'+start_file_base_name[0:-4]+file_suffix}
+                    ek.write_raw(out_file_name, overwrite=True, progress_callback=self.read_write_callback)
+                    logging.info("Finished writing original raw data to file(s) {}".format(out_file_name))
             
             logging.info('\n FINISHED ITERATION')
             
             # Second time around, data does not need to be triwave corrected:
             self.triwave_params['do_triwave'] = False
             # Save reporting csv files:
-            if self.ss_params['do_subsample']:
-                val = self.write_csv_report('filter_report', out_dir, ss_line_prefix+'-'+start_file_base_name[0:-4], cur_iter+1, data.ping_time, self.ping_stats)
-            else:
-                val = self.write_csv_report('filter_report', out_dir, start_file_base_name[0:-4], 1, data.ping_time, self.ping_stats)
-                
-        if self.save_gps:
-            temp = np.zeros(len(idx_array))
-            temp[idx_array] = 1
-            gps_data['filter label'] = temp
-            gps_data['file label'] = np.ones(len(gps_data['latitude']))*self.gps_counter
-            val = self.write_csv_report('gps_report', self.output_path, start_file_base_name[0:-4], None, data.ping_time, gps_data)
-            self.gps_counter += 1
-            
-        if self.map_params['make_map'] and last_one:
-            try:
-                os.mkdir(self.output_path+'maps')
-                logging.info('Successful creation of folder: maps')
-            except: 
-                logging.info(self.output_path+'maps already exists')
-            
-            # Read data from gps report file
-            all_latitudes = []
-            all_longitudes = []
-            all_labels = []
-            all_labels_by_filtering = []
-            all_labels_speed = []
-            all_labels_hours = []
-            with open(self.output_path+'gps_report.csv') as csvfile:
-                csv_reader = csv.reader(csvfile, delimiter=',')
-                line_count = 0
-                for row in csv_reader:
-                    if line_count>0:
-                        all_labels_hours.append(int(row[1][11:13]))
-                        all_latitudes.append(float(row[2]))
-                        all_longitudes.append(float(row[3]))
-                        all_labels_speed.append(np.floor(float(row[4])))
-                        all_labels.append(float(row[5]))
-                        all_labels_by_filtering.append(float(row[6]))
-                    line_count+= 1
-            self.mapper.draw_map(np.array(all_latitudes), np.array(all_longitudes), labels=all_labels, border=self.map_params['region'], file_name='by_file', grids=self.map_params['grids'])
-            self.mapper.draw_map(np.array(all_latitudes), np.array(all_longitudes), labels=all_labels_by_filtering, border=self.map_params['region'], file_name='filtering', grids=self.map_params['grids'])
-            self.mapper.draw_map(np.array(all_latitudes), np.array(all_longitudes), labels=all_labels_speed, border=self.map_params['region'], file_name='speed', grids=self.map_params['grids'], legend=True)
-            self.mapper.draw_map(np.array(all_latitudes), np.array(all_longitudes), labels=all_labels_hours, border=self.map_params['region'], file_name='hours', grids=self.map_params['grids'], legend=True)
+            with self.timer.stage('reports'):
+                if self.ss_params['do_subsample']:
+                    val = self.write_csv_report('filter_report', out_dir, ss_line_prefix+'-'+start_file_base_name[0:-4], cur_iter+1, data.ping_time, self.ping_stats)
+                else:
+                    val = self.write_csv_report('filter_report', out_dir, start_file_base_name[0:-4], 1, data.ping_time, self.ping_stats)
                 
+        self.finish_group(start_file_base_name, data.ping_time, gps_data if self.save_gps else None, idx_array, last_one)
+        
         logging.info('\n \n FINISHED FILE \n')
         
         # Set value of triwave correct back to original state for processor object
         # This was changed for 2+ iterations because correction was already applied to data object for all frequencies
         self.triwave_params['do_triwave'] = tw_correct
         
-        self.db_manager.commit()
+        if self.process_settings['need_to_load']:
+            with self.timer.stage('db_insert'):
+                self.db_manager.commit()
         return True, wrote_a_raw_file, wrote_an_evl_file
     
+    def process_stream(self, file_list, size_suffix, mk_dirs=True, last_one=False, out_list=None):
+        '''
+        Method to process a group of data files one file at a time, called by process when stream is set,
+        so the memory used does not grow with the number of files in the group
+        The ping times, raw file of each ping and GPS of the group come from a scan of the files (raw_scan), and the
+        files are read one at a time when their samples are needed: to fit the triwave correction, for the Sv based filters,
+        the bottom line and the echogram, and to write the output files (a part for each file, joined into one file).
+        Values of each ping are put in arrays for the whole group before anything that spans pings is done (triwave fit,
+        subsampling, running medians, statistic intervals, filling bottom gaps), so the results are those of process_files, except:
+            - GPS data are interpolated from the NMEA of the scan, as for the prescan
+            - the bottom is detected on the Sv of each file
+            - echograms are drawn in the 'reduced' style
+        Groups that cannot be processed the same way a file at a time (e.g. a file with pings that do not match the scan,
+        or with other channels or sampling than the first file) are processed whole with process_files.
+        '''
+        with self.timer.stage('scan'):
+            scan = raw_scan.scan_raw(file_list, self.primary_frequency)
+        if scan is None or scan.n_pings == 0:
+            logging.warning('Could not scan the pings of {}, reading the whole group'.format(file_list))
+            return self.process_files(file_list, size_suffix, mk_dirs=mk_dirs, last_one=last_one, out_list=out_list)
+        stream = self.start_stream(scan, file_list, out_list)
+        self.timer.count('pings_read', scan.n_pings)
+        
+        # Find the first file with path in the list and find the base name without path attached
+        start_file = file_list[0]
+        start_file_base_name = start_file[start_file.rfind('\\')+5:]
+        orig_line_prefix = start_file[start_file.rfind('\\')+1:start_file.rfind('\\')+4]
+        wrote_a_raw_file = False
+        wrote_an_evl_file = False
+        
+        # GPS data from the NMEA of the whole group
+        gps_data = None
+        if self.process_settings['need_gps_data']:
+            with self.timer.stage('gps'):
+                gps_data = scan.interpolate_gps()
+                gps_data = self.check_gps_data(gps_data, gps_data['speed'])
+        
+        # Triwave correction is fit to the pings of the whole group, and applied to each file as it is read
+        if self.triwave_params['do_triwave']:
+            self.stream_triwave(stream)
+            if stream['failed']:
+                return self.process_files(file_list, size_suffix, mk_dirs=mk_dirs, last_one=last_one, out_list=out_list)
+        
+        # The Sv based filters are skipped if the filters on GPS and time remove every ping, as in Filter.do_all_filtering
+        Sv_filters = []
+        if self.filter_settings['do_filtering']:
+            Sv_filters = [filt for filt in self.filter_params if filt in FILTER_REGISTRY and 'Sv' in FILTER_REGISTRY[filt]['inputs']]
+        if Sv_filters and self.gps_filterer is not None:
+            with self.timer.stage('filter'):
+                idx_gps_array, val = self.gps_filterer.do_all_filtering(scan, gps_data=gps_data)
+            if not np.any(idx_gps_array):
+                Sv_filters = []
+        ringdown = 'ringdown' in Sv_filters and len(self.filter_params['ringdown']) == 4
+        mean_bottoms = 'bottom' in Sv_filters and len(self.filter_params['bottom']) in (7, 8)
+        bottom_line = mean_bottoms or (self.make_echogram and self.process_settings['need_bottom_data'])
+        if ringdown or bottom_line or self.make_echogram:
+            if not self.stream_Sv(stream, ringdown=ringdown, mean_bottoms=mean_bottoms, bottom_line=bottom_line, echogram=self.make_echogram):
+                return self.process_files(file_list, size_suffix, mk_dirs=mk_dirs, last_one=last_one, out_list=out_list)
+        
+        # Inputs of the filters, the bottom line is only read or detected when it is first needed
+        filter_inputs = FilterInputs({'bottom': functools.partial(self.get_stream_bottom, stream)}, gps=gps_data, Sv=stream['Sv_values'])
+        
+        # Subsample and filter for every iteration first, the files are then read once to write the outputs of all iterations
+        iterations = []
+        for iters in range(self.ss_params['iterations']):
+            logging.info('Begin processing iteration {} out of {}'.format(iters+1, self.ss_params['iterations']))
+            cur_iter, ss_line_prefix, out_dir, start_ping = self.get_iteration_output(iters, mk_dirs)
+            idx_array = np.ones(scan.n_pings, dtype=bool)
+            idx_ss_array = np.ones(scan.n_pings, dtype=bool)
+            ss_report = None
+            with self.timer.stage('subsample'):
+                if self.ss_params['do_subsample']:
+                    # Masks for all subsample offsets are computed once for this group and read by each iteration
+                    if iters == 0:
+                        self.subsampler.make_bank(scan.n_pings)
+                    idx_ss_array, ss_starts, ss_stops, val = self.subsampler.subsample_from_bank(cur_iter)
+                    if not val:
+                        logging.warning('Subsampling was not performed, skipping this step...')
+                    else:
+                        logging.info('Subsamping was performed successfully on primary frequency.')
+                        ss_report = (ss_starts, ss_stops)
+            
+            # Filter for day, speed, and for dropouts (bottom and ringdown filters)
+            with self.timer.stage('filter'):
+                if self.filter_settings['do_filtering']:
+                    if iters == 0:
+                        idx_filt_array, val = self.filterer.do_all_filtering(scan, inputs=filter_inputs)
+                        # Remove intervals with dropouts above threshold provided
+                        idx_ss_array, self.ping_stats['data'], self.ping_stats['tracking'] = self.filterer.remove_intervals(idx_ss_array=idx_ss_array)
+                        if not val:
+                            logging.warning('None of the filtering was successfully performed, skipped all')
+                        else:
+                            idx_array = np.logical_and(idx_filt_array, idx_ss_array)
+                            logging.info('{} out of {} filters were successfully applied'.format(val, self.filter_settings['number_of_filters']))
+                    else:
+                        logging.info('Filtering from first iteration was successfully applied to following iteration')
+                        idx_ss_array, self.ping_stats['data'], self.ping_stats['tracking'] = self.filterer.remove_intervals(idx_ss_array)
+                        idx_array = np.logical_and(idx_filt_array, idx_ss_array)
+                else:
+                    idx_array = idx_ss_array
+            if stream['failed']:
+                return self.process_files(file_list, size_suffix, mk_dirs=mk_dirs, last_one=last_one, out_list=out_list)
+            
+            iteration = {'cur_iter': cur_iter, 'ss_line_prefix': ss_line_prefix, 'out_dir': out_dir, 'idx_array': idx_array,
+                                'ss_report': ss_report, 'ping_stats': dict(self.ping_stats) if self.filter_settings['do_filtering'] else None,
+                                'out_file_name': None}
+            # Write a new file if there are enough pings left over after subsampling and filtering
+            if np.sum(idx_array) >= self.minimum_pings_to_write:
+                # Designate more specific file name for subsampling.
+                # If subsampling wasn't performed, then just use suffix with file grouping ('size') information
+                if self.ss_params['do_subsample']:
+                    iteration['file_suffix'] = '-ping'+str(start_ping).zfill(5)+'_run'+str(self.ss_params['chunk_size'])+'-stride'+str(self.ss_params['percent'])+size_suffix
+                else:
+                    iteration['file_suffix'] = size_suffix
+                # Make dictionary that raw writer needs to write out the proper name
+                iteration['out_file_name'] = {orig_line_prefix+'-'+start_file_base_name:out_dir+ss_line_prefix+'-'+start_file_base_name[0:-4]+iteration['file_suffix']}
+            iterations.append(iteration)
+        
+        # Raw files to write, with the pings to keep (None for all the pings)
+        writes = [(iteration['out_file_name'], iteration['idx_array']) for iteration in iterations if iteration['out_file_name'] is not None]
+        if writes and self.process_settings['need_bottom_data']:
+            # Get the bottom line for the evl files before any raw file is written
+            bottom_data = filter_inputs['bottom']
+        if self.write_original:
+            ocrf_name = 'original_compiled_raw_files'
+            if mk_dirs:
+                try:
+                    os.mkdir(self.output_path+ocrf_name)
+                    logging.info('Successful creation of folder: '+ ocrf_name)
+                except: 
+                    logging.info(self.output_path+ocrf_name+' already exists')
+            file_suffix = '-no_ss_no_filtering'+size_suffix
+            writes.append(({start_file_base_name:self.output_path+ocrf_name+'\\'+start_file_base_name[0:-4]+file_suffix}, None))
+        if stream['failed']:
+            return self.process_files(file_list, size_suffix, mk_dirs=mk_dirs, last_one=last_one, out_list=out_list)
+        
+        # Every file has been read at least once, so outputs are only written from here on
+        with self.timer.stage('reports'):
+            for frequency, fit_results in stream['triwave_reports']:
+                val = self.write_csv_report('triwave_report', self.output_path, start_file_base_name[0:-4], frequency, None, fit_results)
+        
+        # Save echogram image of primary frequency data
+        with self.timer.stage('echogram'):
+            if self.make_echogram:
+                if mk_dirs:
+                    try:
+                        os.mkdir(self.output_path+'echograms')
+                        logging.info('Successful creation of folder: echograms')
+                    except: 
+                        logging.info(self.output_path+'echograms already exists')
+                bottom_data = stream.get('bottom')
+                # Plot bottom if has been loaded or detected- use different color depending on which
+                bottom_color = 'k' if self.process_settings['detect_bottom'] else 'g'
+                self.echogram_renderer.submit_reduced(self.output_path+'echograms\\'+start_file_base_name[0:-4], stream['echogram'], 
+                                                    bottom=bottom_data, bottom_color=bottom_color)
+        if writes:
+            print('Writing processed file(s):')
+            if not self.stream_write(stream, writes):
+                return self.process_files(file_list, size_suffix, mk_dirs=mk_dirs, last_one=last_one, out_list=out_list)
+            if self.write_original:
+                logging.info("Finished writing original raw data to file(s) {}".format(writes[-1][0]))
+        self.dropped_pings = stream['dropped_pings']
+        
+        # Bottom line files, data files table and reports of each iteration
+        for iteration in iterations:
+            cur_iter = iteration['cur_iter']
+            ss_line_prefix = iteration['ss_line_prefix']
+            out_dir = iteration['out_dir']
+            idx_array = iteration['idx_array']
+            with self.timer.stage('reports'):
+                if iteration['ss_report'] is not None:
+                    val = self.write_csv_report('subsample_report', out_dir, ss_line_prefix+'-'+start_file_base_name[0:-4], cur_iter+1, scan.ping_time, iteration['ss_report'], config=scan.configuration)
+            if iteration['out_file_name'] is not None:
+                logging.info("Finished writing raw data to file(s) {}".format(iteration['out_file_name']))
+                self.timer.count('pings_written', np.sum(idx_array))
+                wrote_a_raw_file = True
+                file_suffix = iteration['file_suffix']
+                base_bot_file_name = None
+                # Write bottom file
+                if self.process_settings['detect_bottom']:
+                    print('Writing bottom line file(s)')
+                    base_bot_file_name = ss_line_prefix+'-'+start_file_base_name[0:-4]+file_suffix[:-4]+'.evl'
+                    with self.timer.stage('evl'):
+                        evl.write_evl(out_dir+base_bot_file_name, bottom_data.ping_time, bottom_data.data, mask=idx_array)
+                    wrote_an_evl_file = True
+                with self.timer.stage('db_insert'):
+                    if self.process_settings['need_to_load'] and cur_iter+1 in self.load_params['ss_list']:
+                        self.insert_datafiles(cur_iter, ss_line_prefix+'-'+start_file_base_name[0:-4]+file_suffix, base_bot_file_name, scan.ping_time[idx_array])
+            else:
+                logging.info("Did not write raw data to file, number of pings left did not exceed minimum pings")
+            logging.info('\n FINISHED ITERATION')
+            # Save reporting csv files:
+            with self.timer.stage('reports'):
+                if iteration['ping_stats'] is not None:
+                    if self.ss_params['do_subsample']:
+                        val = self.write_csv_report('filter_report', out_dir, ss_line_prefix+'-'+start_file_base_name[0:-4], cur_iter+1, scan.ping_time, iteration['ping_stats'])
+                    else:
+                        val = self.write_csv_report('filter_report', out_dir, start_file_base_name[0:-4], 1, scan.ping_time, iteration['ping_stats'])
+        
+        self.finish_group(start_file_base_name, scan.ping_time, gps_data if self.save_gps else None, idx_array, last_one)
+        
+        logging.info('\n \n FINISHED FILE \n')
+        
+        if self.process_settings['need_to_load']:
+            with self.timer.stage('db_insert'):
+                self.db_manager.commit()
+        return True, wrote_a_raw_file, wrote_an_evl_file
+        
+    def start_stream(self, scan, file_list, out_list=None):
+        '''
+        Method to set up the state of a group processed one file at a time by process_stream
+        
+        :param scan: scan of the group, with the ping times and the raw file of each ping
+        :type scan: raw_scan.ScanData
+        
+        :returns stream: the scan and files of the group, the first and one past the last ping of each file in the group ('ranges'),
+                                and what is found while reading the files: triwave fits, Sv statistics, bottom line and echogram
+        :type stream: dict
+        '''
+        names = np.array([config['file_name'] for config in scan.configuration])
+        ranges = []
+        start = 0
+        for file_name in file_list:
+            stop = start+int(np.sum(names == os.path.basename(file_name)))
+            ranges.append((start, stop))
+            start = stop
+        
+        return {'scan': scan, 'files': file_list, 'out_list': out_list, 'ranges': ranges,
+                    'ping_files': names.tolist(), 'signature': None, 'first_config': {},
+                    'triwave': {}, 'triwave_reports': [], 'sv_settings': {'triwave': None}, 'dropped_pings': {}, 'aligned': set(),
+                    'Sv_values': {}, 'failed': None}
+        
+    def stream_files(self, stream, files=None, read_bot=False):
+        '''
+        Generator over the files of a group processed one file at a time, reading the next file when the last one is done with
+        The channels of each file are organized and its pings are aligned, as process_files does for the group, and the triwave
+        correction fit for the group is applied.  Each file is checked against the scan and the first file: if it does not match,
+        stream['failed'] is set and the generator stops, and the group should be processed whole.
+        
+        :param stream: state of the group, from start_stream
+        :type stream: dict
+        
+        :optional param files: indices of the files to read, None for every file
+        :optional type files: list(int)
+        
+        :optional param read_bot: also read the bottom data of the out files of the group
+        :optional type read_bot: bool
+        
+        :yields first_ping, ek, channel_list, channel_primary: index in the group of the first ping of the file, the raw data 
+                    of the file, its channels with the primary first, and the primary channel
+        '''
+        for i, file_name in enumerate(stream['files']):
+            start, stop = stream['ranges'][i]
+            if (files is not None and i not in files) or start == stop:
+                continue
+            if self.instrument=='EK60':
+                ek = EK60.EK60()
+            elif self.instrument=='EK80':
+                ek = EK80.EK80()
+            try:
+                with self.timer.stage('read_raw'):
+                    ek.read_raw([file_name], progress_callback=self.read_write_callback)
+                self.timer.count('files_read', 1)
+            except:
+                logging.error("There was a problem with reading raw data from file {}".format(file_name))
+                stream['failed'] = 'read'
+                return
+            if read_bot:
+                self.read_bottom(ek, stream['out_list'])
+            channel_list, channel_primary = self.organize_channels(ek, [file_name])
+            if channel_list is None:
+                stream['failed'] = 'channels'
+                return
+            dropped_pings = self.align_pings(ek, channel_list, count=i not in stream['aligned'])
+            if i not in stream['aligned']:
+                stream['aligned'].add(i)
+                for channel, n_dropped in dropped_pings.items():
+                    stream['dropped_pings'][channel] = stream['dropped_pings'].get(channel, 0)+n_dropped
+            reason = self.check_stream_file(stream, ek.raw_data[channel_primary][0], channel_list, start, stop)
+            if reason is not None:
+                logging.warning('{} cannot be processed a file at a time ({}), processing the whole group'.format(file_name, reason))
+                stream['failed'] = reason
+                return
+            for channel in channel_list:
+                for data in ek.raw_data[channel]:
+                    # Configuration of the first ping of the group, applied to all the pings before writing
+                    stream['first_config'].setdefault(channel, data.configuration[0])
+                    if stream['triwave'].get(channel) is not None:
+                        with self.timer.stage('triwave'):
+                            data = self.triwave_correcter.correct(data, stream['triwave'][channel], first_ping=start)
+            yield start, ek, channel_list, channel_primary
+            del ek
+        
+    def check_stream_file(self, stream, data, channel_list, start, stop):
+        '''
+        Method to check that a file of a group processed one file at a time has the pings of the scan, and the same channels 
+        and sampling (so the same range grid of Sv) as the first file, so it is processed the same as in the whole group
+        
+        :param data: raw data of the primary channel of the file
+        :type data: raw_data object derived from pyecholab2 raw_read method
+        
+        :returns reason: what does not match, None if the file matches
+        :type reason: str
+        '''
+        if data.n_pings != stop-start or np.any(data.ping_time != stream['scan'].ping_time[start:stop]):
+            return 'pings do not match the scan'
+        signature = {'channels': list(channel_list), 'n_samples': int(data.n_samples)}
+        for name in ['sample_interval', 'sound_velocity', 'sample_offset']:
+            values = getattr(data, name, None)
+            if values is None:
+                return 'no {}'.format(name)
+            values = np.unique(np.asarray(values, dtype=float))
+            if len(values) > 1:
+                return '{} changes within the file'.format(name)
+            signature[name] = values.tolist()
+        if stream['signature'] is None:
+            stream['signature'] = signature
+        elif signature != stream['signature']:
+            return 'channels or sampling differ from the first file'
+        
+        return None
+        
+    def stream_triwave(self, stream):
+        '''
+        Method to fit the triwave correction of each channel to the mean ringdown of all the pings of a group
+        processed one file at a time
+        The fits are kept in stream['triwave'] by channel, and applied to each file as it is read.  The rows of the
+        triwave report are kept in stream['triwave_reports'], and written once the group will not be processed whole.
+        '''
+        n_pings = stream['scan'].n_pings
+        if n_pings<1360:
+            logging.warning('Too few pings to triwave correct.')
+            logging.warning('Triwave correction was not performed, skipping this step...')
+            return
+        ringdowns = {}
+        frequencies = {}
+        with self.timer.stage('triwave'):
+            for first, ek, channel_list, channel_primary in self.stream_files(stream):
+                for channel in channel_list:
+                    for data in ek.raw_data[channel]:
+                        n = self.triwave_correcter.mean_ringdown(data)
+                        if n is None or ringdowns.get(channel, 0) is None:
+                            ringdowns[channel] = None
+                        else:
+                            ringdowns.setdefault(channel, np.full(n_pings, np.nan))[first:first+len(n)] = n
+                        frequencies[channel] = data.frequency[0]
+        if stream['failed']:
+            return
+        for channel in stream['signature']['channels']:
+            if ringdowns.get(channel) is None:
+                logging.warning('Triwave correction was not performed, skipping this step...')
+                continue
+            with self.timer.stage('triwave'):
+                fit_results = self.triwave_correcter.fit_ringdown(ringdowns[channel])
+            logging.info('Triwave correction was performed successfully.')
+            stream['triwave'][channel] = fit_results
+            stream['triwave_reports'].append((frequencies[channel], fit_results))
+            if channel == stream['signature']['channels'][0]:
+                stream['sv_settings']['triwave'] = [self.triwave_params['start_sample'], self.triwave_params['end_sample']]
+        
+    def stream_bottom_source(self, stream, detect=False):
+        '''
+        Method to find where the bottom line of a group processed one file at a time comes from, as get_bottom_data does for the whole group:
+        the line loaded from the out files or detected in an earlier run, if it is in the bottom cache, otherwise the out files,
+        or bottom detection if the out files have no bottom data
+        
+        :optional param detect: the out files have no bottom data, so the bottom is detected
+        :optional type detect: bool
+        
+        :returns source: 'cached' (the line is in stream['depths']), 'out' or 'detect'
+        :type source: str
+        '''
+        scan = stream['scan']
+        file_list = stream['files']
+        out_list = stream['out_list']
+        if not detect:
+            if self.bottom_cache is not None and out_list:
+                key = self.bottom_cache.group_key(file_list, out_list=out_list)
+                if self.bottom_cache.has(file_list, key):
+                    logging.info("Bottom line loaded from {} is in the bottom cache, out files are not read".format(out_list))
+                    with self.timer.stage('bottom'):
+                        stream['depths'] = self.bottom_cache.get(file_list, stream['ping_files'], scan.ping_time, key)
+                    if stream['depths'] is not None:
+                        self.timer.count('bottom_cache_hits', 1)
+                        self.process_settings['detect_bottom'] = False
+                        return 'cached'
+                    logging.info("Could not load the cached bottom line of {}, reading the out files".format(out_list))
+            if out_list:
+                self.process_settings['detect_bottom'] = False
+                return 'out'
+            logging.info("There was no bottom data available, will detect bottom")
+        self.process_settings['detect_bottom'] = True
+        if self.bottom_cache is not None:
+            key = self.bottom_cache.group_key(file_list, sv_settings=self.stream_sv_settings(stream))
+            with self.timer.stage('bottom'):
+                stream['depths'] = self.bottom_cache.get(file_list, stream['ping_files'], scan.ping_time, key)
+            if stream['depths'] is not None:
+                self.timer.count('bottom_cache_hits', 1)
+                return 'cached'
+        
+        return 'detect'
+        
+    def stream_sv_settings(self, stream):
+        '''
+        Method to get the settings that are part of the cache key of a bottom line detected one file at a time,
+        kept apart from the lines detected on the Sv of the whole group
+        '''
+        return dict(stream['sv_settings'], detected_by='file')
+        
+    def stream_Sv(self, stream, ringdown=False, mean_bottoms=False, bottom_line=False, echogram=False, source=None):
+        '''
+        Method to find what needs the samples of a group processed one file at a time, reading one file at a time: the Sv statistics 
+        of each ping for the ringdown and bottom filters (in stream['Sv_values'] by filter name), the bottom line (stream['bottom']) 
+        and the reduced echogram (stream['echogram'])
+        Bottom depths of the files are put in one line for the group, and the gaps are filled with the previous depth as the files are read.
+        The files before the first depth of the group are read again for the bottom filter, once the depth their gaps are filled with is known.
+        
+        :optional param ringdown: find the mean Sv in the range of the ringdown filter
+        :optional param mean_bottoms: find the Sv near the bottom for the bottom filter, the bottom line is also found
+        :optional param bottom_line: find the bottom line
+        :optional param echogram: reduce the Sv of the primary channel for the echogram
+        :optional type ringdown, mean_bottoms, bottom_line, echogram: bool
+        
+        :optional param source: where the bottom line comes from, from stream_bottom_source if None
+        :optional type source: str
+        
+        :returns boolean for success, False if a file did not match the scan and the group should be processed whole
+        '''
+        scan = stream['scan']
+        bottom_line = bottom_line or mean_bottoms
+        if bottom_line and source is None:
+            source = self.stream_bottom_source(stream)
+        if not bottom_line:
+            source = None
+        if ringdown:
+            stream['Sv_values']['ringdown'] = np.full(scan.n_pings, np.nan)
+        if mean_bottoms:
+            stream['Sv_values']['bottom'] = np.full(scan.n_pings, np.nan)
+        if echogram:
+            stream['echogram'] = self.echogram_renderer.reducer(scan.n_pings)
+        if source == 'cached':
+            depths = stream['depths']
+        elif source is not None:
+            depths = np.full(scan.n_pings, np.nan)
+        if source == 'detect':
+            from echolab2.processing import afsc_bot_detector
+            bot_detector = afsc_bot_detector.afsc_bot_detector(**self.bottom_detector_params)
+        # Last depth of the files read, to fill the gaps at the start of the next file, and the files read before the first depth
+        last_depth = None
+        deferred = []
+        read_failed = False
+        
+        for first, ek, channel_list, channel_primary in self.stream_files(stream, read_bot=source == 'out'):
+            data = ek.raw_data[channel_primary][0]
+            stop = first+data.n_pings
+            if ringdown:
+                with self.timer.stage('filter'):
+                    stream['Sv_values']['ringdown'][first:stop] = self.filterer.get_mean_ringdown(data, self.filter_params['ringdown'])
+            Sv = None
+            if echogram or source == 'detect':
+                Sv = data.get_Sv()
+            with self.timer.stage('bottom'):
+                if source == 'out':
+                    if self.process_settings['detect_bottom']:
+                        read_failed = True
+                    elif hasattr(data, 'detected_bottom'):
+                        file_bottom = data.get_bottom()
+                        if file_bottom.data is not None:
+                            depths[first:stop] = file_bottom.data
+                elif source == 'detect':
+                    file_bottom, max_bottom_range = bot_detector.detect(Sv)
+                    depths[first:stop] = file_bottom.data
+            if mean_bottoms:
+                file_depths = depths[first:stop].copy()
+                if source != 'cached':
+                    # Fill the gaps as for the whole group: with the last depth of the earlier files, or the first depth of this file
+                    if last_depth is not None:
+                        file_depths = fill_bottom_gaps(np.concatenate(([last_depth], file_depths)))[1:]
+                    else:
+                        fill_bottom_gaps(file_depths)
+                if np.all(np.isnan(file_depths)):
+                    deferred.append(stream['ranges'].index((first, stop)))
+                else:
+                    last_depth = file_depths[-1]
+                    with self.timer.stage('filter'):
+                        stream['Sv_values']['bottom'][first:stop] = self.filterer.get_mean_bottoms(data, self.filter_params['bottom'], file_depths)
+            if echogram:
+                with self.timer.stage('echogram'):
+                    stream['echogram'].add(Sv.data, Sv.ping_time, Sv.range)
+            del Sv
+        if stream['failed']:
+            return False
+        if source is None:
+            return True
+        
+        if source == 'out':
+            if read_failed or np.all(np.isnan(depths)):
+                logging.info("There was a problem reading bottom data from {} file, will detect bottom".format(stream['out_list']))
+                return self.stream_Sv(stream, mean_bottoms=mean_bottoms, bottom_line=True, source=self.stream_bottom_source(stream, detect=True))
+            logging.info("Successfully read bottom data from {}".format(stream['out_list']))
+        elif source == 'detect':
+            logging.info("Successfully detected bottom data for {}".format(stream['files']))
+        with self.timer.stage('bottom'):
+            # Fill nans in bottom with closest, over the whole group
+            fill_bottom_gaps(depths)
+            if source != 'cached' and self.bottom_cache is not None:
+                if source == 'out':
+                    key = self.bottom_cache.group_key(stream['files'], out_list=stream['out_list'])
+                else:
+                    key = self.bottom_cache.group_key(stream['files'], sv_settings=self.stream_sv_settings(stream))
+                self.bottom_cache.put(stream['files'], stream['ping_files'], scan.ping_time, depths, key)
+        if deferred:
+            for first, ek, channel_list, channel_primary in self.stream_files(stream, files=deferred):
+                data = ek.raw_data[channel_primary][0]
+                stop = first+data.n_pings
+                with self.timer.stage('filter'):
+                    stream['Sv_values']['bottom'][first:stop] = self.filterer.get_mean_bottoms(data, self.filter_params['bottom'], depths[first:stop])
+            if stream['failed']:
+                return False
+        from echolab2.processing import line
+        stream['bottom'] = line.line(ping_time=scan.ping_time.copy(), data=depths)
+        
+        return True
+        
+    def get_stream_bottom(self, stream):
+        '''
+        Method to get the bottom line of a group processed one file at a time, reading the files for it if it was not found with the Sv statistics
+        
+        :returns bottom_data: bottom line, None if no filter needs the bottom or a file did not match the scan
+        :type bottom_data: echolab2 line object
+        '''
+        if not self.process_settings['need_bottom_data']:
+            return None
+        if 'bottom' not in stream and not stream['failed']:
+            self.stream_Sv(stream, bottom_line=True)
+        
+        return stream.get('bottom')
+        
+    def stream_write(self, stream, writes):
+        '''
+        Method to write the raw files of a group processed one file at a time: a part is written from each file read with write_raw, 
+        and the parts are joined into one raw file, the same as written for the whole group
+        
+        :param writes: output file name (as for write_raw, keyed by the name of the first raw file) and pings to keep 
+                            (None for all the pings) of each raw file to write
+        :type writes: list(tuple(dict, array(bool)))
+        
+        :returns boolean for success, False if a file did not match the scan and the group should be processed whole
+        '''
+        parts = [[] for out_file_name, idx_array in writes]
+        for first, ek, channel_list, channel_primary in self.stream_files(stream):
+            stop = first+ek.raw_data[channel_primary][0].n_pings
+            # Apply the configuration of the first ping of the group to all the pings for consistency and to not violate any rules
+            for channel in channel_list:
+                for data in ek.raw_data[channel]:
+                    data.configuration[:] = stream['first_config'][channel]
+            for (out_file_name, idx_array), part_names in zip(writes, parts):
+                raw_index_array = None
+                if idx_array is not None:
+                    if not np.any(idx_array[first:stop]):
+                        continue
+                    raw_index_array = {data: idx_array[first:stop] for channel in channel_list for data in ek.raw_data[channel]}
+                part_name = {key: '{}-part{}{}'.format(os.path.splitext(name)[0], len(part_names), os.path.splitext(name)[1]) 
+                                        for key, name in out_file_name.items()}
+                with self.timer.stage('write_raw'):
+                    ek.write_raw(part_name, raw_index_array=raw_index_array, overwrite=True, progress_callback=self.read_write_callback)
+                part_names.append(part_name)
+        if stream['failed']:
+            for part_names in parts:
+                for part_name in part_names:
+                    for name in part_name.values():
+                        if os.path.exists(name):
+                            os.remove(name)
+            return False
+        with self.timer.stage('write_raw'):
+            for (out_file_name, idx_array), part_names in zip(writes, parts):
+                for key, name in out_file_name.items():
+                    raw_scan.join_raw_files([part_name[key] for part_name in part_names], name)
+        
+        return True
+        
+    def organize_channels(self, ek, file_list):
+        '''
+        Method to organize the channels of the raw data read from file_list, with the primary channel first
+        
+        :returns channel_list, channel_primary: channels with the primary first, and the primary channel,
+                    None if a channel has raw data objects that cannot be sorted out and the files should be skipped
+        '''
+        # Make sure 38 (primary, set at the beginning) is read first, 
+        # so the subsampling index from 38 can be applied to other frequencies
+        # In addition, there is some data quality issues with saildrone, where there is only one 'sector'
+        # In this case, just remove the file that has the bad data and move on.
+        channel_list = []
+        for key, value  in ek.frequency_map.items():
+            L = len(ek.raw_data[value[0]])
+            if self.instrument == 'EK80':
+                # Check to see if there is more than one data object for this channel ID
+                # This will happen for saildrone and we need to get rid of the one with a single sector
+                if L > 1:
+                    for idx in range(0, L):
+                        num_of_sectors = ek.raw_data[value[0]][idx].complex.shape[2]
+                        if num_of_sectors < 3:
+                            idx_to_remove = idx
+                    ek.raw_data[value[0]].remove(ek.raw_data[value[0]][idx_to_remove])
+                    # check to make sure the first file name is still in there
+                    start_file = ek.raw_data[value[0]][0].configuration[0]['file_name']
+            
+            # If there are a list of raw data objects, there is probably something wrong- 
+            # perhaps a setting was changed or there was an erroneous ping.
+            # If there is an 'empty' raw_data object, just remove it.
+            # If there are two non-empty raw_data objects or all empty raw_data objects, 
+            # then skip this file, make a note and move on.
+            skip_this_file = False
+            if L > 1:
+                idx_to_remove = []
+                for idx in range(0, L):
+                    if ek.raw_data[value[0]][idx].n_pings == 1 or ek.raw_data[value[0]][idx].power.size == 0:
+                        idx_to_remove = np.append(idx_to_remove, idx)
+                if len(idx_to_remove) == 0 or len(idx_to_remove) == L:
+                    skip_this_file = True
+                else:
+                    for i in np.flip(idx_to_remove):
+                        ek.raw_data[value[0]].remove(ek.raw_data[value[0]][int(i)])
+            if skip_this_file:
+                logging.error("There were two raw data objects for one frequency and could not determine the cause, so skipping {}".format(file_list))
+                return None, None
+            
+            # Now check to see if this is the primary frequency to base index for others off of
+            # If so, keep track and make sure primary is the first in the list
+            if key == self.primary_frequency:
+                channel_list.insert(0, value[0])
+                channel_primary = value[0]
+            else:
+                channel_list.append(value[0])
+        
+        return channel_list, channel_primary
+        
+    def align_pings(self, ek, channel_list, count=True):
+        '''
+        Method to keep only the pings that are in all channels, by removing the others from each channel
+        The common ping times are found with one intersection of the ping times of all channels
+        
+        :param channel_list: channels of the raw data to align
+        :type channel_list: list(str)
+        
+        :optional param count: add the pings removed to the stage counts, False when the files were already aligned once
+        :optional type count: bool
+        
+        :returns dropped_pings: number of pings removed from each channel
+        :type dropped_pings: dict
+        '''
+        ping_times = [ek.raw_data[channel][0].ping_time for channel in channel_list]
+        # Times found in every channel
+        times, counts = np.unique(np.concatenate([np.unique(t) for t in ping_times]), return_counts=True)
+        common = times[counts == len(channel_list)]
+        dropped_pings = {}
+        for channel, ping_time in zip(channel_list, ping_times):
+            drop = np.flatnonzero(np.logical_not(np.isin(ping_time, common)))
+            dropped_pings[channel] = len(drop)
+            if len(drop) > 0:
+                ek.raw_data[channel][0].delete(index_array=drop)
+                logging.info('Removed {} pings from channel {} that are not in all channels'.format(len(drop), channel))
+        if count:
+            self.timer.count('pings_dropped', sum(dropped_pings.values()))
+        
+        return dropped_pings
+        
+    def insert_datafiles(self, cur_iter, file_name, bot_file_name, ping_time):
+        '''
+        Method to add a raw file written for a subsample line, and its bottom line file, to the data files table,
+        unless they are already in it
+        
+        :param file_name: name of the raw file written
+        :type file_name: str
+        
+        :param bot_file_name: name of the bottom line (evl) file written, None if there is none
+        :type bot_file_name: str
+        
+        :param ping_time: times of the pings written
+        :type ping_time: array(datetime64)
+        '''
+        import pandas as pd
+        from pyAVO2 import avo_db
+        for name in [file_name, bot_file_name]:
+            if name is None:
+                continue
+            # Need to check if this data file is already in there
+            val = self.db_cursor.get_datafile(self.load_params['ship_id'], self.load_params['survey_id'], name)
+            if not val:
+                # If it isn't in the database already, insert it
+                self.db_cursor.insert_datafile(self.load_params['ship_id'], self.load_params['survey_id'], return_id=False,
+                    line=int(cur_iter+1), file_name=name,
+                    start_time=pd.Timestamp(ping_time[0]),
+                    end_time=pd.Timestamp(ping_time[-1]),
+                    n_pings=len(ping_time),
+                    clock_adj=0,
+                    mean_skew=0,
+                    stddev_skew=0,
+                    status=avo_db.StatusCodes.UNCHECKED)
+            
+                logging.info("Finished inserting data file {} info to data_files table".format(name))
+            else:
+                logging.info("Data file {} is already in the data files table".format(name))
+        
+    def get_iteration_output(self, iters, mk_dirs=True):
+        '''
+        Method to find the subsample line of an iteration and make its output folder
+        
+        :returns cur_iter, ss_line_prefix, out_dir, start_ping: subsample offset, line prefix (e.g. L0001), output folder
+                    and first ping of the subsample, prefix and first ping are None without subsampling
+        '''
+        if self.ss_params['do_subsample']:
+            cur_iter = int((iters+self.ss_params['chunk_start']-1)%(100/self.ss_params['percent']))
+            ss_str = str(cur_iter+1)
+            ss_line_prefix = 'L'+ss_str.zfill(4)
+            if mk_dirs:
+                try:
+                    os.mkdir(self.output_path+'SS_'+ss_str)
+                    logging.info('Successful creation of folder: {}'.format('SS_'+ss_str))
+                except: 
+                    logging.info(self.output_path+'SS_'+ss_str+' already exists')
+            out_dir = self.output_path+'SS_'+ss_str+'/'
+            start_ping = cur_iter*self.ss_params['chunk_size']
+        else:
+            out_dir =  self.output_path
+            cur_iter = 0
+            ss_line_prefix = None
+            start_ping = None
+        
+        return cur_iter, ss_line_prefix, out_dir, start_ping
+        
+    def finish_group(self, start_file_base_name, ping_time, gps_data, idx_array, last_one):
+        '''
+        Method for the steps at the end of a group: store the GPS track with the pings kept by the last iteration,
+        and at the end of the run, draw the maps (gps_report.csv is exported by close) and wait for the echograms still being rendered
+        '''
+        with self.timer.stage('gps_store'):
+            if self.save_gps:
+                temp = np.zeros(len(idx_array))
+                temp[idx_array] = 1
+                gps_data['filter label'] = temp
+                gps_data['file label'] = np.ones(len(gps_data['latitude']))*self.gps_counter
+                val = self.gps_store.write_group(start_file_base_name[0:-4], ping_time, gps_data)
+                self.gps_counter += 1
+            
+        with self.timer.stage('maps'):
+            if self.map_params['make_map'] and last_one:
+                try:
+                    os.mkdir(self.output_path+'maps')
+                    logging.info('Successful creation of folder: maps')
+                except: 
+                    logging.info(self.output_path+'maps already exists')
+            
+                # Load all the GPS track segments as arrays
+                track = self.gps_store.read_all()
+                all_latitudes = track['latitude']
+                all_longitudes = track['longitude']
+                all_labels = track['file label']
+                all_labels_by_filtering = track['filter label']
+                all_labels_speed = np.floor(track['speed'])
+                all_labels_hours = track['ping_time'].astype('datetime64[h]').astype(np.int64) % 24
+                self.mapper.draw_map(all_latitudes, all_longitudes, labels=all_labels, border=self.map_params['region'], file_name='by_file', grids=self.map_params['grids'])
+                self.mapper.draw_map(all_latitudes, all_longitudes, labels=all_labels_by_filtering, border=self.map_params['region'], file_name='filtering', grids=self.map_params['grids'])
+                self.mapper.draw_map(all_latitudes, all_longitudes, labels=all_labels_speed, border=self.map_params['region'], file_name='speed', grids=self.map_params['grids'], legend=True)
+                self.mapper.draw_map(all_latitudes, all_longitudes, labels=all_labels_hours, border=self.map_params['region'], file_name='hours', grids=self.map_params['grids'], legend=True)
+                self.mapper.close()
+                
+        # Wait for the echograms still being rendered at the end of the run
+        if self.make_echogram and last_one:
+            with self.timer.stage('echogram'):
+                self.echogram_renderer.drain()
+        
+    def read_bottom(self, ek, out_list):
+        '''
+        Method to read the bottom data of the out files, or to set up bottom detection if they cannot be read
+        '''
+        try:
+            with self.timer.stage('read_bot'):
+                ek.read_bot(out_list, progress_callback=self.read_write_callback)
+            logging.info("Finished successful reading out data from file(s) {}".format(out_list))
+            self.process_settings['detect_bottom'] = False
+        except:
+            logging.error("There was a problem with reading out data from files {}, will detect bottom".format(out_list))
+            # Here instead of failing completely, use custom bottom detection
+            self.process_settings['detect_bottom'] = True
+        
+    def get_bottom_data(self, data, out_list, file_list, ping_files=None, sv_settings=None, cached_depths=None):
+        '''
+        Method to get the bottom line of the primary channel, read from the out files or detected if not available
+        Lines are loaded from the bottom cache when there is one, and saved to it after they are read or detected
+        Missing bottom depths are filled with the previous depth
+        
+        :optional param ping_files: raw file name of each ping, needed to use the bottom cache
+        :optional type ping_files: list(str)
+        
+        :optional param sv_settings: settings that changed the Sv of data (e.g. triwave correction), part of the cache key
+        :optional type sv_settings: dict
+        
+        :optional param cached_depths: bottom depth of each ping loaded from the cached line of the out files, used instead of reading them
+        :optional type cached_depths: array(float)
+        
+        :returns bottom_data: bottom line, None if no filter needs the bottom
+        :type bottom_data: echolab2 line object
+        '''
+        if not self.process_settings['need_bottom_data']:
+            return None
+        from echolab2.processing import line
+        use_cache = self.bottom_cache is not None and ping_files is not None
+        bottom_data = []
+        # Try to read in bottom data, or use the line loaded from the same out files in an earlier run
+        if cached_depths is not None:
+            bottom_data = line.line(ping_time=data.ping_time.copy(), data=cached_depths)
+            self.timer.count('bottom_cache_hits', 1)
+        elif hasattr(data, 'detected_bottom'):
+            bottom_data = data.get_bottom()
+            if bottom_data.data is None or len(np.where(np.isnan(bottom_data.data))[0])==len(bottom_data.data):
+                logging.info("There was a problem reading bottom data from {} file, will detect bottom".format(out_list))
+                self.process_settings['detect_bottom'] = True
+            else:
+                logging.info("Successfully read bottom data from {}".format(out_list))
+        else:
+            logging.info("There was no bottom data available, will detect bottom")
+            self.process_settings['detect_bottom'] = True
+        # If bottom data is not available, detect it, or load the line detected in an earlier run
+        with self.timer.stage('bottom'):
+            if self.process_settings['detect_bottom']:
+                key = self.bottom_cache.group_key(file_list, sv_settings=sv_settings) if use_cache else None
+                depths = self.bottom_cache.get(file_list, ping_files, data.ping_time, key) if use_cache else None
+                if depths is not None:
+                    bottom_data = line.line(ping_time=data.ping_time.copy(), data=depths)
+                    self.timer.count('bottom_cache_hits', 1)
+                else:
+                    from echolab2.processing import afsc_bot_detector
+                    bot_detector = afsc_bot_detector.afsc_bot_detector(**self.bottom_detector_params)
+                    Sv_data = data.get_Sv()
+#                try:
+                    bottom_data, max_bottom_range= bot_detector.detect(Sv_data) 
+                    del Sv_data
+                    logging.info("Successfully detected bottom data for {}".format(file_list))
+#                except:
+#                    logging.info("Error in detecting bottom data for {}".format(file_list))
+                    # Fill nans in bottom with closest before the line is stored
+                    fill_bottom_gaps(bottom_data.data)
+                    if use_cache:
+                        self.bottom_cache.put(file_list, ping_files, data.ping_time, bottom_data.data, key)
+            else:
+                # Fill nans in bottom with closest
+                fill_bottom_gaps(bottom_data.data)
+                # Lines read from the out files are saved, so later runs do not read them again
+                if use_cache and out_list and cached_depths is None:
+                    self.bottom_cache.put(file_list, ping_files, data.ping_time, bottom_data.data, self.bottom_cache.group_key(file_list, out_list=out_list))
+        
+        return bottom_data
+        
+    def get_gps_data(self, ek, data):
+        '''
+        Method to get the GPS position and speed interpolated to the pings of data
+        Erroneous fixes are set to nan and missing speeds are computed from the positions
+        
+        :returns gps_data: 'latitude', 'longitude', 'speed' and the other interpolated fields
+        :type gps_data: dict with arrays of length data.n_pings
+        '''
+        with self.timer.stage('gps'):
+            blank, gps_data = ek.nmea_data.interpolate(data, 'position')
+            fields, speeds = ek.nmea_data.interpolate(data, 'speed')
+            gps_data = self.check_gps_data(gps_data, speeds[fields[0]])
+        
+        return gps_data
+        
+    def check_gps_data(self, gps_data, speed_data):
+        '''
+        Method to set erroneous GPS fixes to nan and compute missing speeds from the positions
+        
+        :param gps_data: intepolated latitude and longitude to ping data times
+        :type gps_data: dict with arrays of length data.n_pings
+        
+        :param speed_data: interpolated speeds (knots), nan where missing
+        :type speed_data: array(float)
+        
+        :returns gps_data: with the checked 'speed' added
+        :type gps_data: dict with arrays of length data.n_pings
+        '''
+        # Find any erroneous GPS fixes and set them to nan
+        gps_data = self.mark_bad_gps_data(gps_data)
+        no_gps = np.all(np.isnan(gps_data['latitude'])) or np.all(np.isnan(gps_data['longitude']))
+        if no_gps:
+            logging.warning('There are no GPS data available.')
+        no_speed = np.any(np.isnan(speed_data))
+        if no_speed:
+            logging.info('There are no speed data available.')
+            if no_gps:
+                logging.warning('There are no GPS data to compute speeds. No speeds will be used.')
+            else:
+                speed_data,  val = self.compute_speed_from_gps(speed_data, gps_data)
+                if val:
+                    logging.info('Speed data successfully computed from GPS data')
+                else:
+                    logging.info('Unable to find missing speed data from GPS. Some speeds may still be missing.')
+        gps_data['speed'] = speed_data
+        
+        return gps_data
+        
+    def get_gps_distances(self, gps_data):
+        '''
+        Method to compute the distance between consecutive GPS fixes,
+        shared by the GPS cleaning and speed backfill steps
+        Uses the haversine formula on a mean earth radius for all pings at once
+        
+        :param gps_data: intepolated latitude and longitude to ping data times
+        :type gps_data: dict with arrays of length data.n_pings
+        
+        :returns distances: distance (km) from each ping to the next, nan where either fix is missing
+        :type distances: array(float) of length data.n_pings-1
+        '''
+        lat = np.radians(np.asarray(gps_data['latitude'], dtype=float))
+        lon = np.radians(np.asarray(gps_data['longitude'], dtype=float))
+        dlat = lat[1:] - lat[:-1]
+        dlon = lon[1:] - lon[:-1]
+        a = np.sin(dlat/2)**2 + np.cos(lat[:-1])*np.cos(lat[1:])*np.sin(dlon/2)**2
+        
+        return 2 * 6371.0088 * np.arcsin(np.sqrt(np.minimum(a, 1)))
+    
     def mark_bad_gps_data(self, gps_data):
-        st_lat = gps_data['latitude'][:-1]
-        st_lon = gps_data['longitude'][:-1]
-        end_lat = gps_data['latitude'][1:]
-        end_lon = gps_data['longitude'][1:]
-        count = 1
-        for lat1, lon1, lat2, lon2 in zip(st_lat, st_lon, end_lat, end_lon):
-            if not np.any(np.isnan((lat1, lon1, lat2, lon2))):
-                if gd.distance((lat1, lon1), (lat2, lon2)).km > 0.1:
-                    gps_data['latitude'][count-1:count] = np.nan
-                    gps_data['longitude'][count-1:count] = np.nan
-            count += 1
+        # Any fix that jumps more than 0.1 km to the next one is considered erroneous
+        distances = self.get_gps_distances(gps_data)
+        bad_inds = np.where(distances > 0.1)[0]
+        gps_data['latitude'][bad_inds] = np.nan
+        gps_data['longitude'][bad_inds] = np.nan
         
         return gps_data
     
     def compute_speed_from_gps(self, speed_data, gps_data):
-        st_lat = gps_data['latitude'][:-1]
-        st_lon = gps_data['longitude'][:-1]
-        end_lat = gps_data['latitude'][1:]
-        end_lon = gps_data['longitude'][1:]
-        time_diff = gps_data['ping_time'][1:] - gps_data['ping_time'][:-1]
-        val = False
-        count = 1
-        for lat1, lon1, lat2, lon2, tdiff, sp in zip(st_lat, st_lon, end_lat, end_lon, time_diff, speed_data[1:]):
-            if np.isnan(sp):
-                if not np.any(np.isnan((lat1, lon1, lat2, lon2))):
-                    temp_dist = gd.distance((lat1, lon1), (lat2, lon2)).km
-                    temp_sp = 3600 * 0.539957 * temp_dist / tdiff.tolist().total_seconds()
-                    speed_data[count] = temp_sp
-                    if not val:
-                        val = True
-            count += 1
+        distances = self.get_gps_distances(gps_data)
+        time_diff = np.diff(gps_data['ping_time']) / np.timedelta64(1, 's')
+        # Only fill missing speeds that have a valid pair of fixes and a positive time step
+        fill_inds = np.where(np.isnan(speed_data[1:]) & np.logical_not(np.isnan(distances)) & (time_diff > 0))[0]
+        speed_data[fill_inds+1] = 3600 * 0.539957 * distances[fill_inds] / time_diff[fill_inds]
+        val = len(fill_inds) > 0
             
         return speed_data,  val
     
@@ -637,11 +1521,13 @@ class Process():
                         pairs.append([float(row[1]), float(row[0]), float(row[3]), float(row[2])])
         elif infile[-3:] == 'shp':
             if pair_number == 2:
+                import shapefile
                 polygon = shapefile.Reader(infile)
                 sh = polygon.shape()
                 for point in sh.points:
                     pairs.append([float(point[0]), float(point[1])])
             elif pair_number == 4:
+                import cartopy.io.shapereader as shpreader
                 reader = shpreader.Reader(infile)
                 grids = reader.records()
                 for g in grids:
@@ -722,27 +1608,6 @@ class Process():
                 csvwriter = csv.writer(csvfile, delimiter=',')
                 csvwriter.writerow(data_to_write)
         
-        if file_type == 'gps_report':
-            file_name = out_dir+file_type+'.csv'
-            
-            if not os.path.exists(file_name):
-                with open(file_name, 'a', newline='') as csvfile:
-                    headers = ['file name', 'ping time', 'latitude', 'longitude', 'speed', 'file label', 'filter label']
-                    csvwriter = csv.writer(csvfile, delimiter=',')
-                    csvwriter.writerow(headers)
-            
-            with open(file_name, 'a', newline='') as csvfile:
-                csvwriter = csv.writer(csvfile, delimiter=',')
-                count = 0
-                for p, lat, lon, sp, val1, val2 in zip(ping_times, params['latitude'], params['longitude'], params['speed'], params['file label'], params['filter label']):
-                    if count == 0:
-                        f_name = start_file_base_name
-                    else:
-                        f_name = ''
-                    data_to_write = [f_name, p, lat, lon, sp, val1, val2]
-                    csvwriter.writerow(data_to_write)
-                    count += 1 
-        
         if file_type == 'filter_report':
             file_name = out_dir+file_type+'-SS{}.csv'.format(cur_iter)
             if not os.path.exists(file_name):
@@ -757,11 +1622,17 @@ class Process():
             with open(file_name, 'a', newline='') as csvfile:
                 
                 for filt, vals in params['data'].items():
+                    # Filters skipped because no pings were left have no statistics
+                    skipped = filt in params['tracking'].get('skipped', [])
                     if filt == 'bottom' or filt == 'ringdown':
                         csvwriter = csv.writer(csvfile, delimiter=',')
                         count = 0
                         for v in zip(vals[0], vals[1], vals[2], vals[3], vals[4]):
-                            if not np.isnan(v[0]):
+                            if not np.isnan(v[0]) and (skipped or np.isnan(v[2])):
+                                stat = 'Skipped' if skipped else 'Err'
+                                data_to_write = [start_file_base_name, v[0], ping_times[int(v[0])], v[1], ping_times[int(v[1])], 
+                                                    filt, stat, stat, stat, '', '', '', 'Y', params['tracking']['interval_removed'][count], params['tracking']['interval_reason'][count]]
+                            elif not np.isnan(v[0]):
                                 data_to_write = [start_file_base_name, v[0], ping_times[int(v[0])], v[1], ping_times[int(v[1])], 
                                                     filt, v[2], v[3], v[4], '', '', '', 'Y', params['tracking']['interval_removed'][count], params['tracking']['interval_reason'][count]]
                             else:
@@ -770,7 +1641,9 @@ class Process():
                             count += 1
                     
                     else:
-                        if not np.isnan(vals[0]):
+                        if skipped:
+                            data_to_write = [start_file_base_name, 'Skipped', 'Skipped', 'Skipped', 'Skipped', filt, 'Skipped', 'Skipped', 'Skipped', 'Y', params['tracking']['file_removed'], params['tracking']['file_reason']]
+                        elif not np.isnan(vals[0]):
                             data_to_write = [start_file_base_name, vals[0], ping_times[vals[0]], vals[1], ping_times[vals[1]-1], 
                                                     filt, vals[2], vals[3], vals[4], 'Y', params['tracking']['file_removed'], params['tracking']['file_reason']]
                         else:
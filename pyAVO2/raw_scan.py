@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+'''
+Light scan of Simrad raw files for the ping times and NMEA of a group, without the samples.
+Only the datagram headers are read: sample data of RAW0 (EK60) and RAW3 (EK80) datagrams are
+skipped with a seek, so a group can be checked against the GPS based filters (time of day,
+region and speed) before reading it with echolab2.
+Raw files written a part at a time for a streamed group are joined into one file with join_raw_files.
+'''
+
+import os, struct, logging, shutil
+import numpy as np
+import xml.etree.ElementTree as ET
+
+# Ticks (100 ns) between the NT epoch (1601) and the unix epoch (1970)
+NT_EPOCH_TICKS = 116444736000000000
+DATAGRAM_HEADER = struct.Struct('<l4sLL')
+CON0_HEADER = struct.Struct('<128s128s128s30s98sl')
+CON0_TRANSCEIVER_SIZE = 320
+# Channel number and frequency of a CON0 transceiver
+CON0_CHANNEL = struct.Struct('<128slf')
+# Channel ID of a RAW3 datagram
+RAW3_CHANNEL = struct.Struct('<128s')
+RAW0_CHANNEL = struct.Struct('<h')
+
+class ScanData():
+    '''
+    Class for the ping times, configuration and GPS of the primary channel of a group from scan_raw.
+    Has the ping_time, n_pings and configuration used by the filters and reports, like a raw_data object.
+    '''
+
+    def __init__(self, ping_time, configuration, nmea_time, latitude, longitude, speed_time, speed):
+        self.ping_time = ping_time
+        self.n_pings = len(ping_time)
+        self.configuration = configuration
+        self.nmea_time = nmea_time
+        self.latitude = latitude
+        self.longitude = longitude
+        self.speed_time = speed_time
+        self.speed = speed
+
+    def interpolate_gps(self):
+        '''
+        Method to interpolate the positions and speeds to the ping times, nan outside the NMEA data
+
+        :returns gps_data: 'ping_time', 'latitude', 'longitude' and 'speed'
+        :type gps_data: dict with arrays of length n_pings
+        '''
+        ping_time = self.ping_time.astype(np.int64).astype(float)
+        gps_data = {'ping_time': self.ping_time}
+        for key, times, values in [('latitude', self.nmea_time, self.latitude), ('longitude', self.nmea_time, self.longitude),
+                                                ('speed', self.speed_time, self.speed)]:
+            if len(times) == 0:
+                gps_data[key] = np.full(self.n_pings, np.nan)
+            else:
+                gps_data[key] = np.interp(ping_time, times.astype(np.int64).astype(float), values, left=np.nan, right=np.nan)
+
+        return gps_data
+
+def nt_to_datetime64(low, high):
+    '''
+    Method to convert the NT time of a datagram to datetime64[ms], the resolution of echolab2 ping times
+    '''
+    return np.datetime64((((high << 32) | low) - NT_EPOCH_TICKS)//10000, 'ms')
+
+def parse_coordinate(value, hemisphere):
+    '''
+    Method to convert an NMEA ddmm.mmmm (or dddmm.mmmm) value to decimal degrees
+    '''
+    if not value:
+        return np.nan
+    degrees = int(float(value)/100)
+    coordinate = degrees + (float(value)-degrees*100)/60
+    return -coordinate if hemisphere in ('S', 'W') else coordinate
+
+def parse_nmea(text):
+    '''
+    Method to get the position and speed (knots) from a GGA, GLL, RMC or VTG sentence
+
+    :returns position, speed: (latitude, longitude) or None, and the speed or None
+    '''
+    sentence = text.strip('\x00\r\n ').split('*')[0]
+    if not sentence.startswith('$') or len(sentence) < 6:
+        return None, None
+    fields = sentence.split(',')
+    message = fields[0][3:]
+    try:
+        if message == 'GGA' and len(fields) > 5:
+            return (parse_coordinate(fields[2], fields[3]), parse_coordinate(fields[4], fields[5])), None
+        if message == 'GLL' and len(fields) > 4:
+            return (parse_coordinate(fields[1], fields[2]), parse_coordinate(fields[3], fields[4])), None
+        if message == 'RMC' and len(fields) > 7:
+            speed = float(fields[7]) if fields[7] else None
+            return (parse_coordinate(fields[3], fields[4]), parse_coordinate(fields[5], fields[6])), speed
+        if message == 'VTG' and len(fields) > 5 and fields[5]:
+            return None, float(fields[5])
+    except ValueError:
+        pass
+    return None, None
+
+def get_ek80_channels(xml_text, frequency):
+    '''
+    Method to find the channel IDs for a frequency in the XML0 configuration datagram of an EK80 file
+    '''
+    channels = set()
+    try:
+        root = ET.fromstring(xml_text.strip('\x00'))
+    except ET.ParseError:
+        return channels
+    for channel in root.iter('Channel'):
+        for transducer in channel.iter('Transducer'):
+            if transducer.get('Frequency') is not None and float(transducer.get('Frequency')) == frequency:
+                channels.add(channel.get('ChannelID'))
+
+    return channels
+
+def scan_raw(file_list, primary_frequency):
+    '''
+    Method to read the ping times of the primary channel and the NMEA of a group of raw files.
+    Pings are kept the same way process_files keeps them after reading the group: only the pings
+    at times found in every channel (see Process.align_pings).
+
+    :param file_list: raw files of the group, in time order
+    :type file_list: list(str)
+
+    :param primary_frequency: frequency (Hz) of the primary channel
+    :type primary_frequency: int
+
+    :returns scan: ping times, a configuration with the 'file_name' and 'end_ping' of each ping, and the GPS data,
+                        None if a file could not be read
+    :type scan: ScanData
+    '''
+    ping_time = []
+    configuration = []
+    # Ping times of every channel, by channel ID
+    channel_times = {}
+    nmea_time, latitude, longitude = [], [], []
+    speed_time, speed = [], []
+    for file_name in file_list:
+        # Channel IDs of the primary frequency, and of the EK60 channel numbers of this file
+        channels = set()
+        channel_ids = {}
+        n_pings = len(ping_time)
+        try:
+            with open(file_name, 'rb') as f:
+                file_size = os.fstat(f.fileno()).st_size
+                position = 0
+                while position+DATAGRAM_HEADER.size <= file_size:
+                    f.seek(position)
+                    length, dgram_type, low, high = DATAGRAM_HEADER.unpack(f.read(DATAGRAM_HEADER.size))
+                    if length < 12:
+                        logging.warning('Stopped scanning {} at a bad datagram'.format(file_name))
+                        break
+                    body_size = length-12
+                    channel_id = None
+                    if dgram_type == b'RAW0':
+                        channel_id = channel_ids.get(RAW0_CHANNEL.unpack(f.read(RAW0_CHANNEL.size))[0])
+                    elif dgram_type == b'RAW3':
+                        channel_id = RAW3_CHANNEL.unpack(f.read(RAW3_CHANNEL.size))[0].decode('latin-1').strip('\x00')
+                    elif dgram_type == b'NME0':
+                        position_fix, fix_speed = parse_nmea(f.read(body_size).decode('latin-1'))
+                        time = nt_to_datetime64(low, high)
+                        if position_fix is not None and not np.isnan(position_fix[0]):
+                            nmea_time.append(time)
+                            latitude.append(position_fix[0])
+                            longitude.append(position_fix[1])
+                        if fix_speed is not None:
+                            speed_time.append(time)
+                            speed.append(fix_speed)
+                    elif dgram_type == b'CON0':
+                        n_transceivers = CON0_HEADER.unpack(f.read(CON0_HEADER.size))[-1]
+                        for i in range(n_transceivers):
+                            name, channel, frequency = CON0_CHANNEL.unpack(f.read(CON0_TRANSCEIVER_SIZE)[:CON0_CHANNEL.size])
+                            channel_ids[i+1] = name.decode('latin-1').strip('\x00')
+                            if frequency == primary_frequency:
+                                channels.add(channel_ids[i+1])
+                    elif dgram_type == b'XML0':
+                        channels |= get_ek80_channels(f.read(body_size).decode('utf-8', errors='ignore'), primary_frequency)
+                    if channel_id is not None:
+                        time = nt_to_datetime64(low, high)
+                        channel_times.setdefault(channel_id, []).append(time)
+                        if channel_id in channels:
+                            ping_time.append(time)
+                    # Length is written before and after each datagram
+                    position += length+8
+        except (OSError, struct.error) as e:
+            logging.warning('Could not scan raw file {}: {}'.format(file_name, e))
+            return None
+        if not channels:
+            logging.warning('Primary frequency {} was not found in {}'.format(primary_frequency, file_name))
+        configuration += [{'file_name': os.path.basename(file_name), 'end_ping': len(ping_time)}]*(len(ping_time)-n_pings)
+
+    # Keep the primary pings at times found in every channel, as align_pings does after a full read
+    ping_time = np.array(ping_time, dtype='datetime64[ms]')
+    if channel_times:
+        times, counts = np.unique(np.concatenate([np.unique(np.array(t, dtype='datetime64[ms]')) for t in channel_times.values()]), return_counts=True)
+        keep = np.isin(ping_time, times[counts == len(channel_times)])
+        if not np.all(keep):
+            logging.info('Scan removed {} pings that are not in all channels'.format(np.sum(~keep)))
+            ping_time = ping_time[keep]
+            configuration = [config for config, k in zip(configuration, keep) if k]
+            # The end ping of each file is counted again without the pings removed
+            end_pings = {}
+            for i, config in enumerate(configuration):
+                end_pings[config['file_name']] = i+1
+            configuration = [dict(config, end_ping=end_pings[config['file_name']]) for config in configuration]
+
+    # NMEA from several files are put in time order for interpolation
+    nmea_order = np.argsort(np.array(nmea_time, dtype='datetime64[ms]'), kind='stable')
+    speed_order = np.argsort(np.array(speed_time, dtype='datetime64[ms]'), kind='stable')
+    return ScanData(ping_time, configuration,
+                            np.array(nmea_time, dtype='datetime64[ms]')[nmea_order], np.array(latitude)[nmea_order],
+                            np.array(longitude)[nmea_order], np.array(speed_time, dtype='datetime64[ms]')[speed_order],
+                            np.array(speed)[speed_order])
+
+def is_configuration(dgram_type, body):
+    '''
+    Method to check whether a datagram is part of the configuration at the start of a raw file:
+    CON0/CON1 (EK60), the XML0 configuration (EK80) or the FIL1 filters written after it
+
+    :param body: start of the datagram after the header, enough for the root element of an XML0 datagram
+    :type body: bytes
+    '''
+    if dgram_type in (b'CON0', b'CON1', b'FIL1'):
+        return True
+    if dgram_type == b'XML0':
+        return b'<Configuration' in body
+    return False
+
+def join_raw_files(part_files, output_file):
+    '''
+    Method to join raw files written for consecutive parts of a group (e.g. one for each file read)
+    into one raw file.  The first part is copied whole, and the configuration datagrams at the start of
+    the other parts are left out, so the output has one configuration followed by the datagrams of every part.
+    The parts are removed once they are joined.
+
+    :param part_files: raw files of the parts, in time order, those that do not exist are skipped
+    :type part_files: list(str)
+
+    :param output_file: raw file to write, replaced if it exists
+    :type output_file: str
+
+    :returns boolean for success, False if no part exists or one could not be read
+    '''
+    part_files = [f for f in part_files if os.path.exists(f)]
+    if not part_files:
+        logging.warning('No parts were written for {}'.format(output_file))
+        return False
+    try:
+        with open(output_file, 'wb') as out:
+            for i, part_file in enumerate(part_files):
+                with open(part_file, 'rb') as f:
+                    file_size = os.fstat(f.fileno()).st_size
+                    position = 0
+                    # Skip the configuration at the start of the part, the output has the one of the first part
+                    while i > 0 and position+DATAGRAM_HEADER.size <= file_size:
+                        f.seek(position)
+                        length, dgram_type, low, high = DATAGRAM_HEADER.unpack(f.read(DATAGRAM_HEADER.size))
+                        if length < 12 or not is_configuration(dgram_type, f.read(min(length-12, 512))):
+                            break
+                        position += length+8
+                    f.seek(position)
+                    shutil.copyfileobj(f, out)
+    except (OSError, struct.error) as e:
+        logging.error('Could not join {} into {}: {}'.format(part_files, output_file, e))
+        return False
+    for part_file in part_files:
+        os.remove(part_file)
+
+    return True
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import os, json, time, logging, datetime, collections, contextlib
+
+class StageTimer():
+    '''
+    Class for timing the stages of processing a group of files.
+    Stages are timed with context managers and counters are added as the group is processed,
+    then a JSON record of the group is appended to a file in the log directory.
+    A selected group can be profiled with cProfile, saved as a .prof file that can be viewed
+    with snakeviz or turned into a flame graph (e.g. with flameprof).
+    '''
+
+    def __init__(self, log_path=None, profile_group=None, file_name='stage_times.jsonl'):
+        '''
+        Initialize the timer
+
+        :optional param log_path: directory for the records and profiles, with trailing slashes, None to only log them
+        :optional type log_path: str
+
+        :optional param profile_group: name of a group, or the number of the group (starting at 0), to profile
+        :optional type profile_group: str or int
+        '''
+        self.log_path = log_path
+        self.profile_group = profile_group
+        self.file_name = file_name
+        self.n_groups = 0
+        self.record = None
+        # Time of the nested stages of each open stage, innermost last
+        self.nested = []
+
+    @contextlib.contextmanager
+    def group(self, name, kind='process'):
+        '''
+        Context manager for processing a group, that writes the record of the group at the end
+
+        :param name: name of the group, e.g. base name of the first file
+        :type name: str
+
+        :optional param kind: what is done to the group, e.g. 'process' or 'merge'
+        :optional type kind: str
+        '''
+        outer = self.record
+        self.record = {'kind': kind, 'group': name, 'start': datetime.datetime.now().isoformat(),
+                            'stages': collections.defaultdict(float), 'calls': collections.defaultdict(int),
+                            'counts': collections.defaultdict(int)}
+        profiler = None
+        if self.profile_group is not None and kind == 'process' and self.profile_group in (name, self.n_groups):
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield self.record
+        finally:
+            self.record['seconds'] = time.perf_counter()-start
+            if profiler is not None:
+                profiler.disable()
+                if self.log_path is not None:
+                    profile_name = self.log_path+'profile_{}.prof'.format(name)
+                    profiler.dump_stats(profile_name)
+                    logging.info('Saved profile of group {} to {}'.format(name, profile_name))
+            if kind == 'process':
+                self.n_groups += 1
+            self.write(self.record)
+            self.record = outer
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''
+        Context manager for timing a stage, time of repeated stages is summed in the group record.
+        Time of a stage run inside another (e.g. bottom detection fetched lazily by a filter) is only counted
+        in the inner stage, so the stages of a group do not overlap and sum to no more than the group time.
+        '''
+        start = time.perf_counter()
+        self.nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter()-start
+            nested = self.nested.pop()
+            if self.nested:
+                self.nested[-1] += elapsed
+            if self.record is not None:
+                self.record['stages'][name] += elapsed-nested
+                self.record['calls'][name] += 1
+
+    def count(self, name, n=1):
+        '''
+        Method to add to a counter of the group record, e.g. number of pings read
+        '''
+        if self.record is not None:
+            self.record['counts'][name] += int(n)
+
+    def write(self, record):
+        '''
+        Method to write a group record as one JSON line
+        '''
+        record = dict(record, stages={k: round(v, 6) for k, v in record['stages'].items()},
+                            calls=dict(record['calls']), counts=dict(record['counts']), seconds=round(record['seconds'], 6))
+        line = json.dumps(record)
+        if self.log_path is None:
+            logging.info('Stage times: {}'.format(line))
+            return
+        try:
+            with open(self.log_path+self.file_name, 'a') as f:
+                f.write(line+'\n')
+        except OSError as e:
+            logging.warning('Could not write stage times to {}: {}'.format(self.log_path+self.file_name, e))
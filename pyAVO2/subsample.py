@@ -58,3 +58,53 @@ class Subsample():
             idx_array[starts[j]:stops[j]] = True
         
         return idx_array, starts, stops-1, True
+    
+    def make_bank(self, total_pings):
+        '''
+        Method to precompute the subsample of every offset (100/percent of them) for a data array at once.
+        Offset i starts at ping i*chunk_size, the same as calling subsample with that start ping.
+        The masks are kept bit-packed, one row per offset, with a table of chunk starts and stops.
+        
+        :param total_pings: total number of pings for a data array to subsample
+        :type total_pings: int
+        
+        :returns number of offsets in the bank
+        '''
+        skip = int(self.skip_number)
+        n_offsets = int(np.ceil(self.skip_number/self.chunk_size))
+        
+        # Table of chunk starts by offset (rows) and chunk (columns), marking those past the end as invalid
+        starts = np.arange(n_offsets)[:, None]*self.chunk_size + np.arange(0, total_pings, skip)[None, :]
+        valid = starts < total_pings
+        stops = np.minimum(starts+self.chunk_size, total_pings)
+        
+        # Mark chunk edges and integrate along pings to fill in each chunk
+        rows = np.broadcast_to(np.arange(n_offsets)[:, None], starts.shape)[valid]
+        edges = np.zeros((n_offsets, total_pings+1), dtype=np.int8)
+        np.add.at(edges, (rows, starts[valid]), 1)
+        np.add.at(edges, (rows, stops[valid]), -1)
+        masks = np.cumsum(edges[:, :-1], axis=1, dtype=np.int8) > 0
+        
+        self.bank = {'total_pings': total_pings, 'masks': np.packbits(masks, axis=1), 
+                            'starts': starts, 'stops': stops, 'valid': valid}
+        
+        return n_offsets
+        
+    def subsample_from_bank(self, offset):
+        '''
+        Method to read the subsample of one offset from the bank made by make_bank
+        
+        :param offset: index of the subsample offset (iteration), the start ping is offset*chunk_size
+        :type offset: int
+        
+        :returns idx_array: boolean array with True for pings to keep after subsampling
+        :returns starts, stops: first and last ping of each chunk, as returned by subsample
+        '''
+        if offset >= self.bank['masks'].shape[0] or not self.bank['valid'][offset].any():
+            logging.error('Start ping is larger than total_pings, subsampling not completed')
+            return False, False, False, False
+        
+        idx_array = np.unpackbits(self.bank['masks'][offset], count=self.bank['total_pings']).astype(bool)
+        valid = self.bank['valid'][offset]
+        
+        return idx_array, self.bank['starts'][offset][valid], self.bank['stops'][offset][valid]-1, True
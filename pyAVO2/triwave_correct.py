@@ -1,6 +1,5 @@
 
 import numpy as np
-from scipy import optimize
 import logging
 
 class TriwaveCorrect():
@@ -41,13 +40,42 @@ class TriwaveCorrect():
         :returns val: bool for success of fit
         '''
         
-        L = data_in.n_samples
+        n = self.mean_ringdown(data_in)
+        if n is None:
+            return data_in, False, False
+        fit_results = self.fit_ringdown(n)
+        data_in = self.correct(data_in, fit_results)
+        
+        return data_in, fit_results, True
+        
+    def mean_ringdown(self, data_in):
+        '''
+        Method to compute the linear mean of power between start and end samples of each ping
+        Values of the pings of a group read one file at a time can be joined and fit with fit_ringdown
+        
+        :param data_in: raw data object, which must contain raw power
+        :type data_in: raw_data object derived from pyecholab2 raw_read method
+        
+        :returns n: mean ringdown (log10 of linear power) of each ping, None if there is no raw power
+        :type n: array(float)
+        '''
         try:
-            n = np.log10(np.mean(10**(data_in.power[:,self.start_sample:self.end_sample]), axis=1))
+            return np.log10(np.mean(10**(data_in.power[:,self.start_sample:self.end_sample]), axis=1))
         except NameError:
             logging.error("No raw power defined in raw data object.")
-            return data_in, False, False
-            
+            return None
+        
+    def fit_ringdown(self, n):
+        '''
+        Method to fit a triangle to the mean ringdown of each ping of a group
+        - Fill NaNs with closest earlier neighbor ping
+        - Fit a triangle
+        
+        :param n: mean ringdown of each ping, from mean_ringdown, changed in place
+        :type n: array(float)
+        
+        :returns fit_results: dictionary of parameters of the fit of triangle wave to raw data
+        '''
         # fill nans with closest earlier ping
         nan_inds = np.argwhere(np.isnan(n))
         while np.any(nan_inds):
@@ -74,8 +102,27 @@ class TriwaveCorrect():
         else:
             logging.info("Triangle fit with r^2 of {}".format(fit_results['r_squared']))
         
+        return fit_results
+        
+    def correct(self, data_in, fit_results, first_ping=0):
+        '''
+        Method to correct raw power with the inverse of the fit triangle, centered around 0
+        
+        :param data_in: raw data object, which must contain raw power
+        :type data_in: raw_data object derived from pyecholab2 raw_read method
+        
+        :param fit_results: fit of the triangle, from fit_ringdown
+        :type fit_results: dict
+        
+        :optional param first_ping: index in the group of the first ping of data_in, 
+                                            for a group read one file at a time
+        :optional type first_ping: int
+        
+        :returns data_in: raw data object with corrected raw power
+        '''
+        L = data_in.n_samples
         # Find correction triangle
-        generated_triangle_offset = self.general_triangle(np.arange(data_in.shape[0]), A=fit_results['amplitude'],
+        generated_triangle_offset = self.general_triangle(first_ping+np.arange(data_in.shape[0]), A=fit_results['amplitude'],
                     M=2721.0, k = fit_results['period_offset'], C=0, dtype='float32')
         triangle_matrix_correct = np.array([generated_triangle_offset,]*L).transpose()
         
@@ -83,7 +130,7 @@ class TriwaveCorrect():
         data_in.power = data_in.power - triangle_matrix_correct
         logging.info("Successfully corrected triangle wave noise in raw power data")
         
-        return data_in, fit_results, True
+        return data_in
         
         
     def fit_triangle(self, mean_ringdown_vec, amplitude=None, period_offset=None,
@@ -100,6 +147,7 @@ class TriwaveCorrect():
         is the "R^2" value of the fit (Coefficient of determination)
         
         '''
+        from scipy import optimize
         N = len(mean_ringdown_vec)
         n = np.arange(N)
         
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+test_file_planner is a regression test of pyAVO2.file_planner.plan_groups against the grouping
+loop it replaced in pre-process-AVO.py, for hour and day bins, with and without a start time.
+File names with random start times are grouped by both, and the groups of files must be identical.
+Day bins are compared for one day only, since the old loop only matched the first day of each bin.
+Grouping by a number of files must not need the start times in the file names.
+
+Usage:
+    python -m pytest tests
+"""
+import os, sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyAVO2.file_planner import plan_groups
+
+def make_names(n_files, seed):
+    '''
+    Method to make raw file names with random start times over a few days
+    '''
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2024-06-15T00:00:00')
+    times = start + np.sort(rng.integers(0, 4*86400, n_files)).astype('timedelta64[s]')
+    return ['L0001-D{}-T{}.raw'.format(str(t)[:10].replace('-', ''), str(t)[11:19].replace(':', '')) for t in times]
+
+def old_groups(files, unit, num, start_time=None):
+    '''
+    Method with the grouping loop of pre-process-AVO.py before file_planner
+    '''
+    f_full_dates = []
+    f_dates = []
+    for f in files:
+        d_start = f.find('-D')+2
+        f_date = f[d_start:d_start+8]
+        t_start = f.find('-T')+2
+        f_time = f[t_start:t_start+6]
+        f_full_dates.append(pd.to_datetime(f_date+'-'+f_time))
+        f_dates.append(pd.to_datetime(f_date).date())
+    freq = str(num)+{'hour': 'h', 'day': 'D'}[unit]
+    if unit == 'hour':
+        if start_time:
+            date_range = pd.date_range(pd.to_datetime(start_time[0]+'-'+start_time[1]), np.max(f_full_dates)+pd.to_timedelta(num, unit='h'), None, freq)
+        else:
+            date_range = pd.date_range(np.min(f_full_dates), np.max(f_full_dates)+pd.to_timedelta(num, unit='h'), None, freq)
+    else:
+        if start_time:
+            date_range = pd.date_range(pd.to_datetime(start_time[0]).date(), np.max(f_dates), None, freq)
+        else:
+            date_range = pd.date_range(np.min(f_dates), np.max(f_dates), None, freq)
+    groups = []
+    for i, d in enumerate(date_range):
+        cur_files = []
+        if unit == 'hour':
+            if i == 0:
+                last_date = d
+            else:
+                for ind, full_d in enumerate(f_full_dates):
+                    if full_d >= last_date and full_d < d:
+                        cur_files.append(files[ind])
+                last_date = d
+        else:
+            for ind, date in enumerate(f_dates):
+                if date == pd.to_datetime(d).date():
+                    cur_files.append(files[ind])
+        if cur_files != []:
+            cur_files.sort()
+            groups.append(cur_files)
+
+    return groups
+
+HOUR_CASES = [(n, start) for n in (1, 2, 3, 5, 24) for start in (None, ['20240616', '013000'], ['20240630', '000000'])]
+DAY_STARTS = [None, ['20240616', '000000'], ['20240617', '120000'], ['20240630', '000000']]
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize('num, start_time', HOUR_CASES)
+def test_hour_groups_match_old_loop(num, start_time, seed):
+    files = make_names(200, seed)
+    new = [group['files'] for group in plan_groups(files, 'hour', num, start_time=start_time)]
+    assert new == old_groups(files, 'hour', num, start_time=start_time)
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize('start_time', DAY_STARTS)
+def test_day_groups_match_old_loop(start_time, seed):
+    files = make_names(200, seed)
+    new = [group['files'] for group in plan_groups(files, 'day', 1, start_time=start_time)]
+    assert new == old_groups(files, 'day', 1, start_time=start_time)
+
+def test_file_groups_without_time_stamps():
+    # Names without the -D...-T... stamp are grouped in the order provided, as before file_planner
+    files = ['survey_{:03d}.raw'.format(i) for i in range(7)]
+    groups = plan_groups(files, 'file', 3)
+    assert [group['files'] for group in groups] == [files[0:3], files[3:6], files[6:7]]
+    assert [group['is_last'] for group in groups] == [False, False, True]
+    assert all(group['out_files'] is None for group in groups)
+
+def test_out_files_are_paired_with_raw_files():
+    files = make_names(10, 0)
+    out_files = [files[0].replace('.raw', '.out'), files[5].replace('.raw', '.out')]
+    groups = plan_groups(files, 'file', 5, out_files=out_files)
+    assert [group['out_files'] for group in groups] == [out_files[:1], out_files[1:]]
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+test_stream is a regression test of the pieces of Process.process_stream that do not need echolab2:
+values found a window (file) of pings at a time must be the same as those found for the whole group.
+The reduced echogram built a window at a time is compared with reduce_blocks of the whole Sv, the
+triwave correction of each window with first_ping with the correction of the whole group, and raw
+files joined with join_raw_files with a scan of the parts.
+
+Usage:
+    python -m pytest tests
+"""
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import synthetic_raw
+from pyAVO2 import raw_scan
+from pyAVO2.echogram_renderer import ReducedEchogram, reduce_blocks
+from pyAVO2.triwave_correct import TriwaveCorrect
+
+class PowerData():
+    '''
+    Class with the raw power of some pings, for the triwave correction
+    '''
+
+    def __init__(self, power):
+        self.power = power
+        self.n_samples = power.shape[1]
+        self.shape = power.shape
+
+def windows(n_pings, sizes):
+    '''
+    Method to split n_pings pings into windows of the sizes given, repeated to the last ping
+    '''
+    bounds = [0]
+    i = 0
+    while bounds[-1] < n_pings:
+        bounds.append(min(bounds[-1]+sizes[i % len(sizes)], n_pings))
+        i += 1
+    return list(zip(bounds[:-1], bounds[1:]))
+
+@pytest.mark.parametrize('n_pings, max_pings, method', [(1000, 90, 'mean'), (1000, 90, 'max'), (50, 90, 'mean'), (997, 100, 'mean')])
+def test_reduced_echogram_windows(n_pings, max_pings, method):
+    rng = np.random.default_rng(n_pings)
+    Sv = rng.uniform(-90, -30, (n_pings, 300)).astype(np.float32)
+    ping_time = np.datetime64('2024-06-15T00:00:00', 'ms')+np.arange(n_pings).astype('timedelta64[s]')
+    sample_range = np.arange(300)*0.19
+    reducer = ReducedEchogram(n_pings, max_pings, 40, method=method)
+    for start, stop in windows(n_pings, [137, 61, 250]):
+        reducer.add(Sv[start:stop], ping_time[start:stop], sample_range)
+    values, reduced_time, reduced_range = reducer.finish()
+    ping_step = max(int(np.ceil(n_pings/max_pings)), 1)
+    expected = reduce_blocks(Sv, ping_step, int(np.ceil(300/40)), method=method)
+    np.testing.assert_allclose(values, expected, rtol=1e-5)
+    np.testing.assert_array_equal(reduced_time, ping_time[::ping_step])
+    np.testing.assert_array_equal(reduced_range, sample_range[::int(np.ceil(300/40))])
+
+def test_reduced_echogram_pads_samples():
+    reducer = ReducedEchogram(20, 20, 10)
+    sample_range = np.arange(10)
+    reducer.add(np.zeros((10, 10)), np.arange(10), sample_range)
+    reducer.add(np.zeros((10, 8)), np.arange(10, 20), sample_range[:8])
+    values, ping_time, reduced_range = reducer.finish()
+    assert values.shape == (20, 10)
+    assert np.all(np.isnan(values[10:, 8:]))
+    assert not np.any(np.isnan(values[:, :8]))
+
+def triwave_power(n_pings):
+    '''
+    Method to make raw power with a triangle wave on the ringdown samples, with the period of the EK60 noise
+    '''
+    rng = np.random.default_rng(1)
+    power = rng.normal(50, 0.5, (n_pings, 20))
+    power[:, :5] += 2*np.abs((np.arange(n_pings)[:, None]+400) % synthetic_raw.TRIWAVE_PERIOD/synthetic_raw.TRIWAVE_PERIOD-0.5)
+    return power
+
+def test_triwave_windows():
+    power = triwave_power(3000)
+    correcter = TriwaveCorrect(0, 5)
+    parts = windows(len(power), [1100, 700])
+    # Mean ringdown of each window joined for the group
+    n = np.concatenate([correcter.mean_ringdown(PowerData(power[start:stop])) for start, stop in parts])
+    np.testing.assert_array_equal(n, correcter.mean_ringdown(PowerData(power)))
+    # Each window corrected from its first ping in the group
+    fit_results = {'amplitude': 1.0, 'period_offset': 400.0, 'r_squared': 1.0}
+    whole = correcter.correct(PowerData(power.copy()), fit_results)
+    corrected = np.concatenate([correcter.correct(PowerData(power[start:stop].copy()), fit_results, first_ping=start).power for start, stop in parts])
+    np.testing.assert_array_equal(corrected, whole.power)
+
+def test_triwave_fit_windows():
+    pytest.importorskip('scipy')
+    power = triwave_power(3000)
+    correcter = TriwaveCorrect(0, 5)
+    whole, fit_results, val = correcter.triwave_correct(PowerData(power.copy()))
+    assert val
+    parts = windows(len(power), [1100, 700])
+    n = np.concatenate([correcter.mean_ringdown(PowerData(power[start:stop])) for start, stop in parts])
+    window_fit = correcter.fit_ringdown(n)
+    assert window_fit == fit_results
+    corrected = np.concatenate([correcter.correct(PowerData(power[start:stop].copy()), window_fit, first_ping=start).power for start, stop in parts])
+    np.testing.assert_array_equal(corrected, whole.power)
+
+@pytest.mark.parametrize('instrument', ['EK60', 'EK80'])
+def test_join_raw_files(tmp_path, instrument):
+    raw_files, out_files = synthetic_raw.write_files(str(tmp_path), n_files=3, pings_per_file=40, n_channels=2,
+                                                                        n_samples=50, instrument=instrument)
+    expected = raw_scan.scan_raw(raw_files, synthetic_raw.FREQUENCIES[0])
+    output_file = str(tmp_path/'joined.raw')
+    assert raw_scan.join_raw_files(raw_files+[str(tmp_path/'missing.raw')], output_file)
+    assert not any(os.path.exists(f) for f in raw_files)
+    scan = raw_scan.scan_raw([output_file], synthetic_raw.FREQUENCIES[0])
+    np.testing.assert_array_equal(scan.ping_time, expected.ping_time)
+    np.testing.assert_array_equal(scan.latitude, expected.latitude)
+    # One configuration at the start of the joined file
+    configurations = 0
+    with open(output_file, 'rb') as f:
+        contents = f.read()
+    position = 0
+    while position < len(contents):
+        length, dgram_type, low, high = raw_scan.DATAGRAM_HEADER.unpack_from(contents, position)
+        configurations += raw_scan.is_configuration(dgram_type, contents[position+16:position+16+512])
+        position += length+8
+    assert configurations == 1
+
+def test_join_raw_files_without_parts(tmp_path):
+    assert not raw_scan.join_raw_files([str(tmp_path/'missing.raw')], str(tmp_path/'joined.raw'))